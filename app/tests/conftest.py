@@ -0,0 +1,57 @@
+"""Fixtures shared by the test cases of the web application."""
+
+from json import dumps
+from unittest.mock import AsyncMock, patch
+
+import pytest_asyncio
+from pytest import fixture
+
+from .. import webapp
+
+
+@fixture
+def api_connect():
+    with patch(
+        "aioswitcher.api.SwitcherApi.connect", return_value=AsyncMock()
+    ) as connect:
+        yield connect
+
+
+@fixture
+def api_disconnect():
+    with patch("aioswitcher.api.SwitcherApi.disconnect") as disconnect:
+        yield disconnect
+
+
+@fixture
+def remotes_db_path(tmp_path):
+    path = tmp_path / "irset_db.json"
+    path.write_text(
+        dumps(
+            {
+                remote_id: {"IRSetID": remote_id, "OnOffType": 0, "IRWaveList": []}
+                for remote_id in ("MITS7004", "MITS7005", "TADC7002")
+            }
+        )
+    )
+    return str(path)
+
+
+@fixture
+def create_client(aiohttp_client):
+    async def create(*args, remotes_db_path=None):
+        # without pooling so every request opens its own connection
+        args = webapp.parser.parse_args(["--pool-idle-ttl", "0", *args])
+        app = webapp.create_app(args)
+        if remotes_db_path:
+            app[webapp.APP_REMOTES] = webapp.SwitcherBreezeRemotes(
+                args.remotes_max_entries, remotes_db_path
+            )
+        return await aiohttp_client(app)
+
+    return create
+
+
+@pytest_asyncio.fixture
+async def api_client(create_client):
+    return await create_client()
@@ -1,10 +1,25 @@
 """Test cases for access logger custom implementation."""
 
-from unittest.mock import Mock, patch
+from asyncio import sleep
+from json import loads
+from logging import DEBUG, INFO, LogRecord
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock, patch
 
-from pytest import fixture
+from aiohttp.test_utils import TestServer
+from assertpy import assert_that
+from pytest import fixture, mark
 
-from ..webapp import CustomAccessLogger
+from ..webapp import (
+    ENDPOINT_GET_STATE,
+    KEY_ACCESS,
+    REQUEST_DEVICE_TIMES,
+    CustomAccessLogger,
+    JsonAccessFormatter,
+    JsonAccessLogger,
+    create_app,
+    parser,
+)
 
 
 @fixture
@@ -38,3 +53,81 @@ def test_access_logger_implementation_writing_to_debug_level(
         mock_debug.assert_called_once_with(
             "127.0.0.1 GET /switcher/get_state done in 0.314159s: 200"
         )
+
+
+def test_access_logger_skips_formatting_when_debug_is_disabled(
+    mock_logger, mock_request, mock_response
+):
+    mock_logger.isEnabledFor.return_value = False
+
+    CustomAccessLogger(mock_logger, "").log(mock_request, mock_response, 0.314159)
+    JsonAccessLogger(mock_logger, "").log(mock_request, mock_response, 0.314159)
+
+    mock_logger.debug.assert_not_called()
+
+
+def test_json_access_logger_records_the_device_round_trip_time(
+    mock_logger, mock_request, mock_response
+):
+    mock_request.get = {REQUEST_DEVICE_TIMES: [0.25, 0.5]}.get
+
+    JsonAccessLogger(mock_logger, "").log(mock_request, mock_response, 0.314159)
+
+    mock_logger.debug.assert_called_once_with(
+        "access",
+        extra={
+            KEY_ACCESS: {
+                "remote": "127.0.0.1",
+                "method": "GET",
+                "path": "/switcher/get_state",
+                "status": 200,
+                "duration": 0.314159,
+                "device_duration": 0.75,
+            }
+        },
+    )
+
+
+def test_json_access_formatter_writes_access_records_as_json_lines():
+    sut = JsonAccessFormatter("%(levelname)s - %(message)s")
+    access = LogRecord("aiohttp.access", DEBUG, "", 0, "access", None, None)
+    access.access = {"path": "/switcher/get_state", "status": 200}
+    other = LogRecord("aiohttp.server", INFO, "", 0, "starting server", None, None)
+
+    line = loads(sut.format(access))
+
+    assert_that(line).contains_entry({"path": "/switcher/get_state"}, {"status": 200})
+    assert_that(line).contains_key("time")
+    assert_that(sut.format(other)).is_equal_to("INFO - starting server")
+
+
+@mark.asyncio
+@patch("aioswitcher.api.SwitcherType1Api.get_state")
+async def test_device_round_trip_time_is_logged_for_the_request(
+    api_get_state, mock_logger, aiohttp_client
+):
+    async def slow_device(*args):
+        await sleep(0.05)
+        return SimpleNamespace(state="ON")
+
+    api_get_state.side_effect = slow_device
+    args = parser.parse_args(["--pool-idle-ttl", "0"])
+    server = TestServer(create_app(args))
+    await server.start_server(access_log_class=JsonAccessLogger, access_log=mock_logger)
+    client = await aiohttp_client(server)
+
+    with patch("aioswitcher.api.SwitcherApi.connect", return_value=AsyncMock()), patch(
+        "aioswitcher.api.SwitcherApi.disconnect"
+    ):
+        await client.get(f"{ENDPOINT_GET_STATE}?type=touch&id=ab1c2d&ip=1.2.3.4&key=18")
+
+    # the access is logged once the response was sent
+    for _ in range(100):
+        if mock_logger.debug.called:
+            break
+        await sleep(0.01)
+    access = mock_logger.debug.call_args.kwargs["extra"][KEY_ACCESS]
+    assert_that(access["device_duration"]).is_greater_than_or_equal_to(0.05)
+    assert_that(access["duration"]).is_greater_than_or_equal_to(
+        access["device_duration"]
+    )
@@ -0,0 +1,155 @@
+"""Test cases for the admission control and the per client rate limits."""
+
+from asyncio import Event, create_task, sleep
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from assertpy import assert_that
+from pytest import fixture, mark, raises
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+fake_device_qparams = "type=touch&id=ab1c2d&ip=1.2.3.4&key=18"
+
+
+@fixture
+def slow_device():
+    release = Event()
+
+    async def control_device(*args):
+        await release.wait()
+        return SimpleNamespace(successful=True)
+
+    with patch(
+        "aioswitcher.api.SwitcherType1Api.control_device", side_effect=control_device
+    ):
+        yield release
+
+
+async def test_client_is_rate_limited_by_its_token_bucket():
+    sut = webapp.SwitcherLimiter(rate=2, burst=2)
+
+    with patch.object(webapp, "monotonic", return_value=100):
+        for _ in range(2):
+            with sut.admit("10.0.0.1"):
+                pass
+        with raises(webapp.SwitcherOverloadedError) as error:
+            with sut.admit("10.0.0.1"):
+                pass
+        assert_that(error.value.retry_in).is_equal_to(0.5)
+        with sut.admit("10.0.0.2"):
+            pass
+    with patch.object(webapp, "monotonic", return_value=100.5):
+        # half a second refills one token at two requests per second
+        with sut.admit("10.0.0.1"):
+            pass
+        # the other client's bucket refilled, it is not limited anymore
+        assert_that(sut.stats()["clients"]).is_equal_to(
+            [{webapp.KEY_IP: "10.0.0.1", "tokens": 0}]
+        )
+
+
+async def test_requests_over_the_max_handled_at_once_are_refused():
+    sut = webapp.SwitcherLimiter(max_requests=1)
+
+    with sut.admit("10.0.0.1"):
+        assert_that(sut.stats()).contains_entry({"in_flight": 1})
+        with raises(webapp.SwitcherOverloadedError, match="too many requests"):
+            with sut.admit("10.0.0.2"):
+                pass
+        with sut.admit("10.0.0.2", counted=False):
+            pass
+    with sut.admit("10.0.0.2"):
+        pass
+    assert_that(sut.stats()).contains_entry({"in_flight": 0})
+
+
+async def test_least_recently_seen_client_is_evicted_when_full():
+    sut = webapp.SwitcherLimiter(rate=1, burst=1, max_clients=1)
+
+    with patch.object(webapp, "monotonic", return_value=100):
+        with sut.admit("10.0.0.1"):
+            pass
+        with sut.admit("10.0.0.2"):
+            pass
+        # evicted, the client starts over with a full bucket
+        with sut.admit("10.0.0.1"):
+            pass
+
+
+async def test_workers_admit_their_share_of_the_limits():
+    sut = webapp.SwitcherLimiter(max_requests=5, rate=4, burst=3, workers=2)
+
+    with sut.admit("10.0.0.12"), sut.admit("10.0.0.12"), sut.admit("10.0.0.13"):
+        with raises(webapp.SwitcherOverloadedError):
+            with sut.admit("10.0.0.14"):
+                pass
+
+    assert_that(sut.stats()).contains_entry(
+        {"max_requests": 3}, {"rate": 2.0}, {"burst": 2}, {"workers": 2}
+    )
+
+
+async def test_rate_limited_client_is_answered_429_with_retry_after(create_client):
+    client = await create_client("--rate-limit", "0.5", "--rate-burst", "2")
+
+    statuses = [
+        (await client.get(webapp.ENDPOINT_GET_CACHE_STATS)).status for _ in range(2)
+    ]
+    response = await client.get(webapp.ENDPOINT_GET_CACHE_STATS)
+
+    assert_that(statuses).is_equal_to([200, 200])
+    assert_that(response.status).is_equal_to(429)
+    assert_that(response.headers["Retry-After"]).is_equal_to("2")
+    assert_that(await response.json()).is_equal_to(
+        {"error": "client 127.0.0.1 is rate limited"}
+    )
+    limits = await (await client.get(webapp.ENDPOINT_GET_LIMITS)).json()
+    assert_that(limits["clients"]).is_length(1)
+    metrics = await (await client.get(webapp.ENDPOINT_METRICS)).text()
+    assert_that(metrics).contains('switcher_webapi_rejected_total{limit="client"} 1')
+
+
+async def test_requests_over_the_server_limit_are_answered_429(
+    slow_device, api_connect, api_disconnect, create_client
+):
+    client = await create_client("--max-requests", "1")
+    turn_on = create_task(
+        client.post(f"{webapp.ENDPOINT_TURN_ON}?{fake_device_qparams}")
+    )
+    while not api_connect.called:
+        await sleep(0.01)
+
+    refused = await client.get(webapp.ENDPOINT_GET_CACHE_STATS)
+    limits = await (await client.get(webapp.ENDPOINT_GET_LIMITS)).json()
+    slow_device.set()
+
+    assert_that(refused.status).is_equal_to(429)
+    assert_that(refused.headers["Retry-After"]).is_equal_to("1")
+    assert_that(limits).contains_entry({"in_flight": 1}, {"max_requests": 1})
+    assert_that(limits["devices"]).is_equal_to(
+        [{webapp.KEY_IP: "1.2.3.4", webapp.KEY_DEVICE_ID: "ab1c2d", "queued": 1}]
+    )
+    assert_that((await turn_on).status).is_equal_to(200)
+
+
+async def test_commands_over_the_device_limit_are_answered_429(
+    slow_device, api_connect, api_disconnect, create_client
+):
+    client = await create_client("--max-device-requests", "1")
+    turn_on = create_task(
+        client.post(f"{webapp.ENDPOINT_TURN_ON}?{fake_device_qparams}")
+    )
+    while not api_connect.called:
+        await sleep(0.01)
+
+    refused = await client.post(f"{webapp.ENDPOINT_TURN_OFF}?{fake_device_qparams}")
+    slow_device.set()
+
+    assert_that(refused.status).is_equal_to(429)
+    assert_that(await refused.json()).is_equal_to(
+        {"error": "device ab1c2d has too many commands queued"}
+    )
+    assert_that((await turn_on).status).is_equal_to(200)
@@ -0,0 +1,131 @@
+"""Test cases for the batch endpoint."""
+
+from asyncio import sleep
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest_asyncio
+from aioswitcher.api import Command
+from assertpy import assert_that
+from pytest import mark
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+
+def plug_query(device_id, ip):
+    return {
+        webapp.KEY_TYPE: "plug",
+        webapp.KEY_ID: device_id,
+        webapp.KEY_IP: ip,
+        webapp.KEY_LOGIN_KEY: "18",
+    }
+
+
+@pytest_asyncio.fixture
+async def api_client(create_client):
+    return await create_client("--batch-concurrency", "2")
+
+
+@patch("aioswitcher.api.SwitcherType1Api.get_state")
+@patch("aioswitcher.api.SwitcherType1Api.control_device")
+async def test_batch_returns_per_operation_results_despite_failures(
+    api_control_device, api_get_state, api_connect, api_disconnect, api_client
+):
+    api_control_device.return_value = SimpleNamespace(successful=True)
+    api_get_state.side_effect = Exception("blabla")
+
+    response = await api_client.post(
+        webapp.ENDPOINT_BATCH,
+        json=[
+            {
+                webapp.KEY_ENDPOINT: webapp.ENDPOINT_TURN_OFF,
+                webapp.KEY_QUERY: plug_query("ab1c2d", "1.2.3.4"),
+            },
+            {
+                webapp.KEY_ENDPOINT: webapp.ENDPOINT_GET_STATE,
+                webapp.KEY_QUERY: plug_query("ab1c2e", "1.2.3.5"),
+            },
+            {
+                webapp.KEY_ENDPOINT: webapp.ENDPOINT_TURN_ON,
+                webapp.KEY_QUERY: plug_query("ab1c2f", "1.2.3.6"),
+                webapp.KEY_BODY: {webapp.KEY_MINUTES: "30"},
+            },
+            {webapp.KEY_ENDPOINT: "/switcher/unknown"},
+        ],
+    )
+
+    assert_that(response.status).is_equal_to(200)
+    assert_that(await response.json()).is_equal_to(
+        [
+            {"status": 200, "result": {"successful": True}},
+            {"status": 500, "error": "blabla"},
+            {"status": 200, "result": {"successful": True}},
+            {"status": 500, "error": "unknown batch operation endpoint"},
+        ]
+    )
+    api_control_device.assert_any_call(Command.OFF)
+    api_control_device.assert_any_call(Command.ON, 30)
+
+
+@patch("aioswitcher.api.SwitcherType1Api.control_device")
+async def test_batch_runs_operations_concurrently_up_to_the_limit(
+    api_control_device, api_connect, api_disconnect, api_client
+):
+    running = []
+    max_running = []
+
+    async def control_device(*args):
+        running.append(1)
+        max_running.append(len(running))
+        await sleep(0.01)
+        running.pop()
+        return SimpleNamespace(successful=True)
+
+    api_control_device.side_effect = control_device
+
+    response = await api_client.post(
+        webapp.ENDPOINT_BATCH,
+        json=[
+            {
+                webapp.KEY_ENDPOINT: webapp.ENDPOINT_TURN_OFF,
+                webapp.KEY_QUERY: plug_query(f"ab1c{i:02d}", f"1.2.3.{i}"),
+            }
+            for i in range(6)
+        ],
+    )
+
+    assert_that(await response.json()).is_length(6)
+    assert_that(max(max_running)).is_equal_to(2)
+
+
+async def test_batch_with_faulty_body_post_request(api_client):
+    response = await api_client.post(webapp.ENDPOINT_BATCH, json={"not": "an array"})
+
+    assert_that(response.status).is_equal_to(500)
+    assert_that(await response.json()).contains_entry(
+        {"error": "failed to get operations array from body as json"}
+    )
+
+
+async def test_batch_reports_malformed_operations_as_failed(api_client):
+    response = await api_client.post(
+        webapp.ENDPOINT_BATCH,
+        json=[
+            {webapp.KEY_ENDPOINT: "/nope"},
+            None,
+            "groupie",
+            {
+                webapp.KEY_ENDPOINT: webapp.ENDPOINT_TURN_OFF,
+                webapp.KEY_GROUP: "boilers",
+                webapp.KEY_QUERY: "kitchen_boiler",
+            },
+        ],
+    )
+
+    assert_that(response.status).is_equal_to(200)
+    assert_that(await response.json()).is_equal_to(
+        [{"status": 500, "error": "unknown batch operation endpoint"}] * 3
+        + [{"status": 500, "error": "failed to get group boilers"}]
+    )
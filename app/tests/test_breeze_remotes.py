@@ -0,0 +1,92 @@
+"""Test cases for the breeze remotes cache."""
+
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest_asyncio
+from aioswitcher.api.remotes import SwitcherBreezeRemote
+from aioswitcher.device import (
+    DeviceState,
+    ThermostatFanLevel,
+    ThermostatMode,
+    ThermostatSwing,
+)
+from assertpy import assert_that
+from pytest import mark, raises
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+
+@pytest_asyncio.fixture
+async def api_client(create_client, remotes_db_path):
+    return await create_client(
+        "--remotes-max-entries", "2", remotes_db_path=remotes_db_path
+    )
+
+
+async def test_remotes_database_is_read_once(remotes_db_path):
+    sut = webapp.SwitcherBreezeRemotes(remotes_db_path=remotes_db_path)
+
+    with patch.object(sut, "_load", wraps=sut._load) as load:
+        first = await sut.get("MITS7004")
+        second = await sut.get("MITS7005")
+        again = await sut.get("MITS7004")
+
+    load.assert_called_once()
+    assert_that(first).is_instance_of(SwitcherBreezeRemote)
+    assert_that(first.remote_id).is_equal_to("MITS7004")
+    assert_that(second.remote_id).is_equal_to("MITS7005")
+    assert_that(again).is_same_as(first)
+
+
+async def test_least_recently_used_remote_is_evicted_when_full(remotes_db_path):
+    sut = webapp.SwitcherBreezeRemotes(max_entries=2, remotes_db_path=remotes_db_path)
+    first = await sut.get("MITS7004")
+    second = await sut.get("MITS7005")
+    # using the first remote makes the second one the least recently used
+    await sut.get("MITS7004")
+    await sut.get("TADC7002")
+
+    assert_that(await sut.get("MITS7004")).is_same_as(first)
+    assert_that(await sut.get("MITS7005")).is_not_same_as(second)
+
+
+async def test_unknown_remote_raises_key_error(remotes_db_path):
+    sut = webapp.SwitcherBreezeRemotes(remotes_db_path=remotes_db_path)
+
+    with raises(KeyError):
+        await sut.get("UNKNOWN1")
+
+
+@patch("aioswitcher.api.SwitcherType2Api.control_breeze_device")
+async def test_control_breeze_device_looks_up_the_tables_and_remote(
+    api_control_breeze_device, api_connect, api_disconnect, api_client
+):
+    api_control_breeze_device.return_value = SimpleNamespace(successful=True)
+
+    response = await api_client.patch(
+        f"{webapp.ENDPOINT_CONTROL_BREEZE_DEVICE}?type=breeze&id=3c4d5e&ip=1.2.3.4",
+        json={
+            webapp.KEY_DEVICE_STATE: DeviceState.ON.display,
+            webapp.KEY_THERMOSTAT_MODE: ThermostatMode.COOL.display,
+            webapp.KEY_TARGET_TEMP: "22",
+            webapp.KEY_FAN_LEVEL: ThermostatFanLevel.HIGH.display,
+            webapp.KEY_THERMOSTAT_SWING: ThermostatSwing.ON.display,
+            webapp.KEY_REMOTE_ID: "TADC7002",
+        },
+    )
+
+    assert_that(response.status).is_equal_to(200)
+    remote, *commands = api_control_breeze_device.call_args.args
+    assert_that(remote.remote_id).is_equal_to("TADC7002")
+    assert_that(commands).is_equal_to(
+        [
+            DeviceState.ON,
+            ThermostatMode.COOL,
+            22,
+            ThermostatFanLevel.HIGH,
+            ThermostatSwing.ON,
+        ]
+    )
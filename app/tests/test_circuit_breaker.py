@@ -0,0 +1,163 @@
+"""Test cases for the per-device circuit breaker."""
+
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest_asyncio
+from aioswitcher.device import DeviceType
+from assertpy import assert_that
+from pytest import mark, raises
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+fake_device_key = webapp.DeviceKey(
+    DeviceType.POWER_PLUG, "1.2.3.4", "ab1c2d", "18", None
+)
+fake_device_qparams = "type=plug&id=ab1c2d&ip=1.2.3.4&key=18"
+
+
+def fail(sut, exc=ConnectionRefusedError()):
+    with raises(type(exc)):
+        with sut.guard(fake_device_key):
+            raise exc
+
+
+@pytest_asyncio.fixture
+async def api_client(create_client):
+    return await create_client("--breaker-failures", "2")
+
+
+async def test_breaker_opens_after_consecutive_failures_and_probes_with_backoff():
+    sut = webapp.SwitcherCircuitBreaker(failures=2, backoff=1, max_backoff=3)
+    with patch.object(webapp, "monotonic", return_value=100):
+        fail(sut)
+        fail(sut)
+        with raises(webapp.SwitcherCircuitOpenError):
+            with sut.guard(fake_device_key):
+                pass
+    with patch.object(webapp, "monotonic", return_value=101):
+        # the backoff passed, the probe fails and doubles it
+        fail(sut)
+        assert_that(sut.stats()).is_equal_to(
+            [
+                {
+                    webapp.KEY_IP: "1.2.3.4",
+                    webapp.KEY_DEVICE_ID: "ab1c2d",
+                    webapp.KEY_STATE: "open",
+                    "failures": 3,
+                    "retry_in": 2,
+                }
+            ]
+        )
+    with patch.object(webapp, "monotonic", return_value=103):
+        # the backoff is capped by the max backoff
+        fail(sut)
+        assert_that(sut.stats()[0]).contains_entry({"retry_in": 3})
+    with patch.object(webapp, "monotonic", return_value=106):
+        with sut.guard(fake_device_key):
+            pass
+    assert_that(sut.stats()).is_empty()
+
+
+async def test_only_one_probe_is_let_through_a_half_open_breaker():
+    sut = webapp.SwitcherCircuitBreaker(failures=1, backoff=1)
+    with patch.object(webapp, "monotonic", return_value=100):
+        fail(sut)
+    with patch.object(webapp, "monotonic", return_value=102):
+        with sut.guard(fake_device_key):
+            assert_that(sut.stats()[0]).contains_entry({webapp.KEY_STATE: "half_open"})
+            with raises(webapp.SwitcherCircuitOpenError):
+                with sut.guard(fake_device_key):
+                    pass
+
+
+async def test_refused_commands_do_not_open_the_breaker():
+    sut = webapp.SwitcherCircuitBreaker(failures=1)
+
+    fail(sut, RuntimeError("get state request was not successful"))
+
+    assert_that(sut.stats()).is_empty()
+    with sut.guard(fake_device_key):
+        pass
+
+
+async def test_disabled_breaker_never_opens():
+    sut = webapp.SwitcherCircuitBreaker(failures=0)
+
+    for _ in range(10):
+        fail(sut)
+
+    assert_that(sut.stats()).is_empty()
+
+
+@patch("aioswitcher.api.SwitcherType1Api.get_state")
+async def test_open_breaker_answers_reads_from_the_last_known_state(
+    api_get_state, api_disconnect, api_client
+):
+    api_get_state.return_value = SimpleNamespace(state="ON")
+    get_state_uri = f"{webapp.ENDPOINT_GET_STATE}?{fake_device_qparams}"
+    with patch("aioswitcher.api.SwitcherApi.connect", return_value=AsyncMock()):
+        await api_client.get(get_state_uri)
+
+    with patch(
+        "aioswitcher.api.SwitcherApi.connect", side_effect=OSError("unreachable")
+    ) as api_connect:
+        for _ in range(2):
+            response = await api_client.get(get_state_uri)
+            assert_that(response.status).is_equal_to(500)
+        response = await api_client.get(get_state_uri)
+
+    assert_that(api_connect.call_count).is_equal_to(2)
+    assert_that(await response.json()).is_equal_to({"state": "ON"})
+
+
+@patch("aioswitcher.api.SwitcherType1Api.get_state")
+async def test_write_refused_by_the_open_breaker_keeps_the_last_known_state(
+    api_get_state, api_disconnect, api_client
+):
+    api_get_state.return_value = SimpleNamespace(state="ON")
+    get_state_uri = f"{webapp.ENDPOINT_GET_STATE}?{fake_device_qparams}"
+    with patch("aioswitcher.api.SwitcherApi.connect", return_value=AsyncMock()):
+        await api_client.get(get_state_uri)
+
+    with patch(
+        "aioswitcher.api.SwitcherApi.connect", side_effect=OSError("unreachable")
+    ):
+        for _ in range(2):
+            await api_client.get(get_state_uri)
+        refused = await api_client.post(
+            f"{webapp.ENDPOINT_TURN_OFF}?{fake_device_qparams}"
+        )
+        response = await api_client.get(get_state_uri)
+
+    assert_that(refused.status).is_equal_to(503)
+    assert_that(response.status).is_equal_to(200)
+    assert_that(await response.json()).is_equal_to({"state": "ON"})
+
+
+async def test_open_breaker_fails_commands_fast_with_service_unavailable(
+    api_disconnect, api_client
+):
+    turn_off_uri = f"{webapp.ENDPOINT_TURN_OFF}?{fake_device_qparams}"
+    with patch(
+        "aioswitcher.api.SwitcherApi.connect", side_effect=OSError("unreachable")
+    ) as api_connect:
+        for _ in range(2):
+            response = await api_client.post(turn_off_uri)
+            assert_that(response.status).is_equal_to(500)
+        response = await api_client.post(turn_off_uri)
+
+    assert_that(api_connect.call_count).is_equal_to(2)
+    assert_that(response.status).is_equal_to(503)
+    assert_that(response.headers["Retry-After"]).is_equal_to("1")
+    assert_that(await response.json()).is_equal_to(
+        {"error": "device ab1c2d is unreachable, circuit breaker is open"}
+    )
+
+    breakers = await (await api_client.get(webapp.ENDPOINT_GET_BREAKERS)).json()
+    assert_that(breakers).is_length(1)
+    assert_that(breakers[0]).contains_entry(
+        {webapp.KEY_DEVICE_ID: "ab1c2d"}, {webapp.KEY_STATE: "open"}, {"failures": 2}
+    )
@@ -0,0 +1,259 @@
+"""Test cases for the per-device command queue."""
+
+from asyncio import Event, create_task, gather, sleep
+from fcntl import LOCK_EX, LOCK_NB, flock
+from multiprocessing import Process
+from os import _exit
+
+from aioswitcher.device import DeviceType
+from assertpy import assert_that
+from pytest import mark, raises
+
+from ..webapp import (
+    DeviceKey,
+    SwitcherCircuitBreaker,
+    SwitcherCommandQueue,
+    SwitcherDeviceLocks,
+    SwitcherOverloadedError,
+    SwitcherTimeoutError,
+)
+
+pytestmark = mark.asyncio
+
+fake_device_key = DeviceKey(DeviceType.POWER_PLUG, "1.2.3.4", "ab1c2d", "18", None)
+other_device_key = DeviceKey(DeviceType.POWER_PLUG, "1.2.3.5", "ef3a4b", "18", None)
+
+
+class FakePool:
+    """Connection pool stand-in running commands without a device."""
+
+    def __init__(self):
+        """Initialize the fake pool."""
+        self.executed = []
+        self.reads = []
+
+    async def execute(self, key, command, read=False):
+        """Record and run the command."""
+        self.executed.append(key)
+        self.reads.append(read)
+        return await command(None)
+
+
+async def test_identical_concurrent_reads_share_one_device_round_trip():
+    pool = FakePool()
+    sut = SwitcherCommandQueue(pool)
+    release = Event()
+
+    async def read(_):
+        await release.wait()
+        return "state"
+
+    reads = gather(*[sut.submit(fake_device_key, read, "get_state") for _ in range(10)])
+    await sleep(0)
+    release.set()
+
+    assert_that(await reads).is_equal_to(["state"] * 10)
+    assert_that(pool.executed).is_length(1)
+
+
+async def test_reads_with_different_read_keys_are_not_shared():
+    pool = FakePool()
+    sut = SwitcherCommandQueue(pool)
+
+    async def read(_):
+        return "state"
+
+    await gather(
+        sut.submit(fake_device_key, read, ("get_shutter_state", 0)),
+        sut.submit(fake_device_key, read, ("get_shutter_state", 1)),
+    )
+
+    assert_that(pool.executed).is_length(2)
+
+
+async def test_read_submitted_after_completion_goes_to_the_device_again():
+    pool = FakePool()
+    sut = SwitcherCommandQueue(pool)
+
+    async def read(_):
+        return "state"
+
+    await sut.submit(fake_device_key, read, "get_state")
+    await sut.submit(fake_device_key, read, "get_state")
+
+    assert_that(pool.executed).is_length(2)
+
+
+async def test_only_reads_may_be_sent_again_on_a_fresh_connection():
+    pool = FakePool()
+    sut = SwitcherCommandQueue(pool)
+
+    async def command(_):
+        return "done"
+
+    await sut.submit(fake_device_key, command, "get_state")
+    await sut.submit(fake_device_key, command)
+
+    assert_that(pool.reads).is_equal_to([True, False])
+
+
+async def test_commands_to_the_same_device_run_one_at_a_time_in_order():
+    sut = SwitcherCommandQueue(FakePool())
+    running = []
+    order = []
+
+    def command(name):
+        async def run(_):
+            running.append(name)
+            assert_that(running).is_length(1)
+            await sleep(0.01)
+            order.append(name)
+            running.remove(name)
+
+        return run
+
+    await gather(*[sut.submit(fake_device_key, command(i)) for i in range(5)])
+
+    assert_that(order).is_equal_to([0, 1, 2, 3, 4])
+
+
+async def test_commands_to_different_devices_run_concurrently():
+    sut = SwitcherCommandQueue(FakePool())
+    both_running = Event()
+    running = []
+
+    async def command(_):
+        running.append(1)
+        if len(running) == 2:
+            both_running.set()
+        await both_running.wait()
+
+    await gather(
+        sut.submit(fake_device_key, command), sut.submit(other_device_key, command)
+    )
+
+    assert_that(both_running.is_set()).is_true()
+
+
+async def test_shared_read_failure_is_raised_to_every_caller():
+    sut = SwitcherCommandQueue(FakePool())
+
+    async def read(_):
+        await sleep(0)
+        raise RuntimeError("get state request was not successful")
+
+    results = await gather(
+        sut.submit(fake_device_key, read, "get_state"),
+        sut.submit(fake_device_key, read, "get_state"),
+        return_exceptions=True,
+    )
+
+    assert_that(results).is_length(2)
+    for result in results:
+        assert_that(result).is_instance_of(RuntimeError)
+
+
+async def test_write_failure_does_not_block_the_next_command():
+    sut = SwitcherCommandQueue(FakePool())
+
+    async def failing(_):
+        raise RuntimeError("blabla")
+
+    async def succeeding(_):
+        return "done"
+
+    with raises(RuntimeError):
+        await sut.submit(fake_device_key, failing)
+    assert_that(await sut.submit(fake_device_key, succeeding)).is_equal_to("done")
+
+
+def hold_device_lock(locks, key):
+    """Lock the device the way another worker would, returning the open file."""
+    fd = open(locks.path(key), "a")
+    flock(fd, LOCK_EX | LOCK_NB)
+    return fd
+
+
+async def test_command_waits_for_the_device_lock_held_by_another_worker(tmp_path):
+    locks = SwitcherDeviceLocks(str(tmp_path))
+    sut = SwitcherCommandQueue(FakePool(), locks)
+    held = hold_device_lock(locks, fake_device_key)
+
+    async def command(_):
+        return "done"
+
+    submitted = create_task(sut.submit(fake_device_key, command))
+    await sleep(0.05)
+    assert_that(submitted.done()).is_false()
+
+    held.close()
+    assert_that(await submitted).is_equal_to("done")
+    hold_device_lock(locks, fake_device_key).close()
+
+
+async def test_device_lock_does_not_block_the_other_devices(tmp_path):
+    locks = SwitcherDeviceLocks(str(tmp_path), 0.05)
+    sut = SwitcherCommandQueue(FakePool(), locks)
+    held = hold_device_lock(locks, fake_device_key)
+
+    async def command(_):
+        return "done"
+
+    assert_that(await sut.submit(other_device_key, command)).is_equal_to("done")
+    held.close()
+
+
+def crash_holding_the_device_lock(directory):
+    hold_device_lock(SwitcherDeviceLocks(directory), fake_device_key)
+    _exit(1)
+
+
+async def test_device_lock_of_a_crashed_worker_is_released(tmp_path):
+    sut = SwitcherCommandQueue(FakePool(), SwitcherDeviceLocks(str(tmp_path), 1))
+    crashed = Process(target=crash_holding_the_device_lock, args=(str(tmp_path),))
+    crashed.start()
+    crashed.join()
+
+    async def command(_):
+        return "done"
+
+    assert_that(await sut.submit(fake_device_key, command)).is_equal_to("done")
+
+
+async def test_device_lock_wait_is_bounded_by_the_timeout(tmp_path):
+    locks = SwitcherDeviceLocks(str(tmp_path), 0.05)
+    breaker = SwitcherCircuitBreaker(failures=1)
+    sut = SwitcherCommandQueue(FakePool(), locks, breaker)
+    held = hold_device_lock(locks, fake_device_key)
+
+    async def command(_):
+        return "done"
+
+    with raises(SwitcherTimeoutError, match="device ab1c2d lock timed out"):
+        await sut.submit(fake_device_key, command)
+    # waiting for another worker does not count as a failure of the device
+    assert_that(breaker.stats()).is_empty()
+    held.close()
+    assert_that(await sut.submit(fake_device_key, command)).is_equal_to("done")
+
+
+async def test_commands_over_the_device_limit_are_refused():
+    sut = SwitcherCommandQueue(FakePool(), max_queued=2)
+    release = Event()
+
+    async def write(_):
+        await release.wait()
+        return "done"
+
+    writes = [create_task(sut.submit(fake_device_key, write)) for _ in range(2)]
+    await sleep(0)
+
+    with raises(SwitcherOverloadedError, match="device ab1c2d has too many commands"):
+        await sut.submit(fake_device_key, write)
+    assert_that(await sut.submit(other_device_key, lambda _: sleep(0, "done")))
+    assert_that(sut.stats()).is_equal_to(
+        [{"ip": "1.2.3.4", "device_id": "ab1c2d", "queued": 2}]
+    )
+    release.set()
+    assert_that(await gather(*writes)).is_equal_to(["done", "done"])
+    assert_that(sut.stats()).is_empty()
@@ -0,0 +1,76 @@
+"""Test cases for the conditional reads answered by etag."""
+
+from json import dumps
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+from assertpy import assert_that
+from pytest import mark
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+fake_device_qparams = "type=touch&id=ab1c2d&ip=1.2.3.4&key=18"
+
+
+async def test_unchanged_response_is_encoded_once():
+    encoder = Mock(side_effect=dumps)
+    sut = webapp.SwitcherEncodedResponses(encoder)
+
+    text, etag = sut.encode("get_state", {"state": "ON"})
+    again = sut.encode("get_state", {"state": "ON"})
+    changed = sut.encode("get_state", {"state": "OFF"})
+
+    assert_that(again).is_equal_to((text, etag))
+    assert_that(changed[1]).is_not_equal_to(etag)
+    assert_that(encoder.call_count).is_equal_to(2)
+
+
+async def test_least_recently_used_read_is_evicted_when_full():
+    encoder = Mock(side_effect=dumps)
+    sut = webapp.SwitcherEncodedResponses(encoder, max_entries=1)
+
+    sut.encode("get_state", {"state": "ON"})
+    sut.encode("get_schedules", [])
+    sut.encode("get_state", {"state": "ON"})
+
+    assert_that(encoder.call_count).is_equal_to(3)
+
+
+@patch("aioswitcher.api.SwitcherType1Api.get_state")
+async def test_read_with_a_matching_etag_is_not_modified(
+    api_get_state, api_connect, api_disconnect, api_client
+):
+    api_get_state.return_value = SimpleNamespace(state="ON")
+    get_state_uri = f"{webapp.ENDPOINT_GET_STATE}?{fake_device_qparams}"
+
+    response = await api_client.get(get_state_uri)
+    etag = response.headers["ETag"]
+    assert_that(await response.json()).is_equal_to({"state": "ON"})
+
+    response = await api_client.get(get_state_uri, headers={"If-None-Match": etag})
+    assert_that(response.status).is_equal_to(304)
+    assert_that(response.headers["ETag"]).is_equal_to(etag)
+    assert_that(await response.read()).is_empty()
+
+    api_get_state.return_value = SimpleNamespace(state="OFF")
+    response = await api_client.get(get_state_uri, headers={"If-None-Match": etag})
+    assert_that(response.status).is_equal_to(200)
+    assert_that(response.headers["ETag"]).is_not_equal_to(etag)
+    assert_that(await response.json()).is_equal_to({"state": "OFF"})
+
+
+@patch("aioswitcher.api.SwitcherType1Api.control_device")
+async def test_writes_are_not_tagged(
+    api_control_device, api_connect, api_disconnect, api_client
+):
+    api_control_device.return_value = SimpleNamespace(successful=True)
+
+    response = await api_client.post(
+        f"{webapp.ENDPOINT_TURN_OFF}?{fake_device_qparams}",
+        headers={"If-None-Match": "*"},
+    )
+
+    assert_that(response.status).is_equal_to(200)
+    assert_that(response.headers).does_not_contain_key("ETag")
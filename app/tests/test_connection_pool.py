@@ -0,0 +1,171 @@
+"""Test cases for the device connection pool."""
+
+from asyncio import open_connection, sleep, start_server
+from functools import partial
+from unittest.mock import patch
+
+import pytest_asyncio
+from aioswitcher.device import DeviceType
+from assertpy import assert_that
+from pytest import mark, raises
+
+from ..webapp import DeviceKey, SwitcherConnectionPool
+
+pytestmark = mark.asyncio
+
+fake_device_key = DeviceKey(DeviceType.POWER_PLUG, "1.2.3.4", "ab1c2d", "18", None)
+
+
+class FakeDevice:
+    """Local tcp server echoing packets back, optionally closing after each reply."""
+
+    def __init__(self):
+        """Initialize the fake device."""
+        self.connections = 0
+        self.close_after_reply = False
+
+    async def handle(self, reader, writer):
+        """Echo every packet received on the connection."""
+        self.connections += 1
+        while data := await reader.read(1024):
+            writer.write(data)
+            await writer.drain()
+            if self.close_after_reply:
+                break
+        writer.close()
+
+
+@pytest_asyncio.fixture
+async def fake_device():
+    device = FakeDevice()
+    server = await start_server(device.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    # redirect the api's connections from the device ip to the local server
+    with patch(
+        "aioswitcher.api.open_connection",
+        side_effect=partial(_open_local_connection, port),
+    ):
+        yield device
+    server.close()
+
+
+async def _open_local_connection(local_port, **kwargs):
+    return await open_connection("127.0.0.1", local_port)
+
+
+async def echo(swapi):
+    swapi._writer.write(b"ping")
+    return await swapi._reader.read(1024)
+
+
+async def test_pooled_connection_is_reused_across_commands(fake_device):
+    pool = SwitcherConnectionPool(idle_ttl=30)
+    assert_that(await pool.execute(fake_device_key, echo)).is_equal_to(b"ping")
+    assert_that(await pool.execute(fake_device_key, echo)).is_equal_to(b"ping")
+    assert_that(fake_device.connections).is_equal_to(1)
+    await pool.close()
+
+
+async def test_zero_idle_ttl_opens_a_connection_per_command(fake_device):
+    pool = SwitcherConnectionPool(idle_ttl=0)
+    await pool.execute(fake_device_key, echo)
+    await pool.execute(fake_device_key, echo)
+    assert_that(fake_device.connections).is_equal_to(2)
+    await pool.close()
+
+
+async def test_connection_closed_by_device_is_replaced_transparently(fake_device):
+    fake_device.close_after_reply = True
+    pool = SwitcherConnectionPool(idle_ttl=30)
+    await pool.execute(fake_device_key, echo)
+    # let the event loop process the device closing the socket
+    await sleep(0.05)
+    assert_that(await pool.execute(fake_device_key, echo)).is_equal_to(b"ping")
+    assert_that(fake_device.connections).is_equal_to(2)
+    await pool.close()
+
+
+async def test_failed_read_on_stale_connection_is_retried(fake_device):
+    pool = SwitcherConnectionPool(idle_ttl=30)
+    await pool.execute(fake_device_key, echo)
+    fake_device.close_after_reply = True
+    attempts = []
+
+    async def command(swapi):
+        attempts.append(swapi)
+        response = await echo(swapi)
+        if len(attempts) == 1:
+            # simulate the device dropping the session before answering
+            swapi._reader.feed_eof()
+            raise ConnectionResetError("connection reset by peer")
+        return response
+
+    assert_that(await pool.execute(fake_device_key, command, read=True)).is_equal_to(
+        b"ping"
+    )
+    assert_that(attempts).is_length(2)
+    assert_that(attempts[0]).is_not_same_as(attempts[1])
+    await pool.close()
+
+
+async def test_failed_write_on_stale_connection_is_not_retried(fake_device):
+    pool = SwitcherConnectionPool(idle_ttl=30)
+    await pool.execute(fake_device_key, echo)
+    attempts = []
+
+    async def command(swapi):
+        attempts.append(swapi)
+        await echo(swapi)
+        # the device dropped the session after the write reached it
+        swapi._reader.feed_eof()
+        raise ConnectionResetError("connection reset by peer")
+
+    with raises(ConnectionResetError):
+        await pool.execute(fake_device_key, command)
+    assert_that(attempts).is_length(1)
+    assert_that(fake_device.connections).is_equal_to(1)
+    await pool.close()
+
+
+async def test_failed_command_on_live_connection_is_not_retried(fake_device):
+    pool = SwitcherConnectionPool(idle_ttl=30)
+    attempts = []
+
+    async def command(swapi):
+        attempts.append(swapi)
+        raise RuntimeError("get state request was not successful")
+
+    with raises(RuntimeError):
+        await pool.execute(fake_device_key, command)
+    assert_that(attempts).is_length(1)
+    assert_that(attempts[0].connected).is_false()
+    await pool.close()
+
+
+async def test_idle_connections_are_evicted_after_ttl(fake_device):
+    pool = SwitcherConnectionPool(idle_ttl=0.1)
+    pool.start()
+    connections = []
+
+    async def command(swapi):
+        connections.append(swapi)
+        return await echo(swapi)
+
+    await pool.execute(fake_device_key, command)
+    assert_that(connections[0].connected).is_true()
+    await sleep(0.3)
+    assert_that(connections[0].connected).is_false()
+    await pool.close()
+
+
+async def test_closing_the_pool_disconnects_idle_connections(fake_device):
+    pool = SwitcherConnectionPool(idle_ttl=30)
+    connections = []
+
+    async def command(swapi):
+        connections.append(swapi)
+        return await echo(swapi)
+
+    await pool.execute(fake_device_key, command)
+    await pool.close()
+    assert_that(connections[0].connected).is_false()
@@ -0,0 +1,164 @@
+"""Test cases for referencing devices registered by alias."""
+
+from asyncio import gather
+from json import dumps, loads
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest_asyncio
+from aioswitcher.api import Command
+from aioswitcher.device import DeviceType
+from assertpy import assert_that
+from pytest import fixture, mark, raises
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+kitchen_boiler = {
+    webapp.KEY_TYPE: "touch",
+    webapp.KEY_IP: "1.2.3.4",
+    webapp.KEY_ID: "ab1c2d",
+    webapp.KEY_LOGIN_KEY: "18",
+}
+
+
+@fixture
+def devices_file(tmp_path):
+    path = tmp_path / "devices.json"
+    path.write_text(dumps({"kitchen_boiler": kitchen_boiler}))
+    return path
+
+
+@pytest_asyncio.fixture
+async def api_client(create_client, devices_file):
+    return await create_client("--devices", str(devices_file))
+
+
+async def test_registry_parses_the_loaded_devices_once(devices_file):
+    sut = webapp.SwitcherDeviceRegistry(str(devices_file))
+    sut.load()
+
+    key = sut.get("kitchen_boiler")
+
+    assert_that(key).is_equal_to(
+        webapp.DeviceKey(DeviceType.TOUCH, "1.2.3.4", "ab1c2d", "18", None)
+    )
+    assert_that(sut.get("kitchen_boiler")).is_same_as(key)
+    with raises(ValueError, match="failed to get device unknown from the registry"):
+        sut.get("unknown")
+
+
+async def test_registries_of_the_workers_share_their_edits(devices_file):
+    worker_a = webapp.SwitcherDeviceRegistry(str(devices_file))
+    worker_b = webapp.SwitcherDeviceRegistry(str(devices_file))
+    worker_a.load()
+    worker_b.load()
+    runner = {**kitchen_boiler, webapp.KEY_TYPE: "runner", webapp.KEY_ID: "ef3a4b"}
+
+    await gather(
+        *[worker_a.register(f"boiler_{i}", kitchen_boiler) for i in range(5)],
+        *[worker_b.register(f"runner_{i}", runner) for i in range(5)],
+    )
+    await worker_b.unregister("kitchen_boiler")
+
+    expected = {f"boiler_{i}" for i in range(5)} | {f"runner_{i}" for i in range(5)}
+    assert_that(set(loads(devices_file.read_text()))).is_equal_to(expected)
+    assert_that(set(worker_a.descriptors())).is_equal_to(expected)
+    assert_that(worker_a.get("runner_0").device_id).is_equal_to("ef3a4b")
+    with raises(ValueError, match="failed to get device kitchen_boiler"):
+        worker_a.get("kitchen_boiler")
+    assert_that(list(devices_file.parent.glob("devices.json.*"))).is_equal_to(
+        [devices_file.parent / "devices.json.lock"]
+    )
+
+
+async def test_registry_without_a_file_starts_empty(tmp_path):
+    sut = webapp.SwitcherDeviceRegistry(str(tmp_path / "missing.json"))
+    sut.load()
+
+    assert_that(sut.descriptors()).is_empty()
+
+
+@patch("aioswitcher.api.SwitcherType1Api.get_state")
+async def test_get_state_of_a_device_referenced_by_alias(
+    api_get_state, api_connect, api_disconnect, api_client
+):
+    api_get_state.return_value = SimpleNamespace(state="ON")
+
+    response = await api_client.get(
+        f"{webapp.ENDPOINT_GET_STATE}?{webapp.KEY_DEVICE}=kitchen_boiler"
+    )
+
+    assert_that(response.status).is_equal_to(200)
+    assert_that(await response.json()).is_equal_to({"state": "ON"})
+
+
+@patch("aioswitcher.api.SwitcherType2Api.control_device")
+async def test_registered_device_is_saved_and_usable_in_a_batch(
+    api_control_device, api_connect, api_disconnect, api_client, devices_file
+):
+    api_control_device.return_value = SimpleNamespace(successful=True)
+    living_room_runner = {
+        webapp.KEY_TYPE: "runner",
+        webapp.KEY_IP: "1.2.3.5",
+        webapp.KEY_ID: "ef3a4b",
+        webapp.KEY_TOKEN: "zvVvd7JxtN7CgvkD1Psujw==",
+    }
+
+    response = await api_client.put(
+        f"{webapp.ENDPOINT_DEVICES}?{webapp.KEY_DEVICE}=living_room_runner",
+        json=living_room_runner,
+    )
+    assert_that(response.status).is_equal_to(200)
+    assert_that(await response.json()).is_equal_to(living_room_runner)
+
+    response = await api_client.post(
+        webapp.ENDPOINT_BATCH,
+        json=[
+            {
+                webapp.KEY_ENDPOINT: webapp.ENDPOINT_TURN_ON,
+                webapp.KEY_QUERY: {webapp.KEY_DEVICE: "living_room_runner"},
+            }
+        ],
+    )
+    assert_that(await response.json()).is_equal_to(
+        [{"status": 200, "result": {"successful": True}}]
+    )
+    api_control_device.assert_called_once_with(Command.ON, 0)
+
+    devices = await (await api_client.get(webapp.ENDPOINT_DEVICES)).json()
+    expected = {
+        "kitchen_boiler": kitchen_boiler,
+        "living_room_runner": living_room_runner,
+    }
+    assert_that(devices).is_equal_to(expected)
+    assert_that(loads(devices_file.read_text())).is_equal_to(expected)
+
+
+async def test_unregistered_device_is_removed_from_the_file(api_client, devices_file):
+    response = await api_client.delete(
+        f"{webapp.ENDPOINT_DEVICES}?{webapp.KEY_DEVICE}=kitchen_boiler"
+    )
+
+    assert_that(response.status).is_equal_to(200)
+    assert_that(loads(devices_file.read_text())).is_empty()
+    response = await api_client.get(
+        f"{webapp.ENDPOINT_GET_STATE}?{webapp.KEY_DEVICE}=kitchen_boiler"
+    )
+    assert_that(response.status).is_equal_to(500)
+    assert_that(await response.json()).is_equal_to(
+        {"error": "failed to get device kitchen_boiler from the registry"}
+    )
+
+
+async def test_register_device_with_faulty_descriptor(api_client):
+    response = await api_client.put(
+        f"{webapp.ENDPOINT_DEVICES}?{webapp.KEY_DEVICE}=garden_plug",
+        json={webapp.KEY_TYPE: "toaster", webapp.KEY_IP: "1.2.3.6"},
+    )
+
+    assert_that(response.status).is_equal_to(500)
+    assert_that(await response.json()).is_equal_to(
+        {"error": "failed to get type, ip and id of device garden_plug"}
+    )
@@ -0,0 +1,147 @@
+"""Test cases for discovering the devices by their udp broadcasts."""
+
+from asyncio import create_task, sleep
+from socket import AF_INET, SOCK_DGRAM, socket
+
+import pytest_asyncio
+from assertpy import assert_that
+from pytest import fixture, mark
+
+from .. import webapp
+from .test_state_bridge import breeze_broadcast_packet, touch_broadcast_packet
+
+pytestmark = mark.asyncio
+
+touch_descriptor = {
+    webapp.KEY_TYPE: "touch",
+    webapp.KEY_IP: "192.168.1.33",
+    webapp.KEY_ID: "ab1c2d",
+    webapp.KEY_LOGIN_KEY: "18",
+    webapp.KEY_NAME: "Kitchen Boiler",
+}
+
+
+@fixture
+def broadcast_port():
+    with socket(AF_INET, SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest_asyncio.fixture
+async def api_client(create_client, broadcast_port, tmp_path):
+    return await create_client(
+        "--bridge-ports",
+        str(broadcast_port),
+        "--devices",
+        str(tmp_path / "devices.json"),
+    )
+
+
+async def broadcast(port, *packets, repeat=20):
+    # devices broadcast every few seconds, repeated until the scan binds the port
+    with socket(AF_INET, SOCK_DGRAM) as sock:
+        for _ in range(repeat):
+            for packet in packets:
+                sock.sendto(packet, ("127.0.0.1", port))
+            await sleep(0.02)
+
+
+def without_last_seen(devices):
+    return [
+        {k: v for k, v in device.items() if k != webapp.KEY_LAST_SEEN}
+        for device in devices
+    ]
+
+
+async def test_discover_returns_deduplicated_devices_seen_in_the_window(
+    api_client, broadcast_port
+):
+    broadcasting = create_task(
+        broadcast(
+            broadcast_port,
+            touch_broadcast_packet,
+            breeze_broadcast_packet,
+            touch_broadcast_packet,
+        )
+    )
+
+    response = await api_client.get(f"{webapp.ENDPOINT_DISCOVER}?window=0.3")
+    await broadcasting
+
+    assert_that(response.status).is_equal_to(200)
+    devices = await response.json()
+    assert_that(without_last_seen(devices)).is_equal_to(
+        [
+            touch_descriptor,
+            {
+                webapp.KEY_TYPE: "breeze",
+                webapp.KEY_IP: "192.168.1.34",
+                webapp.KEY_ID: "3c4d5e",
+                webapp.KEY_LOGIN_KEY: "00",
+                webapp.KEY_NAME: "Living Room AC",
+            },
+        ]
+    )
+    for device in devices:
+        assert_that(device[webapp.KEY_LAST_SEEN]).is_instance_of(float)
+
+
+async def test_concurrent_discoveries_share_one_scan(api_client, broadcast_port):
+    broadcasting = create_task(broadcast(broadcast_port, touch_broadcast_packet))
+
+    responses = [
+        create_task(api_client.get(f"{webapp.ENDPOINT_DISCOVER}?window=0.3"))
+        for _ in range(3)
+    ]
+    await broadcasting
+
+    for response in responses:
+        devices = await (await response).json()
+        assert_that(without_last_seen(devices)).is_equal_to([touch_descriptor])
+
+
+async def test_discovered_devices_are_registered_by_their_name(
+    api_client, broadcast_port
+):
+    broadcasting = create_task(broadcast(broadcast_port, touch_broadcast_packet))
+
+    response = await api_client.get(
+        f"{webapp.ENDPOINT_DISCOVER}?window=0.3&{webapp.KEY_REGISTER}=true"
+    )
+    await broadcasting
+
+    devices = await response.json()
+    assert_that(devices[0]).contains_entry({webapp.KEY_DEVICE: "kitchen_boiler"})
+    registered = await (await api_client.get(webapp.ENDPOINT_DEVICES)).json()
+    assert_that(registered).is_equal_to(
+        {
+            "kitchen_boiler": {
+                webapp.KEY_TYPE: "touch",
+                webapp.KEY_IP: "192.168.1.33",
+                webapp.KEY_ID: "ab1c2d",
+                webapp.KEY_LOGIN_KEY: "18",
+            }
+        }
+    )
+
+
+async def test_discover_answers_from_the_running_bridge(aiohttp_client, broadcast_port):
+    args = ["--bridge", "--bridge-ports", str(broadcast_port)]
+    client = await aiohttp_client(webapp.create_app(webapp.parser.parse_args(args)))
+    await broadcast(broadcast_port, touch_broadcast_packet, repeat=3)
+
+    response = await client.get(f"{webapp.ENDPOINT_DISCOVER}?window=60")
+
+    assert_that(without_last_seen(await response.json())).is_equal_to(
+        [touch_descriptor]
+    )
+
+
+async def test_discover_with_faulty_window(api_client):
+    response = await api_client.get(f"{webapp.ENDPOINT_DISCOVER}?window=soon")
+
+    assert_that(response.status).is_equal_to(500)
+    assert_that(await response.json()).is_equal_to(
+        {"error": "failed to get window from query as seconds"}
+    )
@@ -0,0 +1,212 @@
+"""Test cases for the idempotent writes by their idempotency key."""
+
+from asyncio import Event, create_task, gather, sleep, wait_for
+from fcntl import LOCK_EX, LOCK_NB, flock
+from hashlib import sha256
+from os import utime
+from time import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from aioswitcher.api import Command
+from assertpy import assert_that
+from pytest import mark, raises
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+fake_device_qparams = "type=touch&id=ab1c2d&ip=1.2.3.4&key=18"
+
+
+class FakeWrite:
+    """Device write stand-in counting its calls."""
+
+    def __init__(self, delay=0, fail=False):
+        """Initialize the fake write."""
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    async def __call__(self):
+        """Count the call and answer its number."""
+        self.calls += 1
+        await sleep(self.delay)
+        if self.fail:
+            raise OSError("device is unreachable")
+        return {"call": self.calls}
+
+
+async def test_repeated_key_replays_the_original_result():
+    sut = webapp.SwitcherIdempotentWrites()
+    write = FakeWrite()
+
+    first = await sut.run("retry-1", "turn_on", write)
+    second = await sut.run("retry-1", "turn_on", write)
+    other = await sut.run("retry-2", "turn_on", write)
+
+    assert_that(first).is_equal_to(({"call": 1}, False))
+    assert_that(second).is_equal_to(({"call": 1}, True))
+    assert_that(other).is_equal_to(({"call": 2}, False))
+
+
+async def test_repeated_key_in_flight_waits_for_the_first_write():
+    sut = webapp.SwitcherIdempotentWrites()
+    write = FakeWrite(delay=0.05)
+
+    results = await gather(*(sut.run("retry-1", "turn_on", write) for _ in range(3)))
+
+    assert_that(write.calls).is_equal_to(1)
+    assert_that([result for result, _ in results]).is_equal_to([{"call": 1}] * 3)
+
+
+async def test_failed_write_is_run_again_on_retry():
+    sut = webapp.SwitcherIdempotentWrites()
+    write = FakeWrite(fail=True)
+
+    for _ in range(2):
+        with raises(OSError):
+            await sut.run("retry-1", "turn_on", write)
+
+    assert_that(write.calls).is_equal_to(2)
+
+
+async def test_keys_expire_after_the_ttl_and_are_evicted_when_full():
+    sut = webapp.SwitcherIdempotentWrites(ttl=10, max_entries=1)
+    write = FakeWrite()
+
+    with patch.object(webapp, "monotonic", return_value=100):
+        await sut.run("retry-1", "turn_on", write)
+    with patch.object(webapp, "monotonic", return_value=111):
+        assert_that(await sut.run("retry-1", "turn_on", write)).is_equal_to(
+            ({"call": 2}, False)
+        )
+        await sut.run("retry-2", "turn_on", write)
+        await sut.run("retry-1", "turn_on", write)
+
+    assert_that(write.calls).is_equal_to(4)
+
+
+async def test_key_reused_for_another_write_is_refused():
+    sut = webapp.SwitcherIdempotentWrites()
+    await sut.run("retry-1", "turn_on", FakeWrite())
+
+    with raises(ValueError, match="failed to replay Idempotency-Key retry-1"):
+        await sut.run("retry-1", "turn_off", FakeWrite())
+
+
+async def test_retry_reaching_another_worker_replays_the_result(tmp_path):
+    worker_a = webapp.SwitcherIdempotentWrites(directory=str(tmp_path))
+    worker_b = webapp.SwitcherIdempotentWrites(directory=str(tmp_path))
+    write = FakeWrite(delay=0.05)
+
+    results = await gather(
+        worker_a.run("retry-1", "turn_on", write),
+        worker_b.run("retry-1", "turn_on", write),
+    )
+    retried = await worker_b.run("retry-1", "turn_on", write)
+
+    assert_that(write.calls).is_equal_to(1)
+    assert_that(sorted(replayed for _, replayed in results)).is_equal_to([False, True])
+    assert_that(retried).is_equal_to(({"call": 1}, True))
+    with raises(ValueError, match="failed to replay Idempotency-Key retry-1"):
+        await webapp.SwitcherIdempotentWrites(directory=str(tmp_path)).run(
+            "retry-1", "turn_off", write
+        )
+
+
+async def test_failed_write_is_run_again_by_another_worker(tmp_path):
+    failing = FakeWrite(fail=True)
+    with raises(OSError):
+        await webapp.SwitcherIdempotentWrites(directory=str(tmp_path)).run(
+            "retry-1", "turn_on", failing
+        )
+
+    write = FakeWrite()
+    result = await webapp.SwitcherIdempotentWrites(directory=str(tmp_path)).run(
+        "retry-1", "turn_on", write
+    )
+
+    assert_that(result).is_equal_to(({"call": 1}, False))
+
+
+async def test_writes_of_other_keys_do_not_wait_for_each_other(tmp_path):
+    worker_a = webapp.SwitcherIdempotentWrites(directory=str(tmp_path))
+    worker_b = webapp.SwitcherIdempotentWrites(directory=str(tmp_path))
+    release = Event()
+
+    async def hung_write():
+        await release.wait()
+        return "done"
+
+    hung = create_task(worker_a.run("retry-1", "turn_on", hung_write))
+    await sleep(0.01)
+
+    result = await wait_for(worker_b.run("retry-2", "turn_on", FakeWrite()), 1)
+
+    assert_that(result).is_equal_to(({"call": 1}, False))
+    release.set()
+    assert_that(await hung).is_equal_to(("done", False))
+
+
+async def test_expired_results_and_their_unheld_locks_are_swept(tmp_path):
+    sut = webapp.SwitcherIdempotentWrites(ttl=10, directory=str(tmp_path))
+    await sut.run("retry-1", "turn_on", FakeWrite())
+    await sut.run("retry-2", "turn_on", FakeWrite())
+    for path in tmp_path.iterdir():
+        utime(path, (time() - 20, time() - 20))
+    digest = sha256(b"retry-2").hexdigest()
+    lock = open(tmp_path / f"{digest}.lock")
+    flock(lock, LOCK_EX | LOCK_NB)
+
+    sut._sweep()
+
+    assert_that(sorted(path.name for path in tmp_path.iterdir())).is_equal_to(
+        [f"{digest}.json", f"{digest}.lock"]
+    )
+    lock.close()
+
+
+@patch("aioswitcher.api.SwitcherType1Api.create_schedule")
+async def test_retried_create_schedule_creates_one_schedule(
+    api_create_schedule, api_connect, api_disconnect, api_client
+):
+    async def slow_device(*args):
+        await sleep(0.05)
+        return SimpleNamespace(successful=True)
+
+    api_create_schedule.side_effect = slow_device
+    uri = f"{webapp.ENDPOINT_CREATE_SCHEDULE}?{fake_device_qparams}"
+    body = {webapp.KEY_START: "18:00", webapp.KEY_STOP: "19:00"}
+    headers = {webapp.HEADER_IDEMPOTENCY_KEY: "evening-boiler"}
+
+    first, in_flight = await gather(
+        api_client.post(uri, json=body, headers=headers),
+        create_task(api_client.post(uri, json=body, headers=headers)),
+    )
+    retried = await api_client.post(uri, json=body, headers=headers)
+
+    api_create_schedule.assert_called_once()
+    for response in (first, in_flight, retried):
+        assert_that(response.status).is_equal_to(200)
+        assert_that(await response.json()).is_equal_to({"successful": True})
+    replays = [
+        response.headers.get(webapp.HEADER_IDEMPOTENT_REPLAYED)
+        for response in (first, in_flight, retried)
+    ]
+    # whichever concurrent request came first wrote, the others were replayed
+    assert_that(replays[2]).is_equal_to("true")
+    assert_that(replays[:2]).contains_only(None, "true").contains(None, "true")
+
+
+@patch("aioswitcher.api.SwitcherType1Api.control_device")
+async def test_writes_without_a_key_are_sent_every_time(
+    api_control_device, api_connect, api_disconnect, api_client
+):
+    api_control_device.return_value = SimpleNamespace(successful=True)
+
+    for _ in range(2):
+        await api_client.post(f"{webapp.ENDPOINT_TURN_ON}?{fake_device_qparams}")
+
+    assert_that(api_control_device.call_count).is_equal_to(2)
+    api_control_device.assert_called_with(Command.ON, 0)
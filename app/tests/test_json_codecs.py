@@ -0,0 +1,59 @@
+"""Test cases for the pluggable json codecs."""
+
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+from aioswitcher.api import Command
+from assertpy import assert_that
+from pytest import mark
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+fake_device_qparams = "type=touch&id=ab1c2d&ip=1.2.3.4&key=18"
+
+
+@mark.parametrize("codec", sorted(webapp.JSON_CODECS))
+async def test_codec_round_trips_realistic_payloads(codec):
+    sut = webapp.JSON_CODECS[codec]
+    payload = {
+        "state": "ON",
+        "time_left": "00:30:00",
+        "power_consumption": 2100,
+        "electric_current": 9.5,
+        "schedules": [{"schedule_id": "1", "days": ["MONDAY", "FRIDAY"]}],
+    }
+
+    encoded = sut.dumps(payload)
+
+    assert_that(encoded).is_instance_of(str)
+    assert_that(sut.loads(encoded)).is_equal_to(payload)
+    assert_that(sut.loads(encoded.encode())).is_equal_to(payload)
+
+
+@mark.parametrize("codec", sorted(webapp.JSON_CODECS))
+@patch("aioswitcher.api.SwitcherType1Api.control_device")
+async def test_request_bodies_and_responses_use_the_selected_codec(
+    api_control_device, codec, api_connect, api_disconnect, aiohttp_client
+):
+    api_control_device.return_value = SimpleNamespace(successful=True)
+    args = webapp.parser.parse_args(["--pool-idle-ttl", "0", "--json", codec])
+    app = webapp.create_app(args)
+    selected = app[webapp.APP_JSON]
+    assert_that(selected).is_same_as(webapp.JSON_CODECS[codec])
+    app[webapp.APP_JSON] = spy = webapp.JsonCodec(
+        Mock(wraps=selected.dumps), Mock(wraps=selected.loads)
+    )
+    api_client = await aiohttp_client(app)
+
+    response = await api_client.post(
+        f"{webapp.ENDPOINT_TURN_ON}?{fake_device_qparams}",
+        json={webapp.KEY_MINUTES: "15"},
+    )
+
+    assert_that(response.status).is_equal_to(200)
+    assert_that(await response.json()).is_equal_to({"successful": True})
+    api_control_device.assert_called_once_with(Command.ON, 15)
+    spy.loads.assert_called_once()
+    spy.dumps.assert_called_once_with({"successful": True})
@@ -0,0 +1,82 @@
+"""Test cases for configuring the loggers of the server process."""
+
+from logging import Logger, root
+from logging.handlers import QueueHandler
+from threading import current_thread, main_thread
+
+from assertpy import assert_that
+from pytest import fixture
+
+from .. import webapp
+
+
+class RecordingStream:
+    """Stream stand-in recording the lines written and the threads writing them."""
+
+    def __init__(self):
+        """Initialize the recording stream."""
+        self.lines = []
+        self.threads = set()
+
+    def write(self, text):
+        """Record the text and the thread writing it."""
+        self.threads.add(current_thread())
+        self.lines.extend(line for line in text.splitlines() if line)
+
+    def flush(self):
+        """Nothing is buffered."""
+
+
+def configure_logging(log_level, stream):
+    listener = webapp._configure_logging(log_level)
+    # pytest swaps sys.stderr between the test phases, point the handler at the stream
+    listener.handlers[0].setStream(stream)
+    return listener
+
+
+@fixture(autouse=True)
+def restored_loggers():
+    handlers, level = root.handlers[:], root.level
+    # dictConfig disables the loggers it is not given and sets the levels
+    loggers = [
+        (logger, logger.level, logger.disabled)
+        for logger in root.manager.loggerDict.values()
+        if isinstance(logger, Logger)
+    ]
+    yield
+    root.handlers, root.level = handlers, level
+    for logger, level, disabled in loggers:
+        logger.level, logger.disabled = level, disabled
+
+
+def test_root_logger_hands_its_records_to_a_queue():
+    listener = configure_logging("INFO", RecordingStream())
+    try:
+        assert_that(root.handlers).is_length(1)
+        assert_that(root.handlers[0]).is_instance_of(QueueHandler)
+        assert_that(root.handlers[0].queue).is_same_as(listener.queue)
+    finally:
+        listener.stop()
+
+
+def test_records_are_written_from_the_listener_thread():
+    stream = RecordingStream()
+    listener = configure_logging("INFO", stream)
+    webapp.server_logger.info("starting server")
+    listener.stop()
+
+    assert_that(stream.lines).is_length(1)
+    assert_that(stream.lines[0]).contains("starting server")
+    assert_that(stream.threads).is_length(1)
+    assert_that(stream.threads).does_not_contain(main_thread())
+
+
+def test_stopping_the_listener_flushes_the_queued_records():
+    stream = RecordingStream()
+    listener = configure_logging("DEBUG", stream)
+    for i in range(1000):
+        webapp.server_logger.debug(f"record {i}")
+    listener.stop()
+
+    assert_that(stream.lines).is_length(1000)
+    assert_that(stream.lines[-1]).contains("record 999")
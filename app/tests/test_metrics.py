@@ -0,0 +1,138 @@
+"""Test cases for the prometheus metrics."""
+
+from asyncio import sleep
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from aioswitcher.device import DeviceType
+from assertpy import assert_that
+from pytest import mark, raises
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+fake_device_key = webapp.DeviceKey(
+    DeviceType.POWER_PLUG, "1.2.3.4", "ab1c2d", "18", None
+)
+fake_device_qparams = "type=plug&id=ab1c2d&ip=1.2.3.4&key=18"
+
+
+async def test_histogram_renders_cumulative_buckets():
+    sut = webapp.Histogram("latency_seconds", "Latency.", ("route",), (0.1, 1.0))
+    sut.observe(0.05, "/a")
+    sut.observe(0.1, "/a")
+    sut.observe(5, "/a")
+
+    assert_that(sut.samples()).is_equal_to(
+        [
+            'latency_seconds_bucket{route="/a",le="0.1"} 2',
+            'latency_seconds_bucket{route="/a",le="1.0"} 2',
+            'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+            'latency_seconds_sum{route="/a"} 5.15',
+            'latency_seconds_count{route="/a"} 3',
+        ]
+    )
+
+
+async def test_counter_and_gauge_render_escaped_labels():
+    counter = webapp.Counter("errors_total", "Errors.", ("exception",))
+    counter.inc('Bad"Error\\')
+    counter.inc('Bad"Error\\', amount=2)
+    gauge = webapp.Gauge("in_flight", "In flight.")
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+
+    assert_that(counter.samples()).is_equal_to(
+        ['errors_total{exception="Bad\\"Error\\\\"} 3.0']
+    )
+    assert_that(gauge.samples()).is_equal_to(["in_flight 1.0"])
+
+
+@patch("aioswitcher.api.SwitcherType1Api._login")
+async def test_pool_times_the_login_apart_from_the_command(
+    api_login, api_connect, api_disconnect
+):
+    async def login():
+        await sleep(0.05)
+        return "timestamp", SimpleNamespace(successful=True)
+
+    async def command(swapi):
+        await swapi._login()
+        return "done"
+
+    api_login.side_effect = login
+    metrics = webapp.SwitcherMetrics()
+    sut = webapp.SwitcherConnectionPool(metrics=metrics)
+
+    assert_that(await sut.execute(fake_device_key, command)).is_equal_to("done")
+
+    duration = metrics.device_duration
+    for phase in ("connect", "login", "command"):
+        assert_that(duration.count("ab1c2d", phase)).is_equal_to(1)
+    command_seconds = duration._series[("ab1c2d", "command")][1][0]
+    login_seconds = duration._series[("ab1c2d", "login")][1][0]
+    assert_that(login_seconds).is_greater_than_or_equal_to(0.05)
+    assert_that(command_seconds).is_less_than(0.05)
+    assert_that(metrics.device_in_flight.value("ab1c2d")).is_zero()
+
+
+async def test_metric_without_samples_cannot_be_created():
+    with raises(TypeError):
+        webapp.Metric("untyped", "Untyped.")
+
+
+async def test_devices_past_the_max_share_the_other_label(api_connect, api_disconnect):
+    metrics = webapp.SwitcherMetrics(max_devices=2)
+    sut = webapp.SwitcherConnectionPool(metrics=metrics)
+
+    async def command(swapi):
+        return "done"
+
+    for device_id in ("ab1c2d", "ef3a4b", "0a1b2c", "3d4e5f", "ab1c2d"):
+        await sut.execute(fake_device_key._replace(device_id=device_id), command)
+
+    duration = metrics.device_duration
+    assert_that(duration.count("ab1c2d", "command")).is_equal_to(2)
+    assert_that(duration.count("ef3a4b", "command")).is_equal_to(1)
+    assert_that(duration.count("other", "command")).is_equal_to(2)
+    assert_that({labels[0] for labels in duration._series}).is_equal_to(
+        {"ab1c2d", "ef3a4b", "other"}
+    )
+
+
+@patch("aioswitcher.api.SwitcherType1Api.get_state")
+async def test_metrics_endpoint_reports_requests_devices_and_errors(
+    api_get_state, api_connect, api_disconnect, api_client
+):
+    api_get_state.return_value = SimpleNamespace(state="ON")
+    await api_client.get(f"{webapp.ENDPOINT_GET_STATE}?{fake_device_qparams}")
+    api_get_state.side_effect = RuntimeError("get state request was not successful")
+    await api_client.get(f"{webapp.ENDPOINT_GET_STATE}?{fake_device_qparams}")
+    await api_client.get("/not/a/route")
+
+    response = await api_client.get(webapp.ENDPOINT_METRICS)
+
+    assert_that(response.status).is_equal_to(200)
+    assert_that(response.headers["Content-Type"]).starts_with("text/plain")
+    text = await response.text()
+    assert_that(text).contains(
+        "# TYPE switcher_webapi_requests_total counter",
+        'switcher_webapi_requests_total{route="/switcher/get_state",method="GET",'
+        'status="200"} 1.0',
+        'switcher_webapi_requests_total{route="/switcher/get_state",method="GET",'
+        'status="500"} 1.0',
+        # the error middleware answers unmatched routes with 500 too
+        'switcher_webapi_requests_total{route="unmatched",method="GET",'
+        'status="500"} 1.0',
+        'switcher_webapi_errors_total{exception="HTTPNotFound"} 1.0',
+        'switcher_webapi_request_duration_seconds_count{route="/switcher/get_state",'
+        'method="GET",status="200"} 1',
+        'switcher_webapi_errors_total{exception="RuntimeError"} 1.0',
+        'switcher_webapi_device_duration_seconds_count{device="ab1c2d",'
+        'phase="connect"} 2',
+        'switcher_webapi_device_errors_total{device="ab1c2d",'
+        'exception="RuntimeError"} 1.0',
+        'switcher_webapi_requests_in_flight{route="/metrics"} 1.0',
+    )
@@ -0,0 +1,188 @@
+"""Test cases for polling the state of the registered devices."""
+
+from asyncio import sleep
+from itertools import count
+from json import dumps
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest_asyncio
+from assertpy import assert_that
+from pytest import fixture, mark
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+kitchen_boiler = {
+    webapp.KEY_TYPE: "touch",
+    webapp.KEY_IP: "1.2.3.4",
+    webapp.KEY_ID: "ab1c2d",
+}
+
+
+class FakeQueue:
+    """Command queue stand-in answering polls with the states it is given."""
+
+    def __init__(self, states, delay=0):
+        """Initialize the fake queue."""
+        self.states = states
+        self.delay = delay
+        self.polled = []
+        self.running = 0
+        self.max_running = 0
+
+    async def submit(self, key, command, read=None):
+        """Record the poll and answer the next state."""
+        self.polled.append((webapp.monotonic(), key.device_id, read))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await sleep(self.delay)
+        self.running -= 1
+        return SimpleNamespace(state=next(self.states))
+
+
+async def registry_of(count):
+    registry = webapp.SwitcherDeviceRegistry()
+    for i in range(count):
+        await registry.register(
+            f"boiler_{i}", {**kitchen_boiler, webapp.KEY_ID: f"{i}"}
+        )
+    return registry
+
+
+async def run_poller(registry, queue, seconds, **kwargs):
+    sut = webapp.SwitcherPoller(registry, queue, **kwargs)
+    sut.start()
+    await sleep(seconds)
+    await sut.stop()
+    return sut
+
+
+@fixture(autouse=True)
+def without_jitter():
+    with patch.object(webapp, "uniform", return_value=1):
+        yield
+
+
+async def test_stable_state_is_polled_less_often_than_a_changing_one():
+    stable = FakeQueue(iter(lambda: "ON", None))
+    changing = FakeQueue(map(str, count()))
+
+    await run_poller(
+        await registry_of(1), stable, 0.3, min_interval=0.01, max_interval=0.04
+    )
+    await run_poller(
+        await registry_of(1), changing, 0.3, min_interval=0.01, max_interval=0.04
+    )
+
+    assert_that(len(stable.polled)).is_less_than(12)
+    assert_that(len(changing.polled)).is_greater_than(15)
+    gaps = [b[0] - a[0] for a, b in zip(stable.polled, stable.polled[1:])]
+    assert_that(gaps[0]).is_less_than(gaps[-1])
+
+
+async def test_written_device_is_polled_again_right_away():
+    queue = FakeQueue(iter(lambda: "ON", None))
+    key = webapp.DeviceKey(webapp.DEVICES["touch"], "1.2.3.4", "0", "00", None)
+    sut = webapp.SwitcherPoller(
+        await registry_of(1), queue, min_interval=0.05, max_interval=10
+    )
+    sut.start()
+    await sleep(0.2)
+    assert_that(sut.get(key, webapp.ENDPOINT_GET_STATE)).is_equal_to({"state": "ON"})
+    polled = len(queue.polled)
+
+    sut.written(key)
+    assert_that(sut.get(key, webapp.ENDPOINT_GET_STATE)).is_none()
+    await sleep(0.02)
+    await sut.stop()
+
+    assert_that(queue.polled).is_length(polled + 1)
+
+
+async def test_polls_are_capped_by_the_concurrency():
+    queue = FakeQueue(iter(lambda: "ON", None), delay=0.02)
+
+    await run_poller(await registry_of(6), queue, 0.1, min_interval=0.01, concurrency=2)
+
+    assert_that({device_id for _, device_id, _ in queue.polled}).is_length(6)
+    assert_that(queue.max_running).is_equal_to(2)
+
+
+@fixture
+def devices_file(tmp_path):
+    path = tmp_path / "devices.json"
+    path.write_text(
+        dumps(
+            {
+                "kitchen_boiler": kitchen_boiler,
+                "bedroom_runner": {
+                    webapp.KEY_TYPE: "runner",
+                    webapp.KEY_IP: "1.2.3.5",
+                    webapp.KEY_ID: "ef3a4b",
+                    webapp.KEY_TOKEN: "zvVvd7JxtN7CgvkD1Psujw==",
+                },
+            }
+        )
+    )
+    return path
+
+
+@fixture
+def api_device(api_connect, api_disconnect):
+    with patch("aioswitcher.api.SwitcherType1Api.get_state") as get_state, patch(
+        "aioswitcher.api.SwitcherType2Api.get_shutter_state"
+    ) as get_shutter_state:
+        get_state.return_value = SimpleNamespace(state="ON")
+        get_shutter_state.return_value = SimpleNamespace(position=40)
+        yield SimpleNamespace(get_state=get_state, get_shutter_state=get_shutter_state)
+
+
+@pytest_asyncio.fixture
+async def api_client(create_client, devices_file, api_device):
+    return await create_client(
+        "--devices", str(devices_file), "--poll", "--poll-min-interval", "0.01"
+    )
+
+
+async def test_state_reads_are_answered_from_the_polled_states(api_device, api_client):
+    poller = api_client.app[webapp.APP_POLLER]
+    devices = api_client.app[webapp.APP_DEVICES]
+    for _ in range(100):
+        if poller.get(
+            devices.get("kitchen_boiler"), webapp.ENDPOINT_GET_STATE
+        ) and poller.get(
+            devices.get("bedroom_runner"), (webapp.ENDPOINT_GET_SHUTTER_STATE, 0)
+        ):
+            break
+        await sleep(0.01)
+    await poller.stop()
+    # a cancelled poll's device read is shared with requests, so it runs to the end
+    await sleep(0.01)
+    api_device.get_state.reset_mock()
+    api_device.get_shutter_state.reset_mock()
+
+    state = await api_client.get(
+        f"{webapp.ENDPOINT_GET_STATE}?{webapp.KEY_DEVICE}=kitchen_boiler"
+    )
+    shutter = await api_client.get(
+        f"{webapp.ENDPOINT_GET_SHUTTER_STATE}?{webapp.KEY_DEVICE}=bedroom_runner"
+    )
+
+    assert_that(await state.json()).is_equal_to({"state": "ON"})
+    assert_that(await shutter.json()).is_equal_to({"position": 40})
+    api_device.get_state.assert_not_called()
+    api_device.get_shutter_state.assert_not_called()
+
+
+async def test_polled_state_changes_are_published_to_the_hub():
+    hub = webapp.SwitcherStateHub()
+    subscription = hub.subscribe({"0"})
+    queue = FakeQueue(iter(["ON", "ON", "OFF"] + ["OFF"] * 100))
+
+    await run_poller(
+        await registry_of(1), queue, 0.1, min_interval=0.01, max_interval=0.01, hub=hub
+    )
+
+    assert_that(await subscription.next(1)).is_equal_to({"0": {"state": "OFF"}})
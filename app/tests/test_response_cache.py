@@ -0,0 +1,109 @@
+"""Test cases for the read response cache."""
+
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest_asyncio
+from aioswitcher.device import DeviceType
+from assertpy import assert_that
+from pytest import mark
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+fake_device_key = webapp.DeviceKey(
+    DeviceType.POWER_PLUG, "1.2.3.4", "ab1c2d", "18", None
+)
+other_device_key = webapp.DeviceKey(
+    DeviceType.POWER_PLUG, "1.2.3.5", "ef3a4b", "18", None
+)
+fake_device_qparams = "type=touch&id=ab1c2d&ip=1.2.3.4&key=18"
+
+
+@pytest_asyncio.fixture
+async def api_client(create_client):
+    return await create_client("--cache-ttl", "60")
+
+
+async def test_cached_response_is_served_until_the_ttl_expires():
+    sut = webapp.SwitcherResponseCache(ttl=10)
+    with patch.object(webapp, "monotonic", return_value=100):
+        sut.put(fake_device_key, "get_state", {"state": "ON"}, 0)
+    with patch.object(webapp, "monotonic", return_value=105):
+        assert_that(sut.get(fake_device_key, "get_state")).is_equal_to({"state": "ON"})
+    with patch.object(webapp, "monotonic", return_value=111):
+        assert_that(sut.get(fake_device_key, "get_state")).is_none()
+    assert_that(sut.stats()).contains_entry({"hits": 1}, {"misses": 1})
+
+
+async def test_least_recently_used_response_is_evicted_when_full():
+    sut = webapp.SwitcherResponseCache(ttl=10, max_entries=2)
+    sut.put(fake_device_key, "get_state", "state", 0)
+    sut.put(fake_device_key, "get_schedules", "schedules", 0)
+    # reading the state makes the schedules the least recently used
+    sut.get(fake_device_key, "get_state")
+    sut.put(other_device_key, "get_state", "other state", 0)
+
+    assert_that(sut.get(fake_device_key, "get_schedules")).is_none()
+    assert_that(sut.get(fake_device_key, "get_state")).is_equal_to("state")
+    assert_that(sut.get(other_device_key, "get_state")).is_equal_to("other state")
+    assert_that(sut.stats()).contains_entry({"evictions": 1}, {"entries": 2})
+
+
+async def test_invalidation_drops_only_the_written_device_responses():
+    sut = webapp.SwitcherResponseCache(ttl=10)
+    sut.put(fake_device_key, "get_state", "state", 0)
+    sut.put(fake_device_key, "get_schedules", "schedules", 0)
+    sut.put(other_device_key, "get_state", "other state", 0)
+
+    sut.invalidate(fake_device_key._replace(login_key="00"))
+
+    assert_that(sut.get(fake_device_key, "get_state")).is_none()
+    assert_that(sut.get(fake_device_key, "get_schedules")).is_none()
+    assert_that(sut.get(other_device_key, "get_state")).is_equal_to("other state")
+
+
+async def test_response_read_before_an_invalidation_is_not_cached():
+    sut = webapp.SwitcherResponseCache(ttl=10)
+    generation = sut.generation(fake_device_key)
+    sut.invalidate(fake_device_key)
+    sut.put(fake_device_key, "get_state", "stale state", generation)
+
+    assert_that(sut.get(fake_device_key, "get_state")).is_none()
+
+
+async def test_zero_ttl_disables_the_cache():
+    sut = webapp.SwitcherResponseCache(ttl=0)
+    sut.put(fake_device_key, "get_state", "state", 0)
+
+    assert_that(sut.get(fake_device_key, "get_state")).is_none()
+    assert_that(sut.stats()).contains_entry({"entries": 0}, {"misses": 0})
+
+
+@patch("aioswitcher.api.SwitcherType1Api.create_schedule")
+@patch("aioswitcher.api.SwitcherType1Api.get_schedules")
+async def test_get_schedules_is_cached_until_a_schedule_is_created(
+    api_get_schedules, api_create_schedule, api_connect, api_disconnect, api_client
+):
+    schedule = SimpleNamespace(schedule_id="1", start_time="13:00")
+    api_get_schedules.return_value = SimpleNamespace(schedules=[schedule])
+    api_create_schedule.return_value = SimpleNamespace()
+    schedules_uri = f"{webapp.ENDPOINT_GET_SCHEDULES}?{fake_device_qparams}"
+
+    first = await api_client.get(schedules_uri)
+    second = await api_client.get(schedules_uri)
+    assert_that(api_get_schedules.call_count).is_equal_to(1)
+    assert_that(await second.json()).is_equal_to(await first.json())
+
+    await api_client.post(
+        f"{webapp.ENDPOINT_CREATE_SCHEDULE}?{fake_device_qparams}",
+        json={webapp.KEY_START: "14:00", webapp.KEY_STOP: "15:00"},
+    )
+    await api_client.get(schedules_uri)
+    assert_that(api_get_schedules.call_count).is_equal_to(2)
+
+    stats = await (await api_client.get(webapp.ENDPOINT_GET_CACHE_STATS)).json()
+    assert_that(stats).contains_entry(
+        {"hits": 1}, {"misses": 2}, {"evictions": 0}, {"entries": 1}
+    )
@@ -0,0 +1,212 @@
+"""Test cases for the device groups and scenes."""
+
+from asyncio import sleep
+from json import dumps, loads
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest_asyncio
+from aioswitcher.api import Command
+from assertpy import assert_that
+from pytest import fixture, mark
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+boilers = [f"boiler_{i}" for i in range(4)]
+shutters = [f"shutter_{i}" for i in range(4)]
+
+
+@fixture
+def devices_file(tmp_path):
+    devices = {
+        alias: {
+            webapp.KEY_TYPE: "touch",
+            webapp.KEY_IP: f"1.2.3.{i}",
+            webapp.KEY_ID: f"ab1c{i:02d}",
+        }
+        for i, alias in enumerate(boilers)
+    }
+    devices.update(
+        {
+            alias: {
+                webapp.KEY_TYPE: "runner",
+                webapp.KEY_IP: f"1.2.4.{i}",
+                webapp.KEY_ID: f"ef3a{i:02d}",
+                webapp.KEY_TOKEN: "zvVvd7JxtN7CgvkD1Psujw==",
+            }
+            for i, alias in enumerate(shutters)
+        }
+    )
+    path = tmp_path / "devices.json"
+    path.write_text(dumps(devices))
+    return path
+
+
+@fixture
+def scenes_file(tmp_path):
+    path = tmp_path / "scenes.json"
+    path.write_text(
+        dumps(
+            {
+                webapp.KEY_GROUPS: {"boilers": boilers, "floor_2_shutters": shutters},
+                webapp.KEY_SCENES: {
+                    "good_night": [
+                        {
+                            webapp.KEY_ENDPOINT: webapp.ENDPOINT_TURN_OFF,
+                            webapp.KEY_GROUP: "boilers",
+                        },
+                        {
+                            webapp.KEY_ENDPOINT: webapp.ENDPOINT_SET_POSITION,
+                            webapp.KEY_GROUP: "floor_2_shutters",
+                            webapp.KEY_BODY: {webapp.KEY_POSITION: 0},
+                        },
+                    ]
+                },
+            }
+        )
+    )
+    return path
+
+
+@pytest_asyncio.fixture
+async def api_client(create_client, devices_file, scenes_file):
+    return await create_client(
+        "--devices", str(devices_file), "--scenes", str(scenes_file)
+    )
+
+
+async def slow_device(*args):
+    await sleep(0.1)
+    return SimpleNamespace(successful=True)
+
+
+@patch("aioswitcher.api.SwitcherType2Api.set_position", side_effect=slow_device)
+@patch("aioswitcher.api.SwitcherType1Api.control_device", side_effect=slow_device)
+async def test_scene_runs_its_devices_concurrently_timing_each(
+    api_control_device, api_set_position, api_connect, api_disconnect, api_client
+):
+    response = await api_client.post(
+        f"{webapp.ENDPOINT_RUN_SCENE}?{webapp.KEY_SCENE}=good_night"
+    )
+
+    assert_that(response.status).is_equal_to(200)
+    scene = await response.json()
+    # eight devices taking 0.1 seconds each, run at once
+    assert_that(scene["duration"]).is_less_than(0.4)
+    assert_that(scene["results"]).is_length(8)
+    assert_that([r[webapp.KEY_DEVICE] for r in scene["results"]]).is_equal_to(
+        boilers + shutters
+    )
+    for result in scene["results"]:
+        assert_that(result).contains_entry({"status": 200})
+        assert_that(result["duration"]).is_greater_than_or_equal_to(0.1)
+    assert_that(scene["results"][0]).contains_entry(
+        {webapp.KEY_ENDPOINT: webapp.ENDPOINT_TURN_OFF}
+    )
+    assert_that(api_control_device.call_count).is_equal_to(4)
+    api_set_position.assert_called_with(0, 0)
+
+
+@patch("aioswitcher.api.SwitcherType1Api.control_device")
+async def test_batch_operation_on_a_group_runs_for_every_device(
+    api_control_device, api_connect, api_disconnect, api_client
+):
+    api_control_device.return_value = SimpleNamespace(successful=True)
+
+    response = await api_client.post(
+        webapp.ENDPOINT_BATCH,
+        json=[
+            {
+                webapp.KEY_ENDPOINT: webapp.ENDPOINT_TURN_OFF,
+                webapp.KEY_GROUP: "boilers",
+            },
+            {webapp.KEY_ENDPOINT: webapp.ENDPOINT_TURN_OFF, webapp.KEY_GROUP: "lamps"},
+        ],
+    )
+
+    assert_that(await response.json()).is_equal_to(
+        [{"status": 200, "result": {"successful": True}}] * 4
+        + [{"status": 500, "error": "failed to get group lamps"}]
+    )
+    api_control_device.assert_called_with(Command.OFF)
+
+
+async def test_groups_and_scenes_are_edited_and_saved(api_client, scenes_file):
+    leave_home = [
+        {
+            webapp.KEY_ENDPOINT: webapp.ENDPOINT_TURN_OFF,
+            webapp.KEY_QUERY: {webapp.KEY_DEVICE: "boiler_0"},
+        }
+    ]
+
+    response = await api_client.put(
+        f"{webapp.ENDPOINT_GROUPS}?{webapp.KEY_GROUP}=kitchen", json=["boiler_0"]
+    )
+    assert_that(await response.json()).is_equal_to(["boiler_0"])
+    response = await api_client.put(
+        f"{webapp.ENDPOINT_SCENES}?{webapp.KEY_SCENE}=leave_home", json=leave_home
+    )
+    assert_that(await response.json()).is_equal_to(leave_home)
+    await api_client.delete(f"{webapp.ENDPOINT_GROUPS}?{webapp.KEY_GROUP}=boilers")
+    await api_client.delete(f"{webapp.ENDPOINT_SCENES}?{webapp.KEY_SCENE}=good_night")
+
+    content = await (await api_client.get(webapp.ENDPOINT_SCENES)).json()
+    expected = {
+        webapp.KEY_GROUPS: {"floor_2_shutters": shutters, "kitchen": ["boiler_0"]},
+        webapp.KEY_SCENES: {"leave_home": leave_home},
+    }
+    assert_that(content).is_equal_to(expected)
+    assert_that(loads(scenes_file.read_text())).is_equal_to(expected)
+
+
+async def test_scenes_of_the_workers_share_their_edits(scenes_file):
+    worker_a = webapp.SwitcherScenes(str(scenes_file))
+    worker_b = webapp.SwitcherScenes(str(scenes_file))
+    worker_a.load()
+    worker_b.load()
+
+    await worker_a.set_group("kitchen", ["boiler_0"])
+    await worker_b.set_group("bedroom", ["shutter_0"])
+    await worker_b.remove_scene("good_night")
+
+    assert_that(worker_a.group("bedroom")).is_equal_to(["shutter_0"])
+    assert_that(worker_b.group("kitchen")).is_equal_to(["boiler_0"])
+    assert_that(loads(scenes_file.read_text())).is_equal_to(worker_a.content())
+    assert_that(worker_a.content()[webapp.KEY_SCENES]).is_empty()
+
+
+async def test_set_scene_with_unknown_endpoint(api_client):
+    response = await api_client.put(
+        f"{webapp.ENDPOINT_SCENES}?{webapp.KEY_SCENE}=party",
+        json=[{webapp.KEY_ENDPOINT: "/switcher/dance", webapp.KEY_GROUP: "boilers"}],
+    )
+
+    assert_that(response.status).is_equal_to(500)
+    assert_that((await response.json())["error"]).starts_with(
+        "failed to get operations array of scene party"
+    )
+
+
+async def test_set_scene_with_faulty_query(api_client):
+    response = await api_client.put(
+        f"{webapp.ENDPOINT_SCENES}?{webapp.KEY_SCENE}=party",
+        json=[{webapp.KEY_ENDPOINT: webapp.ENDPOINT_TURN_OFF, webapp.KEY_QUERY: "x"}],
+    )
+
+    assert_that(response.status).is_equal_to(500)
+    assert_that((await response.json())["error"]).starts_with(
+        "failed to get operations array of scene party"
+    )
+
+
+async def test_run_unknown_scene(api_client):
+    response = await api_client.post(
+        f"{webapp.ENDPOINT_RUN_SCENE}?{webapp.KEY_SCENE}=party"
+    )
+
+    assert_that(response.status).is_equal_to(500)
+    assert_that(await response.json()).is_equal_to(
+        {"error": "failed to get scene party"}
+    )
@@ -3,10 +3,19 @@
 from enum import Enum, auto
 from unittest.mock import MagicMock
 
+from aioswitcher.api.messages import SwitcherShutterStateResponse, SwitcherStateResponse
+from aioswitcher.device import DeviceState, DeviceType, ShutterDirection
+from aioswitcher.schedule import Days
+from aioswitcher.schedule.parser import SwitcherSchedule
 from assertpy import assert_that
 from pytest import mark
 
-from ..webapp import _serialize_object
+from ..webapp import (
+    SERIALIZERS,
+    _compile_serializer,
+    _serialize_object,
+    _serialize_reflectively,
+)
 
 
 class JustAnEnum(Enum):
@@ -67,3 +76,59 @@ def test_serialize_object(sut_dict, expected_serialized_dict):
     sut_obj.__dict__ = sut_dict
 
     assert_that(_serialize_object(sut_obj)).is_equal_to(expected_serialized_dict)
+
+
+def response(cls, **attrs):
+    # bypass parsing the unparsed response, the serializers only read attributes
+    obj = cls.__new__(cls)
+    obj.__dict__.update(unparsed_response=b"010101", **attrs)
+    return obj
+
+
+@mark.parametrize(
+    "sut_obj",
+    [
+        response(
+            SwitcherStateResponse,
+            state=DeviceState.ON,
+            time_left="00:30:00",
+            time_on="01:12:43",
+            auto_shutdown="02:00:00",
+            power_consumption=2100,
+            electric_current=9.5,
+        ),
+        response(
+            SwitcherShutterStateResponse,
+            position=50,
+            direction=ShutterDirection.SHUTTER_STOP,
+            device_type=DeviceType.RUNNER,
+            index=0,
+        ),
+        SwitcherSchedule("1", True, {Days.MONDAY, Days.FRIDAY}, "17:00", "18:30"),
+    ],
+)
+def test_compiled_serializer_matches_the_reflective_one(sut_obj):
+    serializer = _compile_serializer(type(sut_obj))
+
+    assert_that(serializer).is_not_same_as(_serialize_reflectively)
+    assert_that(serializer(sut_obj)).is_equal_to(_serialize_reflectively(sut_obj))
+
+
+def test_serializer_is_compiled_once_per_class():
+    SERIALIZERS.pop(SwitcherSchedule, None)
+    schedule = SwitcherSchedule("1", False, set(), "17:00", "18:30")
+
+    _serialize_object(schedule)
+    serializer = SERIALIZERS[SwitcherSchedule]
+    _serialize_object(schedule)
+
+    assert_that(SERIALIZERS[SwitcherSchedule]).is_same_as(serializer)
+
+
+def test_compiled_serializer_falls_back_for_attributes_other_than_fields():
+    schedule = SwitcherSchedule("1", False, set(), "17:00", "18:30")
+    schedule.extra = JustAnEnum.MEMBER_ONE
+
+    assert_that(_compile_serializer(SwitcherSchedule)(schedule)).contains_entry(
+        {"extra": "MEMBER_ONE"}
+    )
@@ -0,0 +1,215 @@
+"""Test cases for the jobs watching shutters move to their position."""
+
+from json import dumps, loads
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest_asyncio
+from aioswitcher.device import ShutterDirection
+from assertpy import assert_that
+from pytest import fixture, mark
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+bedroom_runner = {
+    webapp.KEY_TYPE: "runner",
+    webapp.KEY_IP: "1.2.3.5",
+    webapp.KEY_ID: "ef3a4b",
+    webapp.KEY_TOKEN: "zvVvd7JxtN7CgvkD1Psujw==",
+}
+
+
+def shutter(position, direction=ShutterDirection.SHUTTER_DOWN):
+    return SimpleNamespace(position=position, direction=direction)
+
+
+@fixture
+def devices_file(tmp_path):
+    path = tmp_path / "devices.json"
+    path.write_text(dumps({"bedroom_runner": bedroom_runner}))
+    return path
+
+
+@fixture
+def api_device(api_connect, api_disconnect):
+    with patch("aioswitcher.api.SwitcherType2Api.set_position") as set_position, patch(
+        "aioswitcher.api.SwitcherType2Api.get_shutter_state"
+    ) as get_shutter_state:
+        set_position.return_value = SimpleNamespace(successful=True)
+        yield SimpleNamespace(
+            set_position=set_position, get_shutter_state=get_shutter_state
+        )
+
+
+@pytest_asyncio.fixture
+async def api_client(create_client, devices_file):
+    return await create_client(
+        "--devices",
+        str(devices_file),
+        "--shutter-job-interval",
+        "0.02",
+        "--shutter-job-timeout",
+        "0.5",
+    )
+
+
+async def start_job(api_client, position):
+    response = await api_client.post(
+        f"{webapp.ENDPOINT_SHUTTER_JOBS}?{webapp.KEY_DEVICE}=bedroom_runner",
+        json={webapp.KEY_POSITION: position},
+    )
+    assert_that(response.status).is_equal_to(202)
+    return response
+
+
+async def test_job_is_done_when_the_shutter_reaches_the_position(
+    api_device, api_client
+):
+    api_device.get_shutter_state.side_effect = [shutter(p) for p in (80, 60, 40, 20)]
+
+    response = await start_job(api_client, 20)
+    job = await response.json()
+    assert_that(job).contains_entry({webapp.KEY_STATE: webapp.JOB_MOVING})
+    assert_that(response.headers["Location"]).is_equal_to(
+        f"{webapp.ENDPOINT_SHUTTER_JOBS}?{webapp.KEY_JOB}={job[webapp.KEY_JOB]}"
+    )
+
+    response = await api_client.get(f"{response.headers['Location']}&wait=5")
+
+    job = await response.json()
+    assert_that(job).contains_entry(
+        {webapp.KEY_STATE: webapp.JOB_DONE},
+        {webapp.KEY_POSITION: 20},
+        {"current_position": 20},
+        {webapp.KEY_DEVICE_ID: "ef3a4b"},
+    )
+    assert_that(job["finished"]).is_greater_than_or_equal_to(job["started"])
+    api_device.set_position.assert_called_once_with(20, 0)
+    assert_that(api_device.get_shutter_state.call_count).is_equal_to(4)
+
+
+async def test_job_is_stopped_when_the_shutter_stops_short(api_device, api_client):
+    stop = ShutterDirection.SHUTTER_STOP
+    api_device.get_shutter_state.side_effect = [
+        shutter(70),
+        shutter(55, stop),
+        shutter(55, stop),
+    ]
+
+    response = await start_job(api_client, 20)
+    response = await api_client.get(f"{response.headers['Location']}&wait=5")
+
+    assert_that(await response.json()).contains_entry(
+        {webapp.KEY_STATE: webapp.JOB_STOPPED}, {"current_position": 55}
+    )
+
+
+async def test_job_times_out_when_the_shutter_does_not_get_there(
+    api_device, api_client
+):
+    api_device.get_shutter_state.return_value = shutter(80)
+
+    response = await start_job(api_client, 20)
+    location = response.headers["Location"]
+    response = await api_client.get(f"{location}&wait=0.05")
+    assert_that(await response.json()).contains_entry(
+        {webapp.KEY_STATE: webapp.JOB_MOVING}
+    )
+
+    response = await api_client.get(f"{location}&wait=5")
+
+    assert_that(await response.json()).contains_entry(
+        {webapp.KEY_STATE: webapp.JOB_TIMED_OUT}, {"current_position": 80}
+    )
+
+
+async def test_new_move_of_the_shutter_supersedes_its_job(api_device, api_client):
+    api_device.get_shutter_state.return_value = shutter(80)
+
+    first = await (await start_job(api_client, 20)).json()
+    second = await (await start_job(api_client, 60)).json()
+    api_device.get_shutter_state.return_value = shutter(60)
+
+    response = await api_client.get(
+        f"{webapp.ENDPOINT_SHUTTER_JOBS}?{webapp.KEY_JOB}={first[webapp.KEY_JOB]}"
+    )
+    assert_that(await response.json()).contains_entry(
+        {webapp.KEY_STATE: webapp.JOB_SUPERSEDED}
+    )
+    response = await api_client.get(
+        f"{webapp.ENDPOINT_SHUTTER_JOBS}?{webapp.KEY_JOB}={second[webapp.KEY_JOB]}"
+        "&wait=5"
+    )
+    assert_that(await response.json()).contains_entry(
+        {webapp.KEY_STATE: webapp.JOB_DONE}
+    )
+
+
+async def test_job_events_stream_the_progress_until_it_finishes(api_device, api_client):
+    api_device.get_shutter_state.side_effect = [shutter(p) for p in (80, 80, 50, 20)]
+    job = await (await start_job(api_client, 20)).json()
+
+    response = await api_client.get(
+        f"{webapp.ENDPOINT_SHUTTER_JOB_EVENTS}?{webapp.KEY_JOB}={job[webapp.KEY_JOB]}"
+    )
+
+    assert_that(response.headers["Content-Type"]).is_equal_to("text/event-stream")
+    events = [
+        loads(line.split(": ", 1)[1])
+        for line in (await response.text()).splitlines()
+        if line.startswith("data: ")
+    ]
+    assert_that([e["current_position"] for e in events]).is_subset_of(
+        [None, 80, 50, 20]
+    )
+    assert_that(events[-1]).contains_entry({webapp.KEY_STATE: webapp.JOB_DONE})
+
+
+async def test_failed_polls_are_retried(api_device, api_client):
+    api_device.get_shutter_state.side_effect = [
+        RuntimeError("device went away"),
+        shutter(20),
+    ]
+
+    response = await start_job(api_client, 20)
+    response = await api_client.get(f"{response.headers['Location']}&wait=5")
+
+    assert_that(await response.json()).contains_entry(
+        {webapp.KEY_STATE: webapp.JOB_DONE}
+    )
+
+
+async def test_job_is_not_started_when_the_move_fails(api_device, api_client):
+    api_device.set_position.side_effect = RuntimeError("blabla")
+
+    response = await api_client.post(
+        f"{webapp.ENDPOINT_SHUTTER_JOBS}?{webapp.KEY_DEVICE}=bedroom_runner",
+        json={webapp.KEY_POSITION: 20},
+    )
+
+    assert_that(response.status).is_equal_to(500)
+    assert_that(await response.json()).is_equal_to({"error": "blabla"})
+    api_device.get_shutter_state.assert_not_called()
+
+
+async def test_unknown_job(api_client):
+    response = await api_client.get(f"{webapp.ENDPOINT_SHUTTER_JOBS}?job=abc")
+
+    assert_that(response.status).is_equal_to(500)
+    assert_that(await response.json()).is_equal_to({"error": "failed to get job abc"})
+
+
+async def test_job_with_faulty_wait(api_device, api_client):
+    api_device.get_shutter_state.return_value = shutter(80)
+    job = await (await start_job(api_client, 20)).json()
+
+    response = await api_client.get(
+        f"{webapp.ENDPOINT_SHUTTER_JOBS}?job={job[webapp.KEY_JOB]}&wait=soon"
+    )
+
+    assert_that(response.status).is_equal_to(500)
+    assert_that(await response.json()).is_equal_to(
+        {"error": "failed to get wait from query as seconds"}
+    )
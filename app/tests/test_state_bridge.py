@@ -0,0 +1,179 @@
+"""Test cases for answering state reads from the devices udp broadcasts."""
+
+from asyncio import sleep
+from binascii import unhexlify
+from socket import AF_INET, SOCK_DGRAM, socket
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+import pytest_asyncio
+from aioswitcher.device import DeviceState, DeviceType, SwitcherPowerPlug
+from assertpy import assert_that
+from pytest import fixture, mark
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+# broadcast message of a Switcher Touch named "Kitchen Boiler", id ab1c2d, ip 192.168.1.33
+touch_broadcast_packet = unhexlify(
+    "fef000000000000000000000000000000000ab1c2d0000000000000000000000000000000000000018"
+    "004b69746368656e20426f696c6572000000000000000000000000000000000000030bc0a80121a1b2"
+    "c3d4e5f60000000000000000000000000000000000000000000000000000000000000000000000000000"
+    "00000000000000000001003408000000000000000000000807000000000000201c0000000000000000"
+)
+# broadcast message of a Switcher Breeze named "Living Room AC", id 3c4d5e, ip 192.168.1.34
+breeze_broadcast_packet = unhexlify(
+    "fef0000000000000000000000000000000003c4d5e0000000000000000000000000000000000000000"
+    "004c6976696e6720526f6f6d2041430000000000000000000000000000000000000e0100c0a80122a1"
+    "b2c3d4e5f70000000000000000000000000000000000000000000000000000000000000000000000000"
+    "00000000000000000000000eb00010416210000444c4b36353836330000000000000000000000000000"
+    "000000"
+)
+
+touch_query = "type=touch&id=ab1c2d&ip=192.168.1.33&key=18"
+breeze_query = "type=breeze&id=3c4d5e&ip=192.168.1.34"
+
+
+@fixture
+def bridge_port():
+    with socket(AF_INET, SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest_asyncio.fixture
+async def api_client(create_client, bridge_port):
+    return await create_client("--bridge", "--bridge-ports", str(bridge_port))
+
+
+async def replay(api_client, port, packet, device_id):
+    with socket(AF_INET, SOCK_DGRAM) as sock:
+        sock.sendto(packet, ("127.0.0.1", port))
+    states = api_client.app[webapp.APP_STATES]
+    for _ in range(100):
+        if states.get(device_id):
+            return
+        await sleep(0.01)
+    raise AssertionError("broadcast packet was not received by the bridge")
+
+
+async def test_get_state_is_answered_from_the_broadcast(
+    api_client, bridge_port, api_connect
+):
+    await replay(api_client, bridge_port, touch_broadcast_packet, "ab1c2d")
+
+    response = await api_client.get(f"{webapp.ENDPOINT_GET_STATE}?{touch_query}")
+
+    api_connect.assert_not_called()
+    assert_that(response.status).is_equal_to(200)
+    assert_that(await response.json()).is_equal_to(
+        {
+            "state": "ON",
+            "time_left": "00:30:00",
+            "time_on": None,
+            "auto_shutdown": "02:00:00",
+            "power_consumption": 2100,
+            "electric_current": 9.5,
+        }
+    )
+
+
+async def test_get_state_of_a_plug_has_the_keys_of_a_live_read(api_client, api_connect):
+    api_client.app[webapp.APP_STATES].update(
+        SwitcherPowerPlug(
+            DeviceType.POWER_PLUG,
+            DeviceState.ON,
+            "4e5f6a",
+            "18",
+            "192.168.1.35",
+            "12:A1:A2:1A:BC:1B",
+            "Office Plug",
+            False,
+            power_consumption=120,
+            electric_current=0.5,
+        )
+    )
+
+    response = await api_client.get(
+        f"{webapp.ENDPOINT_GET_STATE}?type=plug&id=4e5f6a&ip=192.168.1.35&key=18"
+    )
+
+    api_connect.assert_not_called()
+    assert_that(await response.json()).is_equal_to(
+        {
+            "state": "ON",
+            "time_left": None,
+            "time_on": None,
+            "auto_shutdown": None,
+            "power_consumption": 120,
+            "electric_current": 0.5,
+        }
+    )
+
+
+async def test_get_breeze_state_is_answered_from_the_broadcast(
+    api_client, bridge_port, api_connect
+):
+    await replay(api_client, bridge_port, breeze_broadcast_packet, "3c4d5e")
+
+    response = await api_client.get(
+        f"{webapp.ENDPOINT_GET_BREEZE_STATE}?{breeze_query}"
+    )
+
+    api_connect.assert_not_called()
+    assert_that(response.status).is_equal_to(200)
+    assert_that(await response.json()).is_equal_to(
+        {
+            "state": "ON",
+            "mode": "COOL",
+            "fan_level": "MEDIUM",
+            "temperature": 23.5,
+            "target_temperature": 22,
+            "swing": "ON",
+            "remote_id": "DLK65863",
+        }
+    )
+
+
+@patch("aioswitcher.api.SwitcherApi.disconnect")
+@patch("aioswitcher.api.SwitcherType1Api.get_state")
+async def test_too_old_broadcast_falls_back_to_a_live_query(
+    api_get_state, api_disconnect, api_client, bridge_port, api_connect
+):
+    api_get_state.return_value = SimpleNamespace(state="OFF")
+    await replay(api_client, bridge_port, touch_broadcast_packet, "ab1c2d")
+
+    response = await api_client.get(
+        f"{webapp.ENDPOINT_GET_STATE}?{touch_query}&{webapp.KEY_MAX_AGE}=0"
+    )
+
+    api_connect.assert_called_once()
+    api_get_state.assert_called_once_with()
+    assert_that(await response.json()).is_equal_to({"state": "OFF"})
+
+
+@patch("aioswitcher.api.SwitcherApi.disconnect")
+@patch("aioswitcher.api.SwitcherType1Api.get_state")
+async def test_device_without_broadcast_is_queried_live(
+    api_get_state, api_disconnect, api_client, api_connect
+):
+    api_get_state.return_value = SimpleNamespace(state="OFF")
+
+    response = await api_client.get(f"{webapp.ENDPOINT_GET_STATE}?{touch_query}")
+
+    api_connect.assert_called_once()
+    assert_that(await response.json()).is_equal_to({"state": "OFF"})
+
+
+async def test_state_cache_expires_entries_by_max_age():
+    sut = webapp.SwitcherStateCache(max_age=10)
+    device = Mock(device_id="ab1c2d")
+    with patch.object(webapp, "monotonic", return_value=100):
+        sut.update(device)
+    with patch.object(webapp, "monotonic", return_value=105):
+        assert_that(sut.get("ab1c2d")).is_same_as(device)
+        assert_that(sut.get("ab1c2d", max_age=1)).is_none()
+    with patch.object(webapp, "monotonic", return_value=111):
+        assert_that(sut.get("ab1c2d")).is_none()
+    assert_that(sut.get("unknown")).is_none()
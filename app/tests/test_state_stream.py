@@ -0,0 +1,163 @@
+"""Test cases for streaming the devices state deltas."""
+
+import json
+
+from aioswitcher.device import (
+    DeviceState,
+    DeviceType,
+    ShutterDirection,
+    SwitcherShutter,
+    SwitcherWaterHeater,
+)
+from assertpy import assert_that
+from pytest import mark
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+
+def water_heater(device_id="ab1c2d", state=DeviceState.ON, remaining_time="00:30:00"):
+    return SwitcherWaterHeater(
+        DeviceType.TOUCH,
+        state,
+        device_id,
+        "18",
+        "192.168.1.33",
+        "A1:B2:C3:D4:E5:F6",
+        "Kitchen Boiler",
+        False,
+        2100,
+        9.5,
+        remaining_time,
+        "02:00:00",
+    )
+
+
+def shutter(device_id="3c4d5e", position=50):
+    return SwitcherShutter(
+        DeviceType.RUNNER,
+        DeviceState.ON,
+        device_id,
+        "18",
+        "192.168.1.34",
+        "A1:B2:C3:D4:E5:F7",
+        "Living Room Shutter",
+        False,
+        position,
+        ShutterDirection.SHUTTER_STOP,
+    )
+
+
+async def test_subscriber_gets_the_full_state_then_only_deltas():
+    sut = webapp.SwitcherStateHub()
+    sut.publish(water_heater())
+    subscription = sut.subscribe({"ab1c2d"})
+
+    assert_that(await subscription.next(1)).is_equal_to(
+        {
+            "ab1c2d": {
+                "state": "ON",
+                "time_left": "00:30:00",
+                "auto_shutdown": "02:00:00",
+                "power_consumption": 2100,
+                "electric_current": 9.5,
+            }
+        }
+    )
+
+    sut.publish(water_heater(remaining_time="00:29:56"))
+    assert_that(await subscription.next(1)).is_equal_to(
+        {"ab1c2d": {"time_left": "00:29:56"}}
+    )
+
+
+async def test_unchanged_and_unsubscribed_devices_are_not_pushed():
+    sut = webapp.SwitcherStateHub()
+    sut.publish(water_heater())
+    subscription = sut.subscribe({"3c4d5e"})
+
+    sut.publish(water_heater(state=DeviceState.OFF))
+    sut.publish(shutter())
+    sut.publish(shutter())
+
+    assert_that(await subscription.next(1)).is_equal_to(
+        {"3c4d5e": {"position": 50, "direction": "SHUTTER_STOP"}}
+    )
+    assert_that(await subscription.next(0.01)).is_empty()
+
+
+async def test_deltas_are_merged_while_the_subscriber_is_busy():
+    sut = webapp.SwitcherStateHub()
+    subscription = sut.subscribe({"3c4d5e"})
+
+    for position in (40, 30, 20):
+        sut.publish(shutter(position=position))
+
+    assert_that(await subscription.next(1)).is_equal_to(
+        {"3c4d5e": {"position": 20, "direction": "SHUTTER_STOP"}}
+    )
+
+
+async def test_polled_states_keep_the_keys_they_do_not_carry():
+    sut = webapp.SwitcherStateHub()
+    sut.publish(water_heater())
+    subscription = sut.subscribe({"ab1c2d"})
+    await subscription.next(1)
+
+    sut.publish_state("ab1c2d", {"state": "ON", "time_left": "00:29:00"})
+    sut.publish(water_heater(remaining_time="00:29:00"))
+
+    assert_that(await subscription.next(1)).is_equal_to(
+        {"ab1c2d": {"time_left": "00:29:00"}}
+    )
+    assert_that(await subscription.next(0.01)).is_empty()
+
+
+async def test_websocket_stream_pushes_deltas_of_subscribed_devices(api_client):
+    hub = api_client.app[webapp.APP_HUB]
+    hub.publish(water_heater())
+
+    async with api_client.ws_connect(
+        f"{webapp.ENDPOINT_STREAM}?{webapp.KEY_ID}=ab1c2d"
+    ) as ws:
+        assert_that(await ws.receive_json()).contains_entry({"device_id": "ab1c2d"})
+
+        await ws.send_json({webapp.KEY_SUBSCRIBE: ["3c4d5e"]})
+        await ws.send_json({webapp.KEY_UNSUBSCRIBE: ["ab1c2d"]})
+        await ws.send_str("not json")
+        assert_that(await ws.receive_json()).is_equal_to(
+            {"error": "failed to get subscription from message"}
+        )
+
+        hub.publish(water_heater(state=DeviceState.OFF))
+        hub.publish(shutter(position=10))
+        assert_that(await ws.receive_json()).is_equal_to(
+            {
+                "device_id": "3c4d5e",
+                "state": {"position": 10, "direction": "SHUTTER_STOP"},
+            }
+        )
+
+
+async def test_event_stream_pushes_deltas_as_server_sent_events(api_client):
+    hub = api_client.app[webapp.APP_HUB]
+    hub.publish(shutter(position=10))
+
+    response = await api_client.get(
+        f"{webapp.ENDPOINT_STREAM_EVENTS}?{webapp.KEY_ID}=3c4d5e"
+    )
+    assert_that(response.headers["Content-Type"]).is_equal_to("text/event-stream")
+    first = await response.content.readuntil(b"\n\n")
+    hub.publish(shutter(position=20))
+    second = await response.content.readuntil(b"\n\n")
+    response.close()
+
+    assert_that(first.decode()).starts_with("event: state\ndata: ")
+    assert_that(json.loads(first.decode().split("data: ")[1])).is_equal_to(
+        {"device_id": "3c4d5e", "state": {"position": 10, "direction": "SHUTTER_STOP"}}
+    )
+    assert_that(second.decode()).starts_with("event: state\ndata: ")
+    assert_that(json.loads(second.decode().split("data: ")[1])).is_equal_to(
+        {"device_id": "3c4d5e", "state": {"position": 20}}
+    )
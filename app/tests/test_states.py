@@ -0,0 +1,202 @@
+"""Test cases for the bulk state snapshot of the devices."""
+
+from json import dumps
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest_asyncio
+from aioswitcher.device import DeviceState, DeviceType, SwitcherWaterHeater
+from assertpy import assert_that
+from pytest import fixture, mark
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+boilers = {
+    f"boiler_{i}": {
+        webapp.KEY_TYPE: "touch",
+        webapp.KEY_IP: f"1.2.3.{i}",
+        webapp.KEY_ID: f"ab1c{i:02d}",
+    }
+    for i in range(3)
+}
+
+
+@fixture
+def devices_file(tmp_path):
+    path = tmp_path / "devices.json"
+    path.write_text(dumps(boilers))
+    return path
+
+
+@fixture
+def scenes_file(tmp_path):
+    path = tmp_path / "scenes.json"
+    path.write_text(dumps({webapp.KEY_GROUPS: {"upstairs": ["boiler_1", "boiler_2"]}}))
+    return path
+
+
+@pytest_asyncio.fixture
+async def api_client(create_client, devices_file, scenes_file):
+    return await create_client(
+        "--devices", str(devices_file), "--scenes", str(scenes_file)
+    )
+
+
+@fixture
+def api_device(api_connect, api_disconnect):
+    with patch("aioswitcher.api.SwitcherType1Api.get_state") as get_state:
+        get_state.return_value = SimpleNamespace(state="ON")
+        yield get_state
+
+
+async def read_states(api_client, *aliases):
+    for alias in aliases:
+        await api_client.get(f"{webapp.ENDPOINT_GET_STATE}?{webapp.KEY_DEVICE}={alias}")
+
+
+async def test_snapshot_bumps_the_version_only_for_changed_states():
+    sut = webapp.SwitcherStateSnapshot()
+
+    sut.update("ab1c00", {"state": "ON"})
+    sut.update("ab1c01", {"state": "ON"})
+    sut.update("ab1c00", {"state": "ON"})
+    sut.update("ab1c00", {"state": "OFF"})
+
+    assert_that(sut.version).is_equal_to(3)
+    assert_that(sut.changed(1)).is_equal_to(
+        [
+            {
+                webapp.KEY_DEVICE_ID: "ab1c01",
+                webapp.KEY_VERSION: 2,
+                webapp.KEY_STATE: {"state": "ON"},
+            },
+            {
+                webapp.KEY_DEVICE_ID: "ab1c00",
+                webapp.KEY_VERSION: 3,
+                webapp.KEY_STATE: {"state": "OFF"},
+            },
+        ]
+    )
+    assert_that(sut.changed(0, {"ab1c00", "unknown"})).is_length(1)
+    assert_that(sut.changed(3)).is_empty()
+
+
+async def test_same_state_read_and_broadcast_does_not_bump_the_version():
+    sut = webapp.SwitcherStateSnapshot()
+    broadcast = SwitcherWaterHeater(
+        DeviceType.TOUCH,
+        DeviceState.ON,
+        "ab1c00",
+        "18",
+        "1.2.3.0",
+        "A1:B2:C3:D4:E5:F6",
+        "Kitchen Boiler",
+        False,
+        2100,
+        9.5,
+        "00:30:00",
+        "02:00:00",
+    )
+    read = {
+        "state": "ON",
+        "time_left": "00:30:00",
+        "time_on": "01:30:00",
+        "auto_shutdown": "02:00:00",
+        "power_consumption": 2100,
+        "electric_current": 9.5,
+    }
+
+    for _ in range(3):
+        sut.update(
+            "ab1c00",
+            webapp._snapshot_state(DeviceType.TOUCH, webapp._stream_state(broadcast)),
+        )
+        sut.update("ab1c00", webapp._snapshot_state(DeviceType.TOUCH, read))
+
+    assert_that(sut.version).is_equal_to(1)
+    assert_that(sut.changed()[0][webapp.KEY_STATE]).does_not_contain_key("time_on")
+
+
+async def test_states_returns_every_known_device_with_an_etag(api_device, api_client):
+    await read_states(api_client, *boilers)
+
+    response = await api_client.get(webapp.ENDPOINT_GET_STATES)
+
+    assert_that(response.status).is_equal_to(200)
+    snapshot = await response.json()
+    assert_that(snapshot[webapp.KEY_VERSION]).is_equal_to(3)
+    assert_that(
+        [s[webapp.KEY_DEVICE_ID] for s in snapshot[webapp.KEY_STATES]]
+    ).is_equal_to(["ab1c00", "ab1c01", "ab1c02"])
+    assert_that(snapshot[webapp.KEY_STATES][0]).contains_entry(
+        {webapp.KEY_STATE: {"state": "ON"}}
+    )
+
+    response = await api_client.get(
+        webapp.ENDPOINT_GET_STATES, headers={"If-None-Match": response.headers["ETag"]}
+    )
+    assert_that(response.status).is_equal_to(304)
+    assert_that(await response.read()).is_empty()
+
+
+async def test_states_since_a_version_returns_the_changed_devices(
+    api_device, api_client
+):
+    await read_states(api_client, *boilers)
+    response = await api_client.get(webapp.ENDPOINT_GET_STATES)
+    etag = response.headers["ETag"]
+    version = (await response.json())[webapp.KEY_VERSION]
+
+    api_device.return_value = SimpleNamespace(state="OFF")
+    await read_states(api_client, "boiler_1")
+    response = await api_client.get(
+        f"{webapp.ENDPOINT_GET_STATES}?{webapp.KEY_SINCE}={version}",
+        headers={"If-None-Match": etag},
+    )
+
+    assert_that(response.status).is_equal_to(200)
+    assert_that(response.headers["ETag"]).is_not_equal_to(etag)
+    assert_that(await response.json()).is_equal_to(
+        {
+            webapp.KEY_VERSION: version + 1,
+            webapp.KEY_STATES: [
+                {
+                    webapp.KEY_DEVICE_ID: "ab1c01",
+                    webapp.KEY_VERSION: version + 1,
+                    webapp.KEY_STATE: {"state": "OFF"},
+                }
+            ],
+        }
+    )
+
+
+async def test_states_filtered_by_alias_and_group(api_device, api_client):
+    await read_states(api_client, *boilers)
+
+    response = await api_client.get(
+        f"{webapp.ENDPOINT_GET_STATES}?{webapp.KEY_GROUP}=upstairs"
+        f"&{webapp.KEY_DEVICE}=boiler_0"
+    )
+    everything = await api_client.get(webapp.ENDPOINT_GET_STATES)
+
+    states = (await response.json())[webapp.KEY_STATES]
+    assert_that(states).is_length(3)
+    assert_that(response.headers["ETag"]).is_not_equal_to(everything.headers["ETag"])
+
+    response = await api_client.get(
+        f"{webapp.ENDPOINT_GET_STATES}?{webapp.KEY_GROUP}=upstairs"
+    )
+    assert_that(
+        [s[webapp.KEY_DEVICE_ID] for s in (await response.json())[webapp.KEY_STATES]]
+    ).is_equal_to(["ab1c01", "ab1c02"])
+
+
+async def test_states_with_faulty_since(api_client):
+    response = await api_client.get(f"{webapp.ENDPOINT_GET_STATES}?since=yesterday")
+
+    assert_that(response.status).is_equal_to(500)
+    assert_that(await response.json()).is_equal_to(
+        {"error": "failed to get since from query as a version"}
+    )
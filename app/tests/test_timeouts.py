@@ -0,0 +1,134 @@
+"""Test cases for the device timeouts and the request deadline."""
+
+from asyncio import sleep
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest_asyncio
+from aioswitcher.device import DeviceType
+from assertpy import assert_that
+from pytest import mark, raises
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+fake_device_key = webapp.DeviceKey(
+    DeviceType.POWER_PLUG, "1.2.3.4", "ab1c2d", "18", None
+)
+fake_device_qparams = "type=plug&id=ab1c2d&ip=1.2.3.4&key=18"
+
+
+async def hang(*args):
+    await sleep(10)
+
+
+@pytest_asyncio.fixture
+async def api_client(create_client):
+    return await create_client("--command-timeout", "0.05")
+
+
+async def test_unreachable_device_fails_fast_on_the_connect_timeout(api_disconnect):
+    sut = webapp.SwitcherConnectionPool(timeouts=webapp.DeviceTimeouts(connect=0.05))
+
+    with patch("aioswitcher.api.SwitcherApi.connect", side_effect=hang):
+        with raises(webapp.SwitcherTimeoutError, match="connecting to ab1c2d"):
+            await sut.execute(fake_device_key, AsyncMock())
+
+
+@patch("aioswitcher.api.SwitcherType1Api._login", side_effect=hang)
+async def test_hanging_login_fails_on_the_login_timeout(
+    api_login, api_connect, api_disconnect
+):
+    sut = webapp.SwitcherConnectionPool(timeouts=webapp.DeviceTimeouts(login=0.05))
+
+    async def command(swapi):
+        return await swapi._login()
+
+    with raises(webapp.SwitcherTimeoutError, match="login to ab1c2d"):
+        await sut.execute(fake_device_key, command)
+    api_disconnect.assert_called_once()
+
+
+@patch("aioswitcher.api.SwitcherType1Api.get_state", side_effect=hang)
+async def test_hanging_command_is_answered_with_a_gateway_timeout(
+    api_get_state, api_connect, api_disconnect, api_client
+):
+    response = await api_client.get(
+        f"{webapp.ENDPOINT_GET_STATE}?{fake_device_qparams}"
+    )
+
+    assert_that(response.status).is_equal_to(504)
+    assert_that(await response.json()).is_equal_to(
+        {"error": "command to ab1c2d timed out after 0.05s"}
+    )
+    api_disconnect.assert_called_once()
+
+
+@patch("aioswitcher.api.SwitcherType1Api.control_device", side_effect=hang)
+async def test_request_deadline_bounds_the_handling_time(
+    api_control_device, api_connect, api_disconnect, aiohttp_client
+):
+    args = ["--pool-idle-ttl", "0"]
+    client = await aiohttp_client(webapp.create_app(webapp.parser.parse_args(args)))
+
+    response = await client.post(
+        f"{webapp.ENDPOINT_TURN_OFF}?{fake_device_qparams}",
+        headers={webapp.HEADER_REQUEST_TIMEOUT: "0.5"},
+    )
+
+    assert_that(response.status).is_equal_to(504)
+    assert_that(await response.json()).is_equal_to(
+        {"error": "request deadline timed out after 0.5s"}
+    )
+    api_disconnect.assert_called_once()
+
+
+@patch("aioswitcher.api.SwitcherType1Api.get_state")
+async def test_request_within_its_deadline_is_answered(
+    api_get_state, api_connect, api_disconnect, api_client
+):
+    api_get_state.return_value = SimpleNamespace(state="ON")
+
+    response = await api_client.get(
+        f"{webapp.ENDPOINT_GET_STATE}?{fake_device_qparams}",
+        headers={webapp.HEADER_REQUEST_TIMEOUT: "5"},
+    )
+
+    assert_that(response.status).is_equal_to(200)
+    assert_that(await response.json()).is_equal_to({"state": "ON"})
+
+
+async def test_faulty_request_timeout_header(api_client):
+    response = await api_client.get(
+        f"{webapp.ENDPOINT_GET_STATE}?{fake_device_qparams}",
+        headers={webapp.HEADER_REQUEST_TIMEOUT: "soon"},
+    )
+
+    assert_that(response.status).is_equal_to(500)
+    assert_that(await response.json()).is_equal_to(
+        {"error": f"failed to get {webapp.HEADER_REQUEST_TIMEOUT} header as seconds"}
+    )
+
+
+@patch("aioswitcher.api.SwitcherType1Api.get_state", side_effect=hang)
+async def test_timed_out_batch_operation_is_reported_as_a_gateway_timeout(
+    api_get_state, api_connect, api_disconnect, api_client
+):
+    response = await api_client.post(
+        webapp.ENDPOINT_BATCH,
+        json=[
+            {
+                webapp.KEY_ENDPOINT: webapp.ENDPOINT_GET_STATE,
+                webapp.KEY_QUERY: {
+                    webapp.KEY_TYPE: "plug",
+                    webapp.KEY_ID: "ab1c2d",
+                    webapp.KEY_IP: "1.2.3.4",
+                },
+            }
+        ],
+    )
+
+    assert_that(await response.json()).is_equal_to(
+        [{"status": 504, "error": "command to ab1c2d timed out after 0.05s"}]
+    )
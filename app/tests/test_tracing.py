@@ -0,0 +1,148 @@
+"""Test cases for tracing the requests with per phase spans."""
+
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest_asyncio
+from aiohttp import web
+from aioswitcher.device import DeviceState
+from assertpy import assert_that
+from pytest import fixture, mark
+
+from .. import webapp
+
+pytestmark = mark.asyncio
+
+fake_device_qparams = "type=touch&id=ab1c2d&ip=1.2.3.4&key=18"
+
+
+@fixture
+def trace_file(tmp_path):
+    return tmp_path / "traces.jsonl"
+
+
+@pytest_asyncio.fixture
+async def api_client(create_client, remotes_db_path, trace_file):
+    return await create_client(
+        "--trace-sample-rate",
+        "1",
+        "--trace-file",
+        str(trace_file),
+        remotes_db_path=remotes_db_path,
+    )
+
+
+@fixture
+def api_get_state(api_connect, api_disconnect):
+    with patch("aioswitcher.api.SwitcherType1Api.get_state") as get_state:
+        get_state.return_value = SimpleNamespace(state="ON")
+        yield get_state
+
+
+@fixture
+def api_control_breeze_device(api_connect, api_disconnect):
+    with patch(
+        "aioswitcher.api.SwitcherType2Api.control_breeze_device"
+    ) as control_breeze_device:
+        control_breeze_device.return_value = SimpleNamespace(successful=True)
+        yield control_breeze_device
+
+
+def timed_phases(header):
+    return [timing.split(";")[0] for timing in header.split(", ")]
+
+
+async def test_trace_times_its_spans_for_the_server_timing_header():
+    sut = webapp.SwitcherTrace("GET /switcher/get_state")
+
+    with sut.span("connect"):
+        pass
+    with sut.span("command"):
+        pass
+
+    assert_that([span.name for span in sut.spans]).is_equal_to(["connect", "command"])
+    for span in sut.spans:
+        assert_that(span.end).is_greater_than_or_equal_to(span.start)
+    assert_that(sut.server_timing()).matches(
+        r"^connect;dur=\d+\.\d{3}, command;dur=\d+\.\d{3}, total;dur=\d+\.\d{3}$"
+    )
+
+
+async def test_tracer_samples_by_its_rate():
+    assert_that(webapp.SwitcherTracer(0).sample("GET /")).is_none()
+    assert_that(webapp.SwitcherTracer(1).sample("GET /")).is_not_none()
+    with patch.object(webapp, "random", return_value=0.3):
+        assert_that(webapp.SwitcherTracer(0.25).sample("GET /")).is_none()
+        assert_that(webapp.SwitcherTracer(0.5).sample("GET /")).is_not_none()
+
+
+async def test_breeze_control_phases_are_timed_in_the_response(
+    api_control_breeze_device, api_client
+):
+    response = await api_client.patch(
+        f"{webapp.ENDPOINT_CONTROL_BREEZE_DEVICE}?type=breeze&id=3c4d5e&ip=1.2.3.4",
+        json={
+            webapp.KEY_DEVICE_STATE: DeviceState.ON.display,
+            webapp.KEY_REMOTE_ID: "TADC7002",
+        },
+    )
+
+    assert_that(response.status).is_equal_to(200)
+    assert_that(
+        timed_phases(response.headers[webapp.HEADER_SERVER_TIMING])
+    ).is_equal_to(
+        ["decode", "remote", "queue", "connect", "command", "encode", "total"]
+    )
+
+
+async def test_traces_are_exported_as_otlp_json_lines(
+    api_get_state, api_client, trace_file
+):
+    await api_client.get(f"{webapp.ENDPOINT_GET_STATE}?{fake_device_qparams}")
+    await api_client.app[webapp.APP_TRACER].export()
+
+    (line,) = trace_file.read_text().splitlines()
+    (resource_spans,) = json.loads(line)["resourceSpans"]
+    root, *spans = resource_spans["scopeSpans"][0]["spans"]
+    assert_that(root).contains_entry({"name": "GET /switcher/get_state"})
+    assert_that(root["attributes"]).contains(
+        {"key": "http.status_code", "value": {"intValue": "200"}}
+    )
+    assert_that([span["name"] for span in spans]).is_equal_to(
+        ["queue", "connect", "command", "encode"]
+    )
+    for span in spans:
+        assert_that(span).contains_entry(
+            {"traceId": root["traceId"]}, {"parentSpanId": root["spanId"]}
+        )
+
+
+async def test_traces_are_posted_to_the_otlp_collector(aiohttp_server):
+    received = []
+
+    async def collect(request):
+        received.append(await request.json())
+        return web.json_response({})
+
+    collector = web.Application()
+    collector.router.add_post("/v1/traces", collect)
+    server = await aiohttp_server(collector)
+    sut = webapp.SwitcherTracer(1, otlp_url=str(server.make_url("/v1/traces")))
+    sut.start()
+
+    sut.finish(sut.sample("GET /switcher/get_state"))
+    await sut.stop()
+
+    assert_that(received).is_length(1)
+    spans = received[0]["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert_that(spans[0]).contains_entry({"name": "GET /switcher/get_state"})
+
+
+async def test_unsampled_requests_are_not_timed(api_get_state, create_client):
+    client = await create_client()
+
+    response = await client.get(f"{webapp.ENDPOINT_GET_STATE}?{fake_device_qparams}")
+
+    assert_that(response.status).is_equal_to(200)
+    assert_that(response.headers).does_not_contain_key(webapp.HEADER_SERVER_TIMING)
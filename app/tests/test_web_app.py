@@ -1,10 +1,8 @@
 """Test cases for the web application."""
 
 from datetime import timedelta
-from unittest.mock import AsyncMock, Mock, patch
+from unittest.mock import Mock, patch
 
-import pytest_asyncio
-from aiohttp import web
 from aioswitcher.api import Command
 from aioswitcher.schedule import Days
 from assertpy import assert_that
@@ -52,29 +50,6 @@
 set_control_breeze_device_uri = f"{webapp.ENDPOINT_CONTROL_BREEZE_DEVICE}?{fake_devicetype_breeze_qparams}&{fake_device_qparams}"
 
 
-@pytest_asyncio.fixture
-async def api_client(aiohttp_client):
-    # create application
-    app = web.Application(middlewares=[webapp.error_middleware])
-    app.add_routes(webapp.routes)
-    # return client from application
-    return await aiohttp_client(app)
-
-
-@fixture
-def api_connect():
-    with patch(
-        "aioswitcher.api.SwitcherApi.connect", return_value=AsyncMock()
-    ) as connect:
-        yield connect
-
-
-@fixture
-def api_disconnect():
-    with patch("aioswitcher.api.SwitcherApi.disconnect") as disconnect:
-        yield disconnect
-
-
 @fixture
 def response_serializer():
     with patch.object(
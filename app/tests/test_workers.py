@@ -0,0 +1,78 @@
+"""Test cases for the supervisor of the worker processes."""
+
+from argparse import Namespace
+from os import O_CREAT, O_EXCL, _exit, getpid, getppid, kill
+from os import open as open_fd
+from os.path import exists
+from signal import SIG_DFL, SIGINT, SIGTERM, getsignal, signal
+from time import monotonic, sleep
+
+from assertpy import assert_that
+from pytest import fixture
+
+from .. import webapp
+
+
+@fixture
+def restored_signals():
+    handlers = {signum: getsignal(signum) for signum in (SIGINT, SIGTERM)}
+    yield
+    for signum, handler in handlers.items():
+        signal(signum, handler)
+
+
+def crashing_once_worker(args, locks_directory):
+    """Crash the first worker once serving, then stop the supervisor when restarted."""
+    signal(SIGTERM, SIG_DFL)
+    webapp._mark_serving(locks_directory)
+    with open(args.started, "a") as started:
+        started.write(f"{getpid()} {locks_directory} {monotonic()}\n")
+    try:
+        open_fd(args.crashed, O_CREAT | O_EXCL)
+    except FileExistsError:
+        if args.workers == sum(1 for _ in open(args.started)) - 1:
+            kill(getppid(), SIGTERM)
+        sleep(60)
+    else:
+        _exit(1)
+
+
+def test_supervisor_restarts_the_crashed_worker_and_stops_on_sigterm(
+    tmp_path, monkeypatch, restored_signals
+):
+    monkeypatch.setattr(webapp, "_run_worker", crashing_once_worker)
+    monkeypatch.setattr(webapp, "WORKER_RESTART_BACKOFF", 0.2)
+    args = Namespace(
+        workers=2, started=str(tmp_path / "started"), crashed=str(tmp_path / "crashed")
+    )
+
+    assert_that(webapp._serve_workers(args)).is_zero()
+
+    started = [line.split() for line in open(args.started)]
+    # two workers, one of them restarted after crashing
+    assert_that({pid for pid, _, _ in started}).is_length(3)
+    # the crashed worker is restarted after the backoff
+    times = sorted(float(at) for _, _, at in started)
+    assert_that(times[2] - times[0]).is_greater_than_or_equal_to(0.2)
+    locks_directories = {directory for _, directory, _ in started}
+    assert_that(locks_directories).is_length(1)
+    assert_that(exists(locks_directories.pop())).is_false()
+
+
+def failing_to_serve_worker(args, locks_directory):
+    """Exit before serving, as a worker failing to bind its port does."""
+    with open(args.started, "a") as started:
+        started.write(f"{getpid()}\n")
+    _exit(1)
+
+
+def test_supervisor_stops_when_a_worker_fails_before_serving(
+    tmp_path, monkeypatch, restored_signals
+):
+    monkeypatch.setattr(webapp, "_run_worker", failing_to_serve_worker)
+    args = Namespace(workers=1, started=str(tmp_path / "started"))
+
+    assert_that(webapp._serve_workers(args)).is_equal_to(1)
+
+    # not restarted
+    assert_that(list(open(args.started))).is_length(1)
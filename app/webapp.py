@@ -1,13 +1,79 @@
 """Web service implemented with aiohttp for integrating the Switcher smart devices."""
 
-from argparse import ArgumentParser
+from abc import ABC, abstractmethod
+from argparse import ArgumentParser, Namespace
+from asyncio import (
+    Event,
+    Future,
+    Lock,
+    Semaphore,
+    Task,
+    TimeoutError,
+    create_task,
+    ensure_future,
+    gather,
+    get_running_loop,
+    shield,
+    sleep,
+    wait,
+    wait_for,
+)
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from contextvars import ContextVar
+from copy import deepcopy
+from dataclasses import fields, is_dataclass
 from datetime import timedelta
 from enum import Enum
-from logging import config
-from typing import Callable, Dict, List, Set, Union
+from fcntl import LOCK_EX, LOCK_NB, flock
+from functools import wraps
+from hashlib import sha256
+from inspect import isclass
+from json import dumps, load, loads
+from logging import DEBUG, Formatter, LogRecord, config, getLogger
+from logging.handlers import QueueHandler, QueueListener
+from math import ceil
+from multiprocessing import Process, connection
+from os import O_CREAT, O_RDWR, chmod, close, fdopen, fstat, getpid, makedirs
+from os import open as open_fd
+from os import remove, replace, scandir, stat
+from os.path import basename, dirname, exists, join
+from queue import SimpleQueue
+from random import getrandbits, random, uniform
+from re import sub
+from shutil import rmtree
+from signal import SIG_DFL, SIGINT, SIGTERM, default_int_handler, signal
+from tempfile import mkdtemp, mkstemp
+from time import monotonic, time, time_ns
+from types import FrameType
+from typing import (
+    Any,
+    AsyncContextManager,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+    get_origin,
+    get_type_hints,
+)
+from zlib import crc32
 
-from aiohttp import web
+from aiohttp import ClientSession, ClientTimeout, WSMsgType, web
 from aiohttp.abc import AbstractAccessLogger
+from aiohttp.helpers import ETAG_ANY, ETag
 from aiohttp.log import (
     access_logger,
     client_logger,
@@ -17,17 +83,38 @@
 )
 from aiohttp.web_request import BaseRequest
 from aiohttp.web_response import StreamResponse
-from aioswitcher.api import Command, SwitcherType1Api, SwitcherType2Api
-from aioswitcher.api.remotes import SwitcherBreezeRemoteManager
+from aioswitcher.api import Command, SwitcherApi, SwitcherType1Api, SwitcherType2Api
+from aioswitcher.api.messages import (
+    SwitcherGetSchedulesResponse,
+    SwitcherShutterStateResponse,
+)
+from aioswitcher.api.remotes import BREEZE_REMOTE_DB_FPATH, SwitcherBreezeRemote
+from aioswitcher.bridge import (
+    SWITCHER_UDP_PORT_TYPE1,
+    SWITCHER_UDP_PORT_TYPE1_NEW_VERSION,
+    SWITCHER_UDP_PORT_TYPE2,
+    SWITCHER_UDP_PORT_TYPE2_NEW_VERSION,
+    SwitcherBridge,
+)
 from aioswitcher.device import (
+    DeviceCategory,
     DeviceState,
     DeviceType,
+    ShutterDirection,
+    SwitcherBase,
+    SwitcherPowerBase,
+    SwitcherShutterBase,
+    SwitcherSingleShutterDualLightBase,
+    SwitcherThermostat,
+    SwitcherTimedBase,
     ThermostatFanLevel,
     ThermostatMode,
     ThermostatSwing,
 )
 from aioswitcher.schedule import Days
 
+T = TypeVar("T")
+
 KEY_TYPE = "type"
 KEY_ID = "id"
 KEY_LOGIN_KEY = "key"
@@ -49,6 +136,28 @@
 KEY_THERMOSTAT_SWING = "thermostat_swing"
 KEY_CURRENT_DEVICE_STATE = "current_device_state"
 KEY_REMOTE_ID = "remote_id"
+KEY_MAX_AGE = "max_age"
+KEY_ENDPOINT = "endpoint"
+KEY_QUERY = "query"
+KEY_BODY = "body"
+KEY_DEVICE_ID = "device_id"
+KEY_STATE = "state"
+KEY_DEVICE = "device"
+KEY_LAST_SEEN = "last_seen"
+KEY_WINDOW = "window"
+KEY_REGISTER = "register"
+KEY_GROUP = "group"
+KEY_SCENE = "scene"
+KEY_GROUPS = "groups"
+KEY_SCENES = "scenes"
+KEY_SUBSCRIBE = "subscribe"
+KEY_UNSUBSCRIBE = "unsubscribe"
+KEY_SINCE = "since"
+KEY_VERSION = "version"
+KEY_STATES = "states"
+KEY_ACCESS = "access"
+KEY_JOB = "job"
+KEY_WAIT = "wait"
 
 ENDPOINT_GET_STATE = "/switcher/get_state"
 ENDPOINT_TURN_ON = "/switcher/turn_on"
@@ -63,6 +172,56 @@
 ENDPOINT_GET_SHUTTER_STATE = "/switcher/get_shutter_state"
 ENDPOINT_POST_STOP_SHUTTER = "/switcher/stop_shutter"
 ENDPOINT_CONTROL_BREEZE_DEVICE = "/switcher/control_breeze_device"
+ENDPOINT_GET_CACHE_STATS = "/switcher/cache_stats"
+ENDPOINT_BATCH = "/switcher/batch"
+ENDPOINT_STREAM = "/switcher/stream"
+ENDPOINT_STREAM_EVENTS = "/switcher/stream/events"
+ENDPOINT_METRICS = "/metrics"
+ENDPOINT_GET_BREAKERS = "/switcher/breakers"
+ENDPOINT_DEVICES = "/switcher/devices"
+ENDPOINT_DISCOVER = "/switcher/discover"
+ENDPOINT_GROUPS = "/switcher/groups"
+ENDPOINT_SCENES = "/switcher/scenes"
+ENDPOINT_RUN_SCENE = "/switcher/scenes/run"
+ENDPOINT_GET_STATES = "/switcher/states"
+ENDPOINT_GET_LIMITS = "/switcher/limits"
+ENDPOINT_SHUTTER_JOBS = "/switcher/shutter_jobs"
+ENDPOINT_SHUTTER_JOB_EVENTS = "/switcher/shutter_jobs/events"
+
+ADMISSION_EXEMPT = (ENDPOINT_METRICS, ENDPOINT_GET_LIMITS)
+STREAM_ENDPOINTS = (
+    ENDPOINT_STREAM,
+    ENDPOINT_STREAM_EVENTS,
+    ENDPOINT_SHUTTER_JOB_EVENTS,
+)
+
+HEADER_REQUEST_TIMEOUT = "X-Request-Timeout"
+HEADER_SERVER_TIMING = "Server-Timing"
+HEADER_IDEMPOTENCY_KEY = "Idempotency-Key"
+HEADER_IDEMPOTENT_REPLAYED = "Idempotent-Replayed"
+
+REQUEST_DEVICE_TIMES = "device_times"
+
+STREAM_HEARTBEAT = 15.0
+DISCOVERY_WINDOW = 5.0
+DISCOVERY_MAX_WINDOW = 30.0
+POLL_JITTER = 0.2
+JOB_MAX_WAIT = 30.0
+JOB_MOVING = "moving"
+JOB_DONE = "done"
+JOB_STOPPED = "stopped"
+JOB_TIMED_OUT = "timed_out"
+JOB_SUPERSEDED = "superseded"
+TRACE_SERVICE_NAME = "switcher_webapi"
+TRACE_EXPORT_INTERVAL = 1.0
+TRACE_MAX_PENDING = 1024
+IDEMPOTENCY_SWEEP_INTERVAL = 60.0
+FILE_MODE = 0o644
+WORKER_RESTART_BACKOFF = 0.5
+WORKER_RESTART_MAX_BACKOFF = 30.0
+METRICS_MAX_DEVICES = 256
+METRICS_OTHER_DEVICE = "other"
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
 
 DEVICES = {
     "mini": DeviceType.MINI,
@@ -77,6 +236,35 @@
     "runners11": DeviceType.RUNNER_S11,
 }
 
+DEVICE_TYPES = {t: name for name, t in DEVICES.items()}
+WEEKDAYS = {d.value: d for d in Days}
+DEVICE_STATES = {s.display: s for s in DeviceState}
+THERMOSTAT_MODES = {m.display: m for m in ThermostatMode}
+THERMOSTAT_FAN_LEVELS = {fl.display: fl for fl in ThermostatFanLevel}
+THERMOSTAT_SWINGS = {sw.display: sw for sw in ThermostatSwing}
+
+
+class JsonCodec(NamedTuple):
+    """Functions encoding the responses and decoding the request bodies."""
+
+    dumps: Callable[[Any], str]
+    loads: Callable[[Union[str, bytes]], Any]
+
+
+JSON_CODECS = {"stdlib": JsonCodec(dumps, loads)}
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    pass
+else:
+
+    def _orjson_dumps(obj: Any) -> str:
+        """Use for encoding with orjson, aiohttp expects the encoder to return str."""
+        return orjson.dumps(obj).decode()
+
+    JSON_CODECS["orjson"] = JsonCodec(_orjson_dumps, orjson.loads)
+
 parser = ArgumentParser(
     description="Start an aiohttp web service integrating with Switcher devices."
 )
@@ -97,354 +285,3862 @@
     help="log level for reporting",
 )
 
-routes = web.RouteTableDef()
+parser.add_argument(
+    "--access-log-format",
+    choices=["text", "json"],
+    default="text",
+    help="format of the debug access log, json adds the device round-trip time",
+)
 
+parser.add_argument(
+    "--pool-idle-ttl",
+    type=float,
+    default=30,
+    help="seconds to keep idle device connections open for reuse, 0 disables"
+    " pooling, default is 30",
+)
 
-def _serialize_object(obj: object) -> Dict[str, Union[List[str], str]]:
-    """Use for converting enum to primitives and remove not relevant keys ."""
-    serialized_dict = dict()  # type: Dict[str, Union[List[str], str]]
-    for k, v in obj.__dict__.items():
-        if not k == "unparsed_response":
-            if isinstance(v, Enum):
-                serialized_dict[k] = v.name
-            elif isinstance(v, Set):
-                serialized_dict[k] = [m.name if isinstance(m, Enum) else m for m in v]
-            else:
-                serialized_dict[k] = v
-    return serialized_dict
+parser.add_argument(
+    "--connect-timeout",
+    type=float,
+    default=5,
+    help="seconds to wait for a device connection, 0 waits for the os, default is 5",
+)
 
+parser.add_argument(
+    "--login-timeout",
+    type=float,
+    default=5,
+    help="seconds to wait for a device login, 0 disables, default is 5",
+)
 
-@routes.get(ENDPOINT_GET_STATE)
-async def get_state(request: web.Request) -> web.Response:
-    """Use to get the current state of the device."""
-    device_type = DEVICES[request.query[KEY_TYPE]]
-    if KEY_LOGIN_KEY in request.query:
-        login_key = request.query[KEY_LOGIN_KEY]
-    else:
-        login_key = "00"
-    async with SwitcherType1Api(
-        device_type, request.query[KEY_IP], request.query[KEY_ID], login_key
-    ) as swapi:
-        return web.json_response(_serialize_object(await swapi.get_state()))
+parser.add_argument(
+    "--command-timeout",
+    type=float,
+    default=10,
+    help="seconds to wait for a device command including its login, 0 disables,"
+    " default is 10",
+)
 
+parser.add_argument(
+    "--breaker-failures",
+    type=int,
+    default=5,
+    help="consecutive connection failures opening a device's circuit breaker,"
+    " 0 disables, default is 5",
+)
 
-@routes.post(ENDPOINT_TURN_ON)
-async def turn_on(request: web.Request) -> web.Response:
-    """Use to turn on the device."""
-    if request.body_exists:
-        body = await request.json()
-        minutes = int(body[KEY_MINUTES]) if body.get(KEY_MINUTES) else 0
-    else:
-        minutes = 0
-    device_type = DEVICES[request.query[KEY_TYPE]]
-    if KEY_LOGIN_KEY in request.query:
-        login_key = request.query[KEY_LOGIN_KEY]
-    else:
-        login_key = "00"
-    async with SwitcherType1Api(
-        device_type, request.query[KEY_IP], request.query[KEY_ID], login_key
-    ) as swapi:
-        return web.json_response(
-            _serialize_object(await swapi.control_device(Command.ON, minutes))
-        )
+parser.add_argument(
+    "--breaker-backoff",
+    type=float,
+    default=1,
+    help="seconds an opened circuit breaker waits before probing the device,"
+    " doubled by every failed probe, default is 1",
+)
 
+parser.add_argument(
+    "--breaker-max-backoff",
+    type=float,
+    default=60,
+    help="max seconds an opened circuit breaker waits before probing the device,"
+    " default is 60",
+)
 
-@routes.post(ENDPOINT_TURN_OFF)
-async def turn_off(request: web.Request) -> web.Response:
-    """Use to turn on the device."""
-    device_type = DEVICES[request.query[KEY_TYPE]]
-    if KEY_LOGIN_KEY in request.query:
-        login_key = request.query[KEY_LOGIN_KEY]
-    else:
-        login_key = "00"
-    async with SwitcherType1Api(
-        device_type, request.query[KEY_IP], request.query[KEY_ID], login_key
-    ) as swapi:
-        return web.json_response(
-            _serialize_object(await swapi.control_device(Command.OFF))
-        )
+parser.add_argument(
+    "--cache-ttl",
+    type=float,
+    default=0,
+    help="seconds to serve read responses from the cache, 0 disables caching,"
+    " default is 0",
+)
 
+parser.add_argument(
+    "--cache-max-entries",
+    type=int,
+    default=1024,
+    help="max number of cached read responses, etags and idempotency keys, default is"
+    " 1024",
+)
 
-@routes.patch(ENDPOINT_SET_NAME)
-async def set_name(request: web.Request) -> web.Response:
-    """Use to set the device's name."""
-    try:
-        body = await request.json()
-        name = body[KEY_NAME]
-    except Exception as exc:
-        raise ValueError(f"failed to get {KEY_NAME} from body as json") from exc
-    device_type = DEVICES[request.query[KEY_TYPE]]
-    if KEY_LOGIN_KEY in request.query:
-        login_key = request.query[KEY_LOGIN_KEY]
-    else:
-        login_key = "00"
-    async with SwitcherType1Api(
-        device_type, request.query[KEY_IP], request.query[KEY_ID], login_key
-    ) as swapi:
-        return web.json_response(_serialize_object(await swapi.set_device_name(name)))
+parser.add_argument(
+    "--idempotency-ttl",
+    type=float,
+    default=3600,
+    help="seconds the result of a write sent with an Idempotency-Key header is"
+    " replayed for repeated requests, default is 3600",
+)
 
+parser.add_argument(
+    "--max-requests",
+    type=int,
+    default=0,
+    help="max number of requests handled at once, others are answered 429, each worker"
+    " admits its share, default is 0 for unlimited",
+)
 
-@routes.patch(ENDPOINT_SET_AUTO_SHUTDOWN)
-async def set_auto_shutdown(request: web.Request) -> web.Response:
-    """Use to set the device's auto shutdown configuration value."""
-    try:
-        body = await request.json()
-        hours = body[KEY_HOURS]
-        minutes = int(body[KEY_MINUTES]) if body.get(KEY_MINUTES) else 0
-    except Exception as exc:
-        raise ValueError("failed to get hours from body as json") from exc
-    device_type = DEVICES[request.query[KEY_TYPE]]
-    if KEY_LOGIN_KEY in request.query:
-        login_key = request.query[KEY_LOGIN_KEY]
-    else:
-        login_key = "00"
-    async with SwitcherType1Api(
-        device_type, request.query[KEY_IP], request.query[KEY_ID], login_key
-    ) as swapi:
-        return web.json_response(
-            _serialize_object(
-                await swapi.set_auto_shutdown(
-                    timedelta(hours=int(hours), minutes=int(minutes) if minutes else 0)
-                )
-            )
-        )
+parser.add_argument(
+    "--max-device-requests",
+    type=int,
+    default=0,
+    help="max number of commands queued for a device, others are answered 429, default"
+    " is 0 for unlimited",
+)
 
+parser.add_argument(
+    "--rate-limit",
+    type=float,
+    default=0,
+    help="requests per second allowed for each client ip, others are answered 429,"
+    " each worker admits its share, default is 0 for unlimited",
+)
 
-@routes.get(ENDPOINT_GET_SCHEDULES)
-async def get_schedules(request: web.Request) -> web.Response:
-    """Use to get the current configured schedules on the device."""
-    device_type = DEVICES[request.query[KEY_TYPE]]
-    if KEY_LOGIN_KEY in request.query:
-        login_key = request.query[KEY_LOGIN_KEY]
-    else:
-        login_key = "00"
-    async with SwitcherType1Api(
-        device_type, request.query[KEY_IP], request.query[KEY_ID], login_key
-    ) as swapi:
-        response = await swapi.get_schedules()
-        return web.json_response([_serialize_object(s) for s in response.schedules])
+parser.add_argument(
+    "--rate-burst",
+    type=int,
+    default=10,
+    help="requests a client ip can send at once before being rate limited, each worker"
+    " admits its share, default is 10",
+)
 
+parser.add_argument(
+    "--remotes-max-entries",
+    type=int,
+    default=32,
+    help="max number of parsed breeze remotes kept in memory, default is 32",
+)
 
-@routes.delete(ENDPOINT_DELETE_SCHEDULE)
-async def delete_schedule(request: web.Request) -> web.Response:
-    """Use to delete an existing schedule."""
+parser.add_argument(
+    "--batch-concurrency",
+    type=int,
+    default=10,
+    help="max number of operations of a batch running at once, default is 10",
+)
+
+parser.add_argument(
+    "--bridge",
+    action="store_true",
+    help="listen for the devices udp broadcasts and answer state reads from them",
+)
+
+parser.add_argument(
+    "--bridge-ports",
+    type=int,
+    nargs="+",
+    default=[
+        SWITCHER_UDP_PORT_TYPE1,
+        SWITCHER_UDP_PORT_TYPE1_NEW_VERSION,
+        SWITCHER_UDP_PORT_TYPE2,
+        SWITCHER_UDP_PORT_TYPE2_NEW_VERSION,
+    ],
+    help="udp ports the bridge listens on, default is the devices broadcast ports",
+)
+
+parser.add_argument(
+    "--bridge-max-age",
+    type=float,
+    default=10,
+    help="max age in seconds of broadcast states answered by read endpoints when"
+    " the max_age query parameter is not set, default is 10",
+)
+
+parser.add_argument(
+    "--devices",
+    help="json file mapping device aliases to their type, ip, id, key and token,"
+    " edits through the api are saved to it and shared with the other workers",
+)
+
+parser.add_argument(
+    "--scenes",
+    help="json file of the device groups and scenes, edits through the api are"
+    " saved to it and shared with the other workers",
+)
+
+parser.add_argument(
+    "--poll",
+    action="store_true",
+    help="poll the state of the registered devices, answering state reads from it",
+)
+
+parser.add_argument(
+    "--poll-min-interval",
+    type=float,
+    default=2,
+    help="seconds between polls of a device after a write or a state change,"
+    " default is 2",
+)
+
+parser.add_argument(
+    "--poll-max-interval",
+    type=float,
+    default=60,
+    help="max seconds between polls of a device whose state is stable, default is 60",
+)
+
+parser.add_argument(
+    "--poll-concurrency",
+    type=int,
+    default=4,
+    help="max number of devices polled at once, default is 4",
+)
+
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="number of worker processes sharing the port, default is 1",
+)
+
+parser.add_argument(
+    "--shutter-job-interval",
+    type=float,
+    default=1,
+    help="seconds between the polls of a shutter moved by a job, default is 1",
+)
+
+parser.add_argument(
+    "--shutter-job-timeout",
+    type=float,
+    default=120,
+    help="seconds a shutter job waits for the shutter to reach its position, default"
+    " is 120",
+)
+
+parser.add_argument(
+    "--trace-sample-rate",
+    type=float,
+    default=0,
+    help="fraction of the requests traced with a Server-Timing header, default is 0",
+)
+
+parser.add_argument(
+    "--trace-file",
+    metavar="FILE",
+    help="file the spans of the traced requests are appended to as otlp json lines",
+)
+
+parser.add_argument(
+    "--trace-otlp-url",
+    metavar="URL",
+    help="otlp http collector the spans are posted to, i.e. http://host:4318/v1/traces",
+)
+
+parser.add_argument(
+    "--json",
+    choices=sorted(JSON_CODECS),
+    default="orjson" if "orjson" in JSON_CODECS else "stdlib",
+    help="library encoding and decoding json, default is orjson when installed",
+)
+
+routes = web.RouteTableDef()
+
+
+Serialized = Dict[str, Union[List[str], str]]
+
+
+def _serialize_value(value: Any) -> Any:
+    """Use for converting an enum or a set of enums to primitives."""
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, Set):
+        return [m.name if isinstance(m, Enum) else m for m in value]
+    return value
+
+
+def _serialize_reflectively(obj: object) -> Serialized:
+    """Use for serializing any object by walking its attributes."""
+    return {
+        k: _serialize_value(v)
+        for k, v in obj.__dict__.items()
+        if not k == "unparsed_response"
+    }
+
+
+def _compile_serializer(cls: type) -> Callable[[object], Serialized]:
+    """Use for generating a serializer specialized for the fields of a dataclass.
+
+    The fields' annotations decide at generation time which values are enums,
+    sets or primitives. Objects that are not dataclasses, or with attributes
+    other than their fields, are serialized reflectively.
+    """
+    if not is_dataclass(cls):
+        return _serialize_reflectively
     try:
-        body = await request.json()
-        schedule_id = body[KEY_SCHEDULE]
-    except Exception as exc:
-        raise ValueError("failed to get schedule from body as json") from exc
-    device_type = DEVICES[request.query[KEY_TYPE]]
-    if KEY_LOGIN_KEY in request.query:
-        login_key = request.query[KEY_LOGIN_KEY]
-    else:
-        login_key = "00"
-    async with SwitcherType1Api(
-        device_type, request.query[KEY_IP], request.query[KEY_ID], login_key
-    ) as swapi:
-        return web.json_response(
-            _serialize_object(await swapi.delete_schedule(schedule_id))
-        )
+        hints = get_type_hints(cls)
+    except Exception:
+        return _serialize_reflectively
+    names = [f.name for f in fields(cls)]
+    items = []
+    for name in names:
+        if name == "unparsed_response":
+            continue
+        hint = hints.get(name)
+        value = f"attrs[{name!r}]"
+        if isclass(hint) and issubclass(hint, Enum):
+            items.append(f"{name!r}: {value}.name")
+        elif get_origin(hint) in (set, frozenset):
+            enums = "[m.name if isinstance(m, Enum) else m for m in"
+            items.append(f"{name!r}: {enums} {value}]")
+        elif hint in (str, int, float, bool):
+            items.append(f"{name!r}: {value}")
+        else:
+            items.append(f"{name!r}: serialize_value({value})")
+    source = (
+        "def serialize(obj):\n"
+        "    attrs = obj.__dict__\n"
+        f"    if len(attrs) != {len(names)}:\n"
+        "        return serialize_reflectively(obj)\n"
+        f"    return {{{', '.join(items)}}}\n"
+    )
+    namespace: Dict[str, Any] = {
+        "Enum": Enum,
+        "serialize_value": _serialize_value,
+        "serialize_reflectively": _serialize_reflectively,
+    }
+    exec(compile(source, f"<serializer {cls.__qualname__}>", "exec"), namespace)
+    return namespace["serialize"]
 
 
-@routes.post(ENDPOINT_CREATE_SCHEDULE)
-async def create_schedule(request: web.Request) -> web.Response:
-    """Use to create a new schedule."""
-    weekdays = dict(map(lambda d: (d.value, d), Days))
-    body = await request.json()
-    start_time = body[KEY_START]
-    stop_time = body[KEY_STOP]
-    selected_days = (
-        set([weekdays[d] for d in body[KEY_DAYS]]) if body.get(KEY_DAYS) else set()
+SERIALIZERS: Dict[type, Callable[[object], Serialized]] = {}
+
+
+def _serialize_object(obj: object) -> Serialized:
+    """Use for converting enum to primitives and remove not relevant keys ."""
+    serializer = SERIALIZERS.get(type(obj))
+    if serializer is None:
+        serializer = SERIALIZERS[type(obj)] = _compile_serializer(type(obj))
+    return serializer(obj)
+
+
+def _serialize_schedules(response: SwitcherGetSchedulesResponse) -> List[Dict]:
+    """Use for converting the schedules of the response to primitives."""
+    return [_serialize_object(s) for s in response.schedules]
+
+
+class DeviceKey(NamedTuple):
+    """Connection details identifying a device, used for keying pooled sessions."""
+
+    device_type: DeviceType
+    ip_address: str
+    device_id: str
+    login_key: str
+    token: Optional[str]
+
+
+def _device_key(query: Mapping[str, str]) -> DeviceKey:
+    """Use for parsing the device connection details from the request query."""
+    return DeviceKey(
+        DEVICES[query[KEY_TYPE]],
+        query[KEY_IP],
+        query[KEY_ID],
+        query.get(KEY_LOGIN_KEY, "00"),
+        query.get(KEY_TOKEN),
     )
-    device_type = DEVICES[request.query[KEY_TYPE]]
-    if KEY_LOGIN_KEY in request.query:
-        login_key = request.query[KEY_LOGIN_KEY]
-    else:
-        login_key = "00"
-    async with SwitcherType1Api(
-        device_type, request.query[KEY_IP], request.query[KEY_ID], login_key
-    ) as swapi:
-        return web.json_response(
-            _serialize_object(
-                await swapi.create_schedule(start_time, stop_time, selected_days)
-            )
-        )
 
 
-@routes.post(ENDPOINT_SET_POSITION)
-async def set_position(request: web.Request) -> web.Response:
-    """Use for setting the shutter position of the Runner and Runner Mini devices."""
+def _device_descriptor(descriptor: Mapping[str, Any]) -> Dict[str, str]:
+    """Use for taking the connection details of a device as query parameters."""
+    return {
+        name: str(descriptor[name])
+        for name in (KEY_TYPE, KEY_IP, KEY_ID, KEY_LOGIN_KEY, KEY_TOKEN)
+        if descriptor.get(name) is not None
+    }
+
+
+def _write_atomically(path: str, content: str) -> None:
+    """Use for replacing the file's content, never leaving it half written."""
     try:
-        body = await request.json()
-        position = int(body[KEY_POSITION])
-    except Exception as exc:
-        raise ValueError("failed to get position from body as json") from exc
-    device_type = DEVICES[request.query[KEY_TYPE]]
-    if KEY_LOGIN_KEY in request.query:
-        login_key = request.query[KEY_LOGIN_KEY]
-    else:
-        login_key = "00"
-    if KEY_INDEX in request.query:
-        index = int(request.query[KEY_INDEX])
-    else:
-        index = 0
-    if KEY_TOKEN in request.query:
-        token = request.query[KEY_TOKEN]
-    else:
-        token = None
-    async with SwitcherType2Api(
-        device_type, request.query[KEY_IP], request.query[KEY_ID], login_key, token
-    ) as swapi:
-        return web.json_response(
-            _serialize_object(await swapi.set_position(position, index))
-        )
+        mode = stat(path).st_mode
+    except FileNotFoundError:
+        mode = FILE_MODE
+    # named uniquely, workers may write the file at once
+    fd, temp_path = mkstemp(dir=dirname(path) or ".", prefix=f"{basename(path)}.")
+    with fdopen(fd, "w") as temp_file:
+        temp_file.write(content)
+    chmod(temp_path, mode)
+    replace(temp_path, path)
 
 
-@routes.get(ENDPOINT_GET_BREEZE_STATE)
-async def get_breeze_state(request: web.Request) -> web.Response:
-    """Use for sending the get state packet to the Breeze device."""
-    device_type = DEVICES[request.query[KEY_TYPE]]
-    if KEY_LOGIN_KEY in request.query:
-        login_key = request.query[KEY_LOGIN_KEY]
-    else:
-        login_key = "00"
-    if KEY_TOKEN in request.query:
-        token = request.query[KEY_TOKEN]
-    else:
-        token = None
-    async with SwitcherType2Api(
-        device_type, request.query[KEY_IP], request.query[KEY_ID], login_key, token
-    ) as swapi:
-        return web.json_response(_serialize_object(await swapi.get_breeze_state()))
+class SharedJsonFile:
+    """A json file edited by the worker processes, each keeping a parsed copy.
 
+    An edit locks the file, applies to its latest content and replaces it, so the
+    edits of the workers are merged instead of overwriting each other. A worker
+    reloads its copy when it finds the file changed.
 
-@routes.get(ENDPOINT_GET_SHUTTER_STATE)
-async def get_shutter_state(request: web.Request) -> web.Response:
-    """Use for sending the get state packet to the Breeze device."""
-    device_type = DEVICES[request.query[KEY_TYPE]]
-    if KEY_LOGIN_KEY in request.query:
-        login_key = request.query[KEY_LOGIN_KEY]
-    else:
-        login_key = "00"
-    if KEY_INDEX in request.query:
-        index = int(request.query[KEY_INDEX])
-    else:
-        index = 0
-    if KEY_TOKEN in request.query:
-        token = request.query[KEY_TOKEN]
-    else:
-        token = None
-    async with SwitcherType2Api(
-        device_type, request.query[KEY_IP], request.query[KEY_ID], login_key, token
-    ) as swapi:
-        return web.json_response(
-            _serialize_object(await swapi.get_shutter_state(index))
-        )
+    Args:
+        path: the json file, None keeps the content in memory only.
 
+    """
 
-@routes.post(ENDPOINT_POST_STOP_SHUTTER)
-async def stop_shutter(request: web.Request) -> web.Response:
-    """Use for stopping the shutter."""
-    device_type = DEVICES[request.query[KEY_TYPE]]
-    if KEY_LOGIN_KEY in request.query:
-        login_key = request.query[KEY_LOGIN_KEY]
-    else:
-        login_key = "00"
-    if KEY_INDEX in request.query:
-        index = int(request.query[KEY_INDEX])
-    else:
-        index = 0
-    if KEY_TOKEN in request.query:
-        token = request.query[KEY_TOKEN]
-    else:
-        token = None
-    async with SwitcherType2Api(
-        device_type, request.query[KEY_IP], request.query[KEY_ID], login_key, token
-    ) as swapi:
-        return web.json_response(_serialize_object(await swapi.stop_shutter(index)))
+    def __init__(self, path: Optional[str] = None) -> None:
+        """Initialize the shared file."""
+        self.path = path
+        self._mtime: Optional[int] = None
+        self._content: Dict[str, Any] = {}
+        self._editing = Lock()
 
+    def changed(self) -> Optional[Dict[str, Any]]:
+        """Return the file's content if it changed since last read or edited."""
+        if not self.path:
+            return None
+        try:
+            if stat(self.path).st_mtime_ns == self._mtime:
+                return None
+            with open(self.path) as json_file:
+                self._mtime = fstat(json_file.fileno()).st_mtime_ns
+                content: Dict[str, Any] = load(json_file)
+        except FileNotFoundError:
+            return None
+        return content
 
-@routes.patch(ENDPOINT_CONTROL_BREEZE_DEVICE)
-async def control_breeze_device(request: web.Request) -> web.Response:
-    """Use for update breez device state."""
-    remote_manager = SwitcherBreezeRemoteManager()
-    device_states = {s.display: s for s in DeviceState}
-    thermostat_modes = {m.display: m for m in ThermostatMode}
-    thermostat_fan_levels = {fl.display: fl for fl in ThermostatFanLevel}
-    thermostat_swings = {sw.display: sw for sw in ThermostatSwing}
-    body: dict = await request.json()
-    try:
-        device_state = device_states.get(body.get(KEY_DEVICE_STATE, None))
-        thermostat_mode = thermostat_modes.get(body.get(KEY_THERMOSTAT_MODE, None))
-        target_temp = int(body[KEY_TARGET_TEMP]) if body.get(KEY_TARGET_TEMP) else 0
-        fan_level = thermostat_fan_levels.get(body.get(KEY_FAN_LEVEL, None))
-        thermostat_swing = thermostat_swings.get(body.get(KEY_THERMOSTAT_SWING, None))
-        remote_id = body[KEY_REMOTE_ID]
+    async def edit(self, edit: Callable[[Dict[str, Any]], Any]) -> Dict[str, Any]:
+        """Apply the edit to the latest content off the event loop, returning it."""
+        if not self.path:
+            content = deepcopy(self._content)
+            edit(content)
+            self._content = content
+            return content
+        async with self._editing:
+            content, self._mtime = await get_running_loop().run_in_executor(
+                None, self._edit_locked, edit
+            )
+        return content
+
+    def _edit_locked(
+        self, edit: Callable[[Dict[str, Any]], Any]
+    ) -> Tuple[Dict[str, Any], int]:
+        """Use for applying the edit to the file while holding its lock."""
+        path = cast(str, self.path)
+        # the file itself is replaced by every edit, so the lock is on a file beside it
+        with open(f"{path}.lock", "a") as lock_file:
+            flock(lock_file, LOCK_EX)
+            try:
+                with open(path) as json_file:
+                    content = load(json_file)
+            except FileNotFoundError:
+                content = {}
+            edit(content)
+            _write_atomically(path, dumps(content, indent=2))
+            return content, stat(path).st_mtime_ns
+
+
+def _parse_descriptor(
+    alias: str, descriptor: Mapping[str, Any]
+) -> Tuple[Dict[str, str], DeviceKey]:
+    """Use for parsing the descriptor of a device once, keeping its key for requests."""
+    try:
+        registered = _device_descriptor(descriptor)
+        return registered, _device_key(registered)
     except Exception as exc:
         raise ValueError(
-            "failed to get commands from body as json, you might sent illegal value"
+            f"failed to get {KEY_TYPE}, {KEY_IP} and {KEY_ID} of device {alias}"
         ) from exc
-    device_type = DEVICES[request.query[KEY_TYPE]]
-    if KEY_LOGIN_KEY in request.query:
-        login_key = request.query[KEY_LOGIN_KEY]
-    else:
-        login_key = "00"
-    if KEY_TOKEN in request.query:
-        token = request.query[KEY_TOKEN]
-    else:
-        token = None
-    async with SwitcherType2Api(
-        device_type,
-        request.query[KEY_IP],
-        request.query[KEY_ID],
-        login_key,
-        token,
-    ) as swapi:
-        remote = remote_manager.get_remote(remote_id)
-        return web.json_response(
-            _serialize_object(
-                await swapi.control_breeze_device(
-                    remote,
-                    device_state,
-                    thermostat_mode,
-                    target_temp,
-                    fan_level,
-                    thermostat_swing,
-                )
-            )
+
+
+class SwitcherDeviceRegistry:
+    """Devices registered by alias, letting requests reference them as ?device=.
+
+    Args:
+        path: json file the devices are loaded from and their edits are saved to,
+            shared with the other workers.
+
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        """Initialize the device registry."""
+        self._file = SharedJsonFile(path)
+        self._descriptors: Dict[str, Dict[str, str]] = {}
+        self._keys: Dict[str, DeviceKey] = {}
+
+    def load(self) -> None:
+        """Load the devices from the file, a missing file is created by an edit."""
+        content = self._file.changed()
+        if content is not None:
+            self._replace(content)
+
+    def get(self, alias: str) -> DeviceKey:
+        """Return the key of the device registered by the alias."""
+        self._refresh()
+        try:
+            return self._keys[alias]
+        except KeyError as exc:
+            raise ValueError(f"failed to get device {alias} from the registry") from exc
+
+    def descriptors(self) -> Dict[str, Dict[str, str]]:
+        """Return the connection details of the registered devices by alias."""
+        self._refresh()
+        return self._descriptors
+
+    def keys(self) -> Set[DeviceKey]:
+        """Return the keys of the registered devices."""
+        self._refresh()
+        return set(self._keys.values())
+
+    async def register(
+        self, alias: str, descriptor: Mapping[str, Any]
+    ) -> Dict[str, str]:
+        """Register or replace the device of the alias, saving the file."""
+        registered, _ = _parse_descriptor(alias, descriptor)
+        self._replace(
+            await self._file.edit(lambda content: content.update({alias: registered}))
         )
+        return registered
 
+    async def register_discovered(
+        self, devices: Sequence[Mapping[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """Register the discovered devices not registered yet, aliased by name."""
+        registered: List[Dict[str, Any]] = []
 
-@web.middleware
-async def error_middleware(request: web.Request, handler: Callable) -> web.Response:
-    """Middleware for handling server exceptions."""
-    try:
-        return await handler(request)
-    except Exception as exc:
-        server_logger.exception("caught exception while handing over to endpoint")
-        return web.json_response({"error": str(exc)}, status=500)
+        def edit(content: Dict[str, Any]) -> None:
+            registered.clear()
+            aliases = {d.get(KEY_ID): alias for alias, d in content.items()}
+            for device in devices:
+                alias = aliases.get(device[KEY_ID])
+                if alias is None:
+                    alias = sub(r"\W+", "_", device[KEY_NAME].lower()).strip("_")
+                    if not alias or alias in content:
+                        alias = f"{alias}_{device[KEY_ID]}".lstrip("_")
+                    content[alias] = _parse_descriptor(alias, device)[0]
+                registered.append({**device, KEY_DEVICE: alias})
 
+        self._replace(await self._file.edit(edit))
+        return registered
 
-class CustomAccessLogger(AbstractAccessLogger):
-    """Custom implementation of the aiohttp access logger."""
+    async def unregister(self, alias: str) -> None:
+        """Remove the device of the alias, saving the file."""
+        self.get(alias)
+        self._replace(await self._file.edit(lambda content: content.pop(alias, None)))
 
-    def log(self, request: BaseRequest, response: StreamResponse, time: float) -> None:
-        """Log as debug instead origin info."""
-        remote = request.remote
-        method = request.method
-        path = request.path
-        status = response.status
-        self.logger.debug(f"{remote} {method} {path} done in {time}s: {status}")
+    def _replace(self, content: Mapping[str, Any]) -> None:
+        """Use for parsing the loaded or edited devices, replacing the registered."""
+        descriptors: Dict[str, Dict[str, str]] = {}
+        keys: Dict[str, DeviceKey] = {}
+        for alias, descriptor in content.items():
+            descriptors[alias], keys[alias] = _parse_descriptor(alias, descriptor)
+        self._descriptors, self._keys = descriptors, keys
 
+    def _refresh(self) -> None:
+        """Use for reloading the devices when another worker edited the file."""
+        try:
+            content = self._file.changed()
+            if content is not None:
+                self._replace(content)
+        except ValueError:
+            server_logger.warning(f"failed to reload {self._file.path}", exc_info=True)
 
-if __name__ == "__main__":
-    args = parser.parse_args()
 
-    loggingConfig = {
-        "version": 1,
+APP_DEVICES = web.AppKey("devices", SwitcherDeviceRegistry)
+
+
+def _resolve_device_key(app: web.Application, query: Mapping[str, str]) -> DeviceKey:
+    """Use for getting the key of the device registered by alias, or in the query."""
+    alias = query.get(KEY_DEVICE)
+    if alias is None:
+        return _device_key(query)
+    return app[APP_DEVICES].get(alias)
+
+
+def _create_api(key: DeviceKey) -> SwitcherApi:
+    """Use for creating the protocol matching api for the device."""
+    if key.device_type.protocol_type == 1:
+        return SwitcherType1Api(
+            key.device_type, key.ip_address, key.device_id, key.login_key
+        )
+    return SwitcherType2Api(
+        key.device_type, key.ip_address, key.device_id, key.login_key, key.token
+    )
+
+
+def _is_alive(swapi: SwitcherApi) -> bool:
+    """Use for checking the device did not close the api's socket."""
+    reader = getattr(swapi, "_reader", None)
+    return swapi.connected and reader is not None and not reader.at_eof()
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    """Use for rendering label pairs in the prometheus text format."""
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    """Use for rendering a sample value in the prometheus text format."""
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric(ABC):
+    """Prometheus metric, series identified by their label values.
+
+    Args:
+        name: the metric name.
+        documentation: the help text of the metric.
+        labels: the label names, values are passed positionally in this order.
+
+    """
+
+    kind = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, labels: Tuple[str, ...] = ()
+    ) -> None:
+        """Initialize the metric."""
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Return the series in the prometheus text format."""
+
+
+class Counter(Metric):
+    """Prometheus counter, a value per combination of label values."""
+
+    kind = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labels: Tuple[str, ...] = ()
+    ) -> None:
+        """Initialize the metric."""
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        """Increase the value of the labelled series."""
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        """Return the value of the labelled series."""
+        return self._values.get(labels, 0)
+
+    def samples(self) -> List[str]:
+        """Return the series in the prometheus text format."""
+        return [
+            f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Gauge(Counter):
+    """Prometheus gauge, a value per combination of label values going up and down."""
+
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        """Decrease the value of the labelled series."""
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    """Prometheus histogram, observations counted in cumulative buckets.
+
+    Args:
+        name: the metric name.
+        documentation: the help text of the metric.
+        labels: the label names, values are passed positionally in this order.
+        buckets: the upper bounds of the buckets, in seconds.
+
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = HISTOGRAM_BUCKETS,
+    ) -> None:
+        """Initialize the metric."""
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets + (float("inf"),)
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        """Count the observation in the buckets of the labelled series."""
+        counts, total = self._series.setdefault(
+            labels, ([0] * len(self.buckets), [0.0])
+        )
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def count(self, *labels: str) -> int:
+        """Return the number of observations of the labelled series."""
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def samples(self) -> List[str]:
+        """Return the series in the prometheus text format."""
+        lines = []
+        names = self.labels + ("le",)
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket = _format_labels(names, labels + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            series = _format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{series} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{series} {cumulative}")
+        return lines
+
+
+class SwitcherMetrics:
+    """The web service and device metrics, exposed on the metrics endpoint.
+
+    Args:
+        max_devices: number of devices labelled by their id, the devices past it are
+            labelled as other, the ids are taken from the requests.
+
+    """
+
+    def __init__(self, max_devices: int = METRICS_MAX_DEVICES) -> None:
+        """Initialize the metrics."""
+        self._max_devices = max_devices
+        self._devices: Set[str] = set()
+        self.requests = Counter(
+            "switcher_webapi_requests_total",
+            "Number of handled requests.",
+            ("route", "method", "status"),
+        )
+        self.request_duration = Histogram(
+            "switcher_webapi_request_duration_seconds",
+            "Time spent handling requests.",
+            ("route", "method", "status"),
+        )
+        self.requests_in_flight = Gauge(
+            "switcher_webapi_requests_in_flight",
+            "Number of requests being handled.",
+            ("route",),
+        )
+        self.errors = Counter(
+            "switcher_webapi_errors_total",
+            "Number of requests failed by an exception, by the exception type.",
+            ("exception",),
+        )
+        self.device_duration = Histogram(
+            "switcher_webapi_device_duration_seconds",
+            "Time spent talking to the devices, by round-trip phase.",
+            ("device", "phase"),
+        )
+        self.device_in_flight = Gauge(
+            "switcher_webapi_device_commands_in_flight",
+            "Number of commands being sent to the devices.",
+            ("device",),
+        )
+        self.device_errors = Counter(
+            "switcher_webapi_device_errors_total",
+            "Number of failed device commands, by the exception type.",
+            ("device", "exception"),
+        )
+        self.rejected = Counter(
+            "switcher_webapi_rejected_total",
+            "Number of requests refused with 429, by the limit exceeded.",
+            ("limit",),
+        )
+
+    def device_label(self, device_id: str) -> str:
+        """Return the label of the device's series, other once max devices are seen."""
+        if device_id not in self._devices:
+            if len(self._devices) >= self._max_devices:
+                return METRICS_OTHER_DEVICE
+            self._devices.add(device_id)
+        return device_id
+
+    def render(self) -> str:
+        """Return all the metrics in the prometheus text format."""
+        lines = []
+        for metric in vars(self).values():
+            if not isinstance(metric, Metric):
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+APP_METRICS = web.AppKey("metrics", SwitcherMetrics)
+
+# logins done while running a command, so the pool can tell them from the command
+_logins: ContextVar[Optional[List[float]]] = ContextVar("logins", default=None)
+# device round-trips done while handling a request, for the access log
+_device_times: ContextVar[Optional[List[float]]] = ContextVar(
+    "device_times", default=None
+)
+
+
+class TraceSpan(NamedTuple):
+    """A timed phase of a traced request, in unix nanoseconds."""
+
+    name: str
+    span_id: str
+    start: int
+    end: int
+
+
+class SwitcherTrace:
+    """Spans of the phases of one sampled request.
+
+    Args:
+        name: name of the request's root span.
+
+    """
+
+    def __init__(self, name: str) -> None:
+        """Initialize the trace, starting its root span."""
+        self.name = name
+        self.trace_id = f"{getrandbits(128):032x}"
+        self.span_id = f"{getrandbits(64):016x}"
+        self.start = time_ns()
+        self.end = 0
+        self.attributes: Dict[str, Union[str, int]] = {}
+        self.spans: List[TraceSpan] = []
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Time the phase as a span of the trace."""
+        start = time_ns()
+        try:
+            yield
+        finally:
+            self.spans.append(
+                TraceSpan(name, f"{getrandbits(64):016x}", start, time_ns())
+            )
+
+    def server_timing(self) -> str:
+        """Return the spans and the time so far as a Server-Timing header value."""
+        timings = [(span.name, span.end - span.start) for span in self.spans]
+        timings.append(("total", time_ns() - self.start))
+        return ", ".join(f"{name};dur={nanos / 1e6:.3f}" for name, nanos in timings)
+
+
+_trace: ContextVar[Optional[SwitcherTrace]] = ContextVar("trace", default=None)
+
+
+@contextmanager
+def _span(name: str) -> Iterator[None]:
+    """Use for timing a phase as a span, when the request handled is traced."""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+class SwitcherTimeoutError(Exception):
+    """A device did not answer in time, or the request's deadline was exceeded."""
+
+
+class SwitcherCircuitOpenError(Exception):
+    """The device's circuit breaker is open after consecutive connection failures.
+
+    Args:
+        device_id: the id of the device.
+        retry_in: seconds until the breaker lets a probe through to the device.
+
+    """
+
+    def __init__(self, device_id: str, retry_in: float) -> None:
+        """Initialize the error."""
+        super().__init__(f"device {device_id} is unreachable, circuit breaker is open")
+        self.retry_in = retry_in
+
+
+class SwitcherOverloadedError(Exception):
+    """A request was refused for exceeding a limit of the server, device or client.
+
+    Args:
+        message: what limit was exceeded.
+        retry_in: seconds until the request would be admitted.
+        limit: the limit exceeded, server, client or device.
+
+    """
+
+    def __init__(self, message: str, retry_in: float, limit: str) -> None:
+        """Initialize the error."""
+        super().__init__(message)
+        self.retry_in = retry_in
+        self.limit = limit
+
+
+class DeviceTimeouts(NamedTuple):
+    """Seconds to wait for each phase of talking to a device, 0 disables."""
+
+    connect: float = 0
+    login: float = 0
+    command: float = 0
+
+
+async def _within(awaitable: Awaitable[T], timeout: float, what: str) -> T:
+    """Use for awaiting with a timeout, 0 disables, raising a switcher timeout."""
+    if not timeout:
+        return await awaitable
+    try:
+        return await wait_for(awaitable, timeout)
+    except TimeoutError as exc:
+        raise SwitcherTimeoutError(f"{what} timed out after {timeout}s") from exc
+
+
+class SwitcherConnectionPool:
+    """Keep device connections open for reuse across requests.
+
+    Args:
+        idle_ttl: seconds an idle connection is kept open, 0 disables pooling.
+        metrics: metrics timing the connect, login and command phases.
+        timeouts: timeouts of the connect, login and command phases.
+
+    """
+
+    def __init__(
+        self,
+        idle_ttl: float = 0,
+        metrics: Optional[SwitcherMetrics] = None,
+        timeouts: DeviceTimeouts = DeviceTimeouts(),
+    ) -> None:
+        """Initialize the connection pool."""
+        self._idle_ttl = idle_ttl
+        self._metrics = metrics
+        self._timeouts = timeouts
+        self._idle: Dict[DeviceKey, List[Tuple[float, SwitcherApi]]] = {}
+        self._reaper: Optional["Task[None]"] = None
+
+    def start(self) -> None:
+        """Start evicting idle connections in the background."""
+        if self._idle_ttl > 0 and not self._reaper:
+            self._reaper = create_task(self._reap())
+
+    async def close(self) -> None:
+        """Stop the background eviction and disconnect all idle connections."""
+        if self._reaper:
+            self._reaper.cancel()
+            self._reaper = None
+        idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for _, swapi in connections:
+                await swapi.disconnect()
+
+    async def execute(
+        self,
+        key: DeviceKey,
+        command: Callable[[SwitcherApi], Awaitable[T]],
+        read: bool = False,
+    ) -> T:
+        """Run a command on a pooled connection, reconnecting if it went stale.
+
+        Only a read is sent again on a fresh connection when the stale one fails it,
+        a write might have reached the device before its socket was closed.
+        """
+        started = monotonic()
+        if self._metrics:
+            device = self._metrics.device_label(key.device_id)
+            self._metrics.device_in_flight.inc(device)
+        try:
+            return await self._execute(key, command, read)
+        except Exception as exc:
+            if self._metrics:
+                self._metrics.device_errors.inc(device, type(exc).__name__)
+            raise
+        finally:
+            if self._metrics:
+                self._metrics.device_in_flight.dec(device)
+            device_times = _device_times.get()
+            if device_times is not None:
+                device_times.append(monotonic() - started)
+
+    async def _execute(
+        self,
+        key: DeviceKey,
+        command: Callable[[SwitcherApi], Awaitable[T]],
+        read: bool,
+    ) -> T:
+        """Use for running the command, reconnecting if the connection went stale."""
+        swapi = await self._checkout(key)
+        reused = swapi is not None
+        if not swapi:
+            swapi = await self._connect(key)
+        try:
+            result = await self._command(key, swapi, command)
+        except Exception:
+            stale = reused and not _is_alive(swapi)
+            await swapi.disconnect()
+            if not stale or not read:
+                raise
+            # the device closed the pooled socket mid-command, retry on a fresh one
+            server_logger.debug("pooled connection was closed by the device")
+            swapi = await self._connect(key)
+            try:
+                result = await self._command(key, swapi, command)
+            except BaseException:
+                await swapi.disconnect()
+                raise
+        except BaseException:
+            await swapi.disconnect()
+            raise
+        await self._checkin(key, swapi)
+        return result
+
+    async def _connect(self, key: DeviceKey) -> SwitcherApi:
+        """Use for opening a new connection to the device."""
+        swapi = _create_api(key)
+        connect = _within(
+            swapi.connect(), self._timeouts.connect, f"connecting to {key.device_id}"
+        )
+        started = monotonic()
+        try:
+            with _span("connect"):
+                await connect
+        finally:
+            if self._metrics:
+                self._metrics.device_duration.observe(
+                    monotonic() - started,
+                    self._metrics.device_label(key.device_id),
+                    "connect",
+                )
+        self._wrap_login(key, swapi)
+        return swapi
+
+    def _wrap_login(self, key: DeviceKey, swapi: SwitcherApi) -> None:
+        """Use for bounding and timing the login every command of the api sends."""
+        if not self._metrics and not self._timeouts.login:
+            return
+        login = swapi._login
+
+        @wraps(login)
+        async def timed_login() -> Any:
+            started = monotonic()
+            try:
+                with _span("login"):
+                    return await _within(
+                        login(), self._timeouts.login, f"login to {key.device_id}"
+                    )
+            finally:
+                elapsed = monotonic() - started
+                if self._metrics:
+                    self._metrics.device_duration.observe(
+                        elapsed, self._metrics.device_label(key.device_id), "login"
+                    )
+                logins = _logins.get()
+                if logins is not None:
+                    logins.append(elapsed)
+
+        setattr(swapi, "_login", timed_login)
+
+    async def _command(
+        self,
+        key: DeviceKey,
+        swapi: SwitcherApi,
+        command: Callable[[SwitcherApi], Awaitable[T]],
+    ) -> T:
+        """Use for running the command, timed without the login it sends first."""
+        bounded = _within(
+            command(swapi), self._timeouts.command, f"command to {key.device_id}"
+        )
+        if not self._metrics:
+            with _span("command"):
+                return await bounded
+        logins: List[float] = []
+        token = _logins.set(logins)
+        started = monotonic()
+        try:
+            with _span("command"):
+                return await bounded
+        finally:
+            _logins.reset(token)
+            elapsed = monotonic() - started - sum(logins)
+            self._metrics.device_duration.observe(
+                elapsed, self._metrics.device_label(key.device_id), "command"
+            )
+
+    async def _checkout(self, key: DeviceKey) -> Optional[SwitcherApi]:
+        """Use for taking the most recently used live connection for the device."""
+        connections = self._idle.get(key)
+        while connections:
+            released, swapi = connections.pop()
+            if monotonic() - released < self._idle_ttl and _is_alive(swapi):
+                return swapi
+            await swapi.disconnect()
+        return None
+
+    async def _checkin(self, key: DeviceKey, swapi: SwitcherApi) -> None:
+        """Use for returning a connection to the pool, or closing it."""
+        if self._idle_ttl > 0 and _is_alive(swapi):
+            self._idle.setdefault(key, []).append((monotonic(), swapi))
+        else:
+            await swapi.disconnect()
+
+    async def _reap(self) -> None:
+        """Use for periodically disconnecting connections idle past the ttl."""
+        while True:
+            await sleep(self._idle_ttl / 2)
+            expiry = monotonic() - self._idle_ttl
+            expired: List[SwitcherApi] = []
+            for key, connections in list(self._idle.items()):
+                expired.extend(swapi for used, swapi in connections if used < expiry)
+                connections[:] = [c for c in connections if c[0] >= expiry]
+                if not connections:
+                    del self._idle[key]
+            for swapi in expired:
+                await swapi.disconnect()
+
+
+APP_POOL = web.AppKey("pool", SwitcherConnectionPool)
+
+
+# failures telling the device is unreachable, rather than it refusing the command
+DEVICE_FAILURES = (OSError, EOFError, SwitcherTimeoutError)
+
+
+class DeviceCircuit:
+    """Consecutive connection failures of a device and when to probe it next."""
+
+    def __init__(self) -> None:
+        """Initialize the circuit."""
+        self.failures = 0
+        self.backoff = 0.0
+        self.retry_at = 0.0
+        self.probing = False
+
+
+class SwitcherCircuitBreaker:
+    """Fail commands fast for devices whose connections keep failing.
+
+    After consecutive connection failures the device's breaker opens, failing its
+    commands without touching the network. Once the backoff passes, a single probe
+    command is let through, closing the breaker if it succeeds and doubling the
+    backoff if it fails.
+
+    Args:
+        failures: consecutive failures opening the breaker, 0 disables it.
+        backoff: seconds before the first probe of an opened breaker.
+        max_backoff: max seconds between probes.
+        max_entries: number of devices whose last read responses are kept for
+            answering while their breaker is open.
+
+    """
+
+    def __init__(
+        self,
+        failures: int = 0,
+        backoff: float = 1,
+        max_backoff: float = 60,
+        max_entries: int = 1024,
+    ) -> None:
+        """Initialize the circuit breaker."""
+        self._failures = failures
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._max_entries = max_entries
+        self._circuits: Dict[Tuple[str, str], DeviceCircuit] = {}
+        self._last_known: "OrderedDict[DeviceKey, Dict[Hashable, Any]]" = OrderedDict()
+
+    @contextmanager
+    def guard(self, key: DeviceKey) -> Iterator[None]:
+        """Guard a command sent to the device, raising if its breaker is open."""
+        if self._failures <= 0:
+            yield
+            return
+        device = (key.ip_address, key.device_id)
+        circuit = self._circuits.get(device)
+        if circuit and circuit.failures >= self._failures:
+            retry_in = circuit.retry_at - monotonic()
+            if circuit.probing or retry_in > 0:
+                raise SwitcherCircuitOpenError(key.device_id, max(retry_in, 0))
+            circuit.probing = True
+        try:
+            yield
+        except DEVICE_FAILURES:
+            self._failed(device)
+            raise
+        except Exception:
+            # the device answered, refusing the command is not a connection failure
+            self._circuits.pop(device, None)
+            raise
+        except BaseException:
+            if circuit:
+                circuit.probing = False
+            raise
+        else:
+            self._circuits.pop(device, None)
+
+    def _failed(self, device: Tuple[str, str]) -> None:
+        """Use for counting a failure, opening the breaker or backing off further."""
+        circuit = self._circuits.setdefault(device, DeviceCircuit())
+        circuit.failures += 1
+        circuit.probing = False
+        if circuit.failures < self._failures:
+            return
+        if circuit.failures == self._failures:
+            circuit.backoff = self._backoff
+        else:
+            circuit.backoff = min(circuit.backoff * 2, self._max_backoff)
+        circuit.retry_at = monotonic() + circuit.backoff
+        server_logger.warning(
+            f"circuit breaker of device {device[1]} is open for {circuit.backoff}s"
+        )
+
+    def remember(self, key: DeviceKey, read: Hashable, response: Any) -> None:
+        """Keep the device's read response for answering while its breaker is open."""
+        if self._failures <= 0:
+            return
+        self._last_known.setdefault(key, {})[read] = response
+        self._last_known.move_to_end(key)
+        if len(self._last_known) > self._max_entries:
+            self._last_known.popitem(last=False)
+
+    def forget(self, key: DeviceKey) -> None:
+        """Drop the device's read responses, outdated by a write."""
+        self._last_known.pop(key, None)
+
+    def last_known(self, key: DeviceKey, read: Hashable) -> Optional[Any]:
+        """Return the last read response of the device, if any."""
+        return self._last_known.get(key, {}).get(read)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Return the state of the breakers of the failing devices."""
+        now = monotonic()
+        stats = []
+        for (ip_address, device_id), circuit in self._circuits.items():
+            if circuit.failures < self._failures:
+                state = "closed"
+            elif circuit.probing or circuit.retry_at <= now:
+                state = "half_open"
+            else:
+                state = "open"
+            stats.append(
+                {
+                    KEY_IP: ip_address,
+                    KEY_DEVICE_ID: device_id,
+                    KEY_STATE: state,
+                    "failures": circuit.failures,
+                    "retry_in": max(circuit.retry_at - now, 0),
+                }
+            )
+        return stats
+
+
+APP_BREAKER = web.AppKey("breaker", SwitcherCircuitBreaker)
+
+
+@asynccontextmanager
+async def _file_lock(path: str, timeout: float, what: str) -> AsyncIterator[None]:
+    """Use for holding an flock of the file, waiting up to the timeout, 0 disables."""
+    while True:
+        fd = await _flock(path, timeout, what)
+        # the file may be removed by a sweep while waiting, locked again once created
+        try:
+            if fstat(fd).st_ino == stat(path).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        close(fd)
+    try:
+        yield
+    finally:
+        close(fd)
+
+
+async def _flock(path: str, timeout: float, what: str) -> int:
+    """Use for opening the file and waiting for its flock, returning the locked fd."""
+    # opened per hold, locks of separate opens exclude each other in a process too
+    fd = open_fd(path, O_RDWR | O_CREAT)
+    try:
+        flock(fd, LOCK_EX | LOCK_NB)
+    except BlockingIOError:
+        # held by another process, waited for in a thread not to block the loop
+        locked = get_running_loop().run_in_executor(None, flock, fd, LOCK_EX)
+        try:
+            with _span("lock"):
+                await _within(shield(locked), timeout, what)
+        except BaseException:
+            # closing the file once the thread got the lock releases it
+            locked.add_done_callback(lambda _: close(fd))
+            raise
+    except BaseException:
+        close(fd)
+        raise
+    return fd
+
+
+class SwitcherDeviceLocks:
+    """Locks shared by the worker processes, one for each device.
+
+    The locks are flock()s of files in a directory shared by the workers. The
+    kernel releases a worker's locks when it dies, so a crashed worker does not
+    leave its devices locked for the workers restarted after it.
+
+    Args:
+        directory: the directory of the lock files.
+        timeout: seconds to wait for a lock held by another worker, 0 disables.
+
+    """
+
+    def __init__(self, directory: str, timeout: float = 0) -> None:
+        """Initialize the device locks."""
+        self._directory = directory
+        self._timeout = timeout
+
+    def path(self, key: DeviceKey) -> str:
+        """Return the path of the device's lock file."""
+        device = f"{key.ip_address}:{key.device_id}".encode()
+        return join(self._directory, f"{sha256(device).hexdigest()}.lock")
+
+    def hold(self, key: DeviceKey) -> AsyncContextManager[None]:
+        """Hold the device's lock, waiting for the worker holding it."""
+        return _file_lock(self.path(key), self._timeout, f"device {key.device_id} lock")
+
+
+class SwitcherCommandQueue:
+    """Run the commands sent to each device one at a time, in arrival order.
+
+    Identical reads submitted while one is already queued or running share that
+    single device round-trip and its result.
+
+    Args:
+        pool: the connection pool used for executing the commands.
+        device_locks: locks shared with the other worker processes, so only one
+            worker talks to a device at a time.
+        breaker: the circuit breaker failing commands fast for unreachable devices.
+        max_queued: max number of commands queued for a device, 0 is unlimited.
+
+    """
+
+    def __init__(
+        self,
+        pool: SwitcherConnectionPool,
+        device_locks: Optional["SwitcherDeviceLocks"] = None,
+        breaker: Optional[SwitcherCircuitBreaker] = None,
+        max_queued: int = 0,
+    ) -> None:
+        """Initialize the command queue."""
+        self._pool = pool
+        self._device_locks = device_locks
+        self._breaker = breaker or SwitcherCircuitBreaker()
+        self._max_queued = max_queued
+        self._locks: Dict[Tuple[str, str], Lock] = {}
+        self._queued: Dict[Tuple[str, str], int] = {}
+        self._reads: Dict[Tuple[DeviceKey, Hashable], "Task[Any]"] = {}
+
+    async def submit(
+        self,
+        key: DeviceKey,
+        command: Callable[[SwitcherApi], Awaitable[T]],
+        read: Optional[Hashable] = None,
+    ) -> T:
+        """Queue a command for the device, reads are shared by their read key."""
+        if read is None:
+            return await self._run(key, command, False)
+        read_key = (key, read)
+        task = self._reads.get(read_key)
+        if not task:
+            task = create_task(self._run(key, command, True))
+            self._reads[read_key] = task
+            task.add_done_callback(lambda _: self._reads.pop(read_key, None))
+        # shielded so one caller going away does not cancel the others' read
+        return await shield(task)
+
+    async def _run(
+        self,
+        key: DeviceKey,
+        command: Callable[[SwitcherApi], Awaitable[T]],
+        read: bool,
+    ) -> T:
+        """Use for executing the command once the device's earlier commands are done."""
+        device = (key.ip_address, key.device_id)
+        if self._max_queued and self._queued.get(device, 0) >= self._max_queued:
+            raise SwitcherOverloadedError(
+                f"device {key.device_id} has too many commands queued", 1, "device"
+            )
+        lock = self._locks.setdefault(device, Lock())
+        self._queued[device] = self._queued.get(device, 0) + 1
+        try:
+            # asyncio locks wake their waiters in fifo order
+            with _span("queue"):
+                await lock.acquire()
+            try:
+                hold = (
+                    self._device_locks.hold(key)
+                    if self._device_locks
+                    else nullcontext()
+                )
+                # held outside the breaker, waiting for a worker is no device failure
+                async with hold:
+                    with self._breaker.guard(key):
+                        return await self._pool.execute(key, command, read)
+            finally:
+                lock.release()
+        finally:
+            self._queued[device] -= 1
+            if not self._queued[device]:
+                del self._queued[device]
+                del self._locks[device]
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Return the number of commands queued for each busy device."""
+        return [
+            {KEY_IP: ip, KEY_DEVICE_ID: device_id, "queued": queued}
+            for (ip, device_id), queued in self._queued.items()
+        ]
+
+
+APP_QUEUE = web.AppKey("queue", SwitcherCommandQueue)
+
+
+class TokenBucket:
+    """Requests a client can send at once, refilled at the rate limit."""
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float) -> None:
+        """Initialize the bucket."""
+        self.tokens = tokens
+        self.updated = updated
+
+
+class SwitcherLimiter:
+    """Admission of the requests, bounding those handled at once and each client's rate.
+
+    Requests over a limit are refused right away instead of waiting, for the
+    clients to back off rather than piling up on the server and the devices.
+    The limits are kept by each worker process, each admitting its share of them for
+    the workers together not to go over the limits.
+
+    Args:
+        max_requests: max number of requests handled at once, 0 is unlimited.
+        rate: requests per second allowed for each client, 0 is unlimited.
+        burst: requests a client can send at once, the size of its token bucket.
+        max_clients: number of client buckets kept before evicting the oldest used.
+        workers: number of worker processes sharing the limits.
+
+    """
+
+    def __init__(
+        self,
+        max_requests: int = 0,
+        rate: float = 0,
+        burst: int = 10,
+        max_clients: int = 1024,
+        workers: int = 1,
+    ) -> None:
+        """Initialize the limiter."""
+        self._max_requests = ceil(max_requests / workers)
+        self._rate = rate / workers
+        self._burst = max(ceil(burst / workers), 1)
+        self._max_clients = max_clients
+        self._workers = workers
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.in_flight = 0
+
+    @contextmanager
+    def admit(self, client: str, counted: bool = True) -> Iterator[None]:
+        """Admit the client's request, counting it while handled unless told not to."""
+        if counted and self._max_requests and self.in_flight >= self._max_requests:
+            raise SwitcherOverloadedError(
+                "server is handling too many requests", 1, "server"
+            )
+        if self._rate > 0:
+            self._take(client)
+        if not counted:
+            yield
+            return
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    def _take(self, client: str) -> None:
+        """Use for taking a token of the client's bucket, refilled since last taken."""
+        now = monotonic()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self._burst, now)
+            if len(self._buckets) > self._max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+            bucket.tokens = min(
+                bucket.tokens + (now - bucket.updated) * self._rate, self._burst
+            )
+            bucket.updated = now
+        if bucket.tokens < 1:
+            raise SwitcherOverloadedError(
+                f"client {client} is rate limited",
+                (1 - bucket.tokens) / self._rate,
+                "client",
+            )
+        bucket.tokens -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the limits, the requests handled and the clients being limited."""
+        now = monotonic()
+        clients = []
+        for client, bucket in self._buckets.items():
+            tokens = min(
+                bucket.tokens + (now - bucket.updated) * self._rate, self._burst
+            )
+            if tokens < self._burst:
+                clients.append({KEY_IP: client, "tokens": tokens})
+        return {
+            "in_flight": self.in_flight,
+            "max_requests": self._max_requests,
+            "rate": self._rate,
+            "burst": self._burst,
+            "workers": self._workers,
+            "worker": getpid(),
+            "clients": clients,
+        }
+
+
+APP_LIMITER = web.AppKey("limiter", SwitcherLimiter)
+
+
+class SwitcherStateCache:
+    """Latest state broadcast by each device, keyed by the device id.
+
+    Args:
+        max_age: default seconds a broadcast state is considered fresh.
+
+    """
+
+    def __init__(self, max_age: float = 0) -> None:
+        """Initialize the state cache."""
+        self._max_age = max_age
+        self._devices: Dict[str, Tuple[float, SwitcherBase]] = {}
+
+    def update(self, device: SwitcherBase) -> None:
+        """Store the device's broadcast state, used as the bridge callback."""
+        self._devices[device.device_id] = (monotonic(), device)
+
+    def discard(self, device_id: str) -> None:
+        """Drop the device's broadcast state, it is stale after writing to it."""
+        self._devices.pop(device_id, None)
+
+    def get(
+        self, device_id: str, max_age: Optional[float] = None
+    ) -> Optional[SwitcherBase]:
+        """Return the device's state if it was broadcast within the max age."""
+        entry = self._devices.get(device_id)
+        if not entry:
+            return None
+        if monotonic() - entry[0] > (self._max_age if max_age is None else max_age):
+            return None
+        return entry[1]
+
+
+class SwitcherDiscovery:
+    """Devices found by their udp broadcasts, indexed by the device id.
+
+    Args:
+        broadcast_ports: udp ports listened on while scanning.
+        continuous: the devices are updated by the running bridge, not by scans.
+
+    """
+
+    def __init__(self, broadcast_ports: List[int], continuous: bool = False) -> None:
+        """Initialize the discovery."""
+        self._broadcast_ports = broadcast_ports
+        self._continuous = continuous
+        self._devices: Dict[str, Dict[str, Any]] = {}
+        self._scan: Optional["Task[None]"] = None
+        self._scan_started = 0.0
+
+    def update(self, device: SwitcherBase) -> None:
+        """Index the device's descriptor, stamping when it was last seen."""
+        descriptor = self._devices.get(device.device_id)
+        if (
+            descriptor is None
+            or descriptor[KEY_IP] != device.ip_address
+            or descriptor[KEY_NAME] != device.name
+        ):
+            descriptor = {
+                KEY_TYPE: DEVICE_TYPES[device.device_type],
+                KEY_IP: device.ip_address,
+                KEY_ID: device.device_id,
+                KEY_LOGIN_KEY: device.device_key,
+                KEY_NAME: device.name,
+            }
+            self._devices[device.device_id] = descriptor
+        descriptor[KEY_LAST_SEEN] = time()
+
+    async def discover(self, window: float) -> List[Dict[str, Any]]:
+        """Return the devices seen within the window, scanning for it if not running.
+
+        Concurrent discoveries share a single scan, the ports can only be bound once.
+        """
+        if self._continuous:
+            since = time() - window
+        else:
+            if not self._scan:
+                self._scan_started = time()
+                self._scan = create_task(self._listen(window))
+            since = self._scan_started
+            await shield(self._scan)
+        return [d for d in self._devices.values() if d[KEY_LAST_SEEN] >= since]
+
+    async def _listen(self, window: float) -> None:
+        """Use for listening to the broadcasts for the window."""
+        bridge = SwitcherBridge(self.update, self._broadcast_ports)
+        try:
+            await bridge.start()
+            await sleep(window)
+        finally:
+            await bridge.stop()
+            self._scan = None
+
+
+GET_STATE_KEYS = (
+    "state",
+    "time_left",
+    "time_on",
+    "auto_shutdown",
+    "power_consumption",
+    "electric_current",
+)
+
+APP_STATES = web.AppKey("states", SwitcherStateCache)
+APP_BRIDGE = web.AppKey("bridge", SwitcherBridge)
+APP_DISCOVERY = web.AppKey("discovery", SwitcherDiscovery)
+
+
+def _cached_device(
+    app: web.Application, query: Mapping[str, str]
+) -> Optional[SwitcherBase]:
+    """Use for getting the device's broadcast state if fresh enough for the request."""
+    max_age = query.get(KEY_MAX_AGE)
+    return app[APP_STATES].get(
+        _resolve_device_key(app, query).device_id,
+        float(max_age) if max_age is not None else None,
+    )
+
+
+def _broadcast_state(device: SwitcherBase) -> Dict[str, object]:
+    """Use for shaping a broadcast water heater or plug state as get_state does."""
+    state: Dict[str, object] = {"state": device.device_state.name}
+    if isinstance(device, SwitcherTimedBase):
+        state["time_left"] = device.remaining_time
+        state["auto_shutdown"] = device.auto_shutdown
+    if isinstance(device, SwitcherPowerBase):
+        state["power_consumption"] = device.power_consumption
+        state["electric_current"] = device.electric_current
+    return state
+
+
+def _cached_state(device: SwitcherBase) -> Dict[str, object]:
+    """Use for answering get_state from a broadcast with the keys of a live read.
+
+    The broadcasts lack some keys of the read, those are answered as null.
+    """
+    state: Dict[str, object] = dict.fromkeys(GET_STATE_KEYS)
+    state.update(_broadcast_state(device))
+    return state
+
+
+def _broadcast_breeze_state(device: SwitcherThermostat) -> Dict[str, object]:
+    """Use for shaping a broadcast thermostat state as get_breeze_state does."""
+    return {
+        "state": device.device_state.name,
+        "mode": device.mode.name,
+        "fan_level": device.fan_level.name,
+        "temperature": device.temperature,
+        "target_temperature": device.target_temperature,
+        "swing": device.swing.name,
+        "remote_id": device.remote_id,
+    }
+
+
+def _broadcast_shutter_state(
+    device: Union[SwitcherShutterBase, SwitcherSingleShutterDualLightBase]
+) -> Dict[str, object]:
+    """Use for shaping a broadcast shutter state as get_shutter_state does."""
+    state: Dict[str, object] = {
+        "position": device.position,
+        "direction": device.direction.name,
+    }
+    if isinstance(device, SwitcherSingleShutterDualLightBase):
+        state["lights"] = [light.name for light in device.lights]
+    return state
+
+
+def _stream_state(device: SwitcherBase) -> Dict[str, object]:
+    """Use for shaping a broadcast state of any device for the stream subscribers."""
+    if isinstance(device, SwitcherThermostat):
+        return _broadcast_breeze_state(device)
+    if isinstance(device, (SwitcherShutterBase, SwitcherSingleShutterDualLightBase)):
+        return _broadcast_shutter_state(device)
+    return _broadcast_state(device)
+
+
+SNAPSHOT_STATE_KEYS: Dict[DeviceCategory, Tuple[str, ...]] = {
+    DeviceCategory.WATER_HEATER: (
+        "state",
+        "time_left",
+        "auto_shutdown",
+        "power_consumption",
+        "electric_current",
+    ),
+    DeviceCategory.POWER_PLUG: ("state", "power_consumption", "electric_current"),
+    DeviceCategory.THERMOSTAT: (
+        "state",
+        "mode",
+        "fan_level",
+        "temperature",
+        "target_temperature",
+        "swing",
+        "remote_id",
+    ),
+    DeviceCategory.SHUTTER: ("position", "direction"),
+    DeviceCategory.SINGLE_SHUTTER_DUAL_LIGHT: ("position", "direction"),
+}
+
+
+def _snapshot_state(
+    device_type: DeviceType, state: Mapping[str, Any]
+) -> Dict[str, Any]:
+    """Use for shaping a read or broadcast state to the keys both of them carry.
+
+    The snapshot is fed by the reads, the polls and the broadcasts, a state shaped
+    by its source would look changed each time the source of a device changes.
+    """
+    return {
+        name: state[name]
+        for name in SNAPSHOT_STATE_KEYS[device_type.category]
+        if name in state
+    }
+
+
+class SwitcherStateSubscription:
+    """State deltas pending for one stream subscriber.
+
+    Deltas published while the subscriber is busy are merged per device, so a
+    slow client gets the latest values instead of an ever growing backlog.
+
+    Args:
+        device_ids: ids of the devices to receive deltas for.
+
+    """
+
+    def __init__(self, device_ids: Set[str]) -> None:
+        """Initialize the subscription."""
+        self.device_ids = device_ids
+        self.closed = False
+        self._pending: Dict[str, Dict[str, object]] = {}
+        self._event = Event()
+
+    def push(self, device_id: str, delta: Dict[str, object]) -> None:
+        """Merge a delta into the ones pending for the subscriber."""
+        self._pending.setdefault(device_id, {}).update(delta)
+        self._event.set()
+
+    def close(self) -> None:
+        """Wake the subscriber up for it to stop streaming."""
+        self.closed = True
+        self._event.set()
+
+    async def next(self, timeout: float) -> Dict[str, Dict[str, object]]:
+        """Wait for the pending deltas, empty if none were published in time."""
+        try:
+            await wait_for(self._event.wait(), timeout)
+        except TimeoutError:
+            return {}
+        self._event.clear()
+        pending, self._pending = self._pending, {}
+        return pending
+
+
+class SwitcherStateHub:
+    """Fan out of the devices state changes to the stream subscribers.
+
+    The devices are fed by their broadcasts and their polls, each subscriber only
+    gets the keys that changed since the last published state. A key missing from
+    a state keeps its last value, as the polls do not carry every broadcast key.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the state hub."""
+        self._states: Dict[str, Dict[str, object]] = {}
+        self._subscriptions: Set[SwitcherStateSubscription] = set()
+
+    def publish(self, device: SwitcherBase) -> None:
+        """Push the changed keys of the device's broadcast state to its subscribers."""
+        self.publish_state(device.device_id, _stream_state(device))
+
+    def publish_state(self, device_id: str, state: Mapping[str, object]) -> None:
+        """Push the changed keys of the device's state to its subscribers."""
+        previous = self._states.get(device_id, {})
+        delta = {k: v for k, v in state.items() if previous.get(k) != v}
+        if not delta:
+            return
+        self._states[device_id] = {**previous, **delta}
+        for subscription in self._subscriptions:
+            if device_id in subscription.device_ids:
+                subscription.push(device_id, delta)
+
+    def subscribe(self, device_ids: Set[str]) -> SwitcherStateSubscription:
+        """Subscribe for deltas, starting with the last known full states."""
+        subscription = SwitcherStateSubscription(device_ids)
+        self._subscriptions.add(subscription)
+        self.resend(subscription, device_ids)
+        return subscription
+
+    def resend(
+        self, subscription: SwitcherStateSubscription, device_ids: Set[str]
+    ) -> None:
+        """Push the last known full states of the devices to the subscriber."""
+        for device_id in device_ids:
+            if device_id in self._states:
+                subscription.push(device_id, self._states[device_id])
+
+    def unsubscribe(self, subscription: SwitcherStateSubscription) -> None:
+        """Stop pushing deltas to the subscriber."""
+        self._subscriptions.discard(subscription)
+
+    def close(self) -> None:
+        """Wake all subscribers up for them to stop streaming."""
+        for subscription in self._subscriptions:
+            subscription.close()
+
+
+APP_HUB = web.AppKey("hub", SwitcherStateHub)
+
+
+class SwitcherStateSnapshot:
+    """Last known state of every device, versioned for fetching only what changed.
+
+    Every state change bumps the snapshot version and stamps the device with it,
+    a client passing the version it has gets the devices changed since.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the state snapshot."""
+        self.version = 0
+        self._states: Dict[str, Tuple[int, Any]] = {}
+
+    def update(self, device_id: str, state: Any) -> None:
+        """Store the device's state, bumping the version if it changed."""
+        entry = self._states.get(device_id)
+        if entry and entry[1] == state:
+            return
+        self.version += 1
+        self._states[device_id] = (self.version, state)
+
+    def changed(
+        self, since: int = 0, device_ids: Optional[Set[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """Return the states changed after the version, of the devices if given."""
+        if since >= self.version:
+            return []
+        entries = (
+            self._states.items()
+            if device_ids is None
+            else [(d, self._states[d]) for d in device_ids if d in self._states]
+        )
+        return [
+            {KEY_DEVICE_ID: device_id, KEY_VERSION: version, KEY_STATE: state}
+            for device_id, (version, state) in sorted(entries, key=lambda e: e[1][0])
+            if version > since
+        ]
+
+
+APP_SNAPSHOT = web.AppKey("snapshot", SwitcherStateSnapshot)
+
+
+class SwitcherResponseCache:
+    """Serialized read responses kept for a ttl, evicting the least recently used.
+
+    Args:
+        ttl: seconds a response is served from the cache, 0 disables caching.
+        max_entries: number of responses kept before evicting the oldest used.
+
+    """
+
+    def __init__(self, ttl: float = 0, max_entries: int = 1024) -> None:
+        """Initialize the response cache."""
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[DeviceKey, Hashable], Tuple[float, Any]]" = (
+            OrderedDict()
+        )
+        self._generations: Dict[Tuple[str, str], int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def generation(self, key: DeviceKey) -> int:
+        """Return the device's generation, bumped by every invalidation."""
+        return self._generations.get((key.ip_address, key.device_id), 0)
+
+    def get(self, key: DeviceKey, read: Hashable) -> Optional[Any]:
+        """Return the cached response of the device's read if not expired."""
+        if self._ttl <= 0:
+            return None
+        entry = self._entries.get((key, read))
+        if entry and monotonic() - entry[0] < self._ttl:
+            self._entries.move_to_end((key, read))
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(
+        self, key: DeviceKey, read: Hashable, response: Any, generation: int
+    ) -> None:
+        """Cache the device's read response unless invalidated since it was sent."""
+        if self._ttl <= 0 or generation != self.generation(key):
+            return
+        self._entries[(key, read)] = (monotonic(), response)
+        self._entries.move_to_end((key, read))
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: DeviceKey) -> None:
+        """Drop every cached response of the device, used after writing to it."""
+        device = (key.ip_address, key.device_id)
+        self._generations[device] = self._generations.get(device, 0) + 1
+        for cached in [k for k in self._entries if k[0][1:3] == device]:
+            del self._entries[cached]
+
+    def stats(self) -> Dict[str, float]:
+        """Return the cache counters and configuration."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "max_entries": self._max_entries,
+            "ttl": self._ttl,
+        }
+
+
+APP_CACHE = web.AppKey("cache", SwitcherResponseCache)
+
+
+class SwitcherEncodedResponses:
+    """Last encoded body and etag of each read, reused while its response is the same.
+
+    Responses answered from the caches are the same objects, and comparing an
+    uncached one to the last is cheaper than encoding it, so an unchanged
+    response is encoded and hashed once.
+
+    Args:
+        dumps: the json encoder of the responses.
+        max_entries: number of reads kept before evicting the oldest used.
+
+    """
+
+    def __init__(self, dumps: Callable[[Any], str], max_entries: int = 1024) -> None:
+        """Initialize the encoded responses."""
+        self._dumps = dumps
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[Any, str, str]]" = OrderedDict()
+
+    def encode(self, read: Hashable, response: Any) -> Tuple[str, str]:
+        """Return the encoded response and its etag, a hash of the encoded body."""
+        entry = self._entries.get(read)
+        if entry and (entry[0] is response or entry[0] == response):
+            self._entries.move_to_end(read)
+            return entry[1], entry[2]
+        text = self._dumps(response)
+        etag = f"{crc32(text.encode()):08x}"
+        self._entries[read] = (response, text, etag)
+        self._entries.move_to_end(read)
+        if len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+        return text, etag
+
+
+APP_ENCODED = web.AppKey("encoded", SwitcherEncodedResponses)
+
+
+class SwitcherIdempotentWrites:
+    """Results of the writes by their idempotency key, kept for a ttl.
+
+    A repeated key is answered the original result, waiting for it while the
+    first write is in flight, so a retried write reaches the device once. Failed
+    writes are forgotten, for their retries to run again.
+
+    With a directory shared by the workers, a key's write holds the key's lock there
+    and stores its result there, for a retry reaching another worker to be replayed.
+
+    Args:
+        ttl: seconds a result is replayed for, counted from the first write.
+        max_entries: number of keys kept before evicting the oldest used.
+        directory: the directory the workers share the results in.
+
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600,
+        max_entries: int = 1024,
+        directory: Optional[str] = None,
+    ) -> None:
+        """Initialize the idempotent writes."""
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._directory = directory
+        self._swept = monotonic()
+        self._entries: "OrderedDict[str, Tuple[float, Hashable, Future[Any]]]" = (
+            OrderedDict()
+        )
+
+    async def run(
+        self, key: str, request: Hashable, write: Callable[[], Awaitable[T]]
+    ) -> Tuple[T, bool]:
+        """Return the write's result and whether it was replayed for a repeated key.
+
+        The request identifies the write, a key reused for another one is refused.
+        """
+        entry = self._entries.get(key)
+        if entry and monotonic() - entry[0] < self._ttl:
+            if entry[1] != request:
+                raise ValueError(
+                    f"failed to replay {HEADER_IDEMPOTENCY_KEY} {key},"
+                    " it was sent with another request"
+                )
+            self._entries.move_to_end(key)
+            # shielded so one caller going away does not cancel the others' write
+            result, _ = await shield(entry[2])
+            return result, True
+        task = ensure_future(self._write_once(key, request, write))
+        self._entries[key] = (monotonic(), request, task)
+        self._entries.move_to_end(key)
+        task.add_done_callback(lambda done: self._forget_failed(key, done))
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+        return await shield(task)
+
+    async def _write_once(
+        self, key: str, request: Hashable, write: Callable[[], Awaitable[T]]
+    ) -> Tuple[T, bool]:
+        """Use for running the write unless another worker did, replaying its result."""
+        if not self._directory:
+            return await write(), False
+        digest = sha256(key.encode()).hexdigest()
+        path = join(self._directory, f"{digest}.json")
+        fingerprint = dumps(request)
+        # locked by key, only the retries of the write wait for it
+        async with _file_lock(
+            join(self._directory, f"{digest}.lock"),
+            0,
+            f"{HEADER_IDEMPOTENCY_KEY} {key} lock",
+        ):
+            try:
+                with open(path) as stored_file:
+                    stored = load(stored_file)
+            except (FileNotFoundError, ValueError):
+                stored = None
+            if stored and stored["expires"] > time():
+                if stored["request"] != fingerprint:
+                    raise ValueError(
+                        f"failed to replay {HEADER_IDEMPOTENCY_KEY} {key},"
+                        " it was sent with another request"
+                    )
+                return stored["result"], True
+            result = await write()
+            stored = {"expires": time() + self._ttl, "request": fingerprint}
+            await get_running_loop().run_in_executor(
+                None, _write_atomically, path, dumps({**stored, "result": result})
+            )
+        if monotonic() - self._swept > IDEMPOTENCY_SWEEP_INTERVAL:
+            self._swept = monotonic()
+            await get_running_loop().run_in_executor(None, self._sweep)
+        return result, False
+
+    def _sweep(self) -> None:
+        """Use for deleting the expired results and locks of the keys no one holds."""
+        directory = cast(str, self._directory)
+        expired = time() - self._ttl
+        for entry in scandir(directory):
+            if not entry.name.endswith(".lock"):
+                continue
+            result = f"{entry.path[: -len('.lock')]}.json"
+            try:
+                if entry.stat().st_mtime >= expired:
+                    continue
+                fd = open_fd(entry.path, O_RDWR)
+            except FileNotFoundError:
+                continue
+            try:
+                # a key being written is locked, its result is checked once locked
+                flock(fd, LOCK_EX | LOCK_NB)
+                if exists(result) and stat(result).st_mtime >= expired:
+                    continue
+                for path in (result, entry.path):
+                    try:
+                        remove(path)
+                    except FileNotFoundError:
+                        pass
+            except BlockingIOError:
+                pass
+            finally:
+                close(fd)
+
+    def _forget_failed(self, key: str, task: "Future[Any]") -> None:
+        """Use for dropping the key of a failed write, letting it be retried."""
+        entry = self._entries.get(key)
+        if entry and entry[2] is task and (task.cancelled() or task.exception()):
+            del self._entries[key]
+
+
+APP_IDEMPOTENT = web.AppKey("idempotent", SwitcherIdempotentWrites)
+
+
+PolledRead = Tuple[Hashable, Callable[[SwitcherApi], Awaitable[Any]]]
+
+
+def _polled_read(key: DeviceKey) -> PolledRead:
+    """Use for picking the state read of the device, keyed as its endpoint keys it."""
+    if key.device_type.category == DeviceCategory.THERMOSTAT:
+        return ENDPOINT_GET_BREEZE_STATE, lambda swapi: swapi.get_breeze_state()
+    if key.device_type.category in (
+        DeviceCategory.SHUTTER,
+        DeviceCategory.SINGLE_SHUTTER_DUAL_LIGHT,
+    ):
+        return (ENDPOINT_GET_SHUTTER_STATE, 0), lambda swapi: swapi.get_shutter_state(0)
+    return ENDPOINT_GET_STATE, lambda swapi: swapi.get_state()
+
+
+class SwitcherPoller:
+    """Poll the state of the registered devices, adapting each device's interval.
+
+    A device is polled at the min interval after a write or a state change, the
+    interval doubling up to the max while its state is stable. Polls are jittered
+    for the devices not to be hit at the same moment.
+
+    Args:
+        registry: the registered devices to poll.
+        queue: the command queue the polls are sent through, shared with requests.
+        min_interval: seconds between polls after a write or a state change.
+        max_interval: max seconds between polls of a stable state.
+        concurrency: max number of devices polled at once.
+        snapshot: the state snapshot updated with the polled states.
+        hub: the state hub the polled states are published to.
+
+    """
+
+    def __init__(
+        self,
+        registry: SwitcherDeviceRegistry,
+        queue: SwitcherCommandQueue,
+        min_interval: float = 2,
+        max_interval: float = 60,
+        concurrency: int = 4,
+        snapshot: Optional[SwitcherStateSnapshot] = None,
+        hub: Optional[SwitcherStateHub] = None,
+    ) -> None:
+        """Initialize the poller."""
+        self._registry = registry
+        self._snapshot = snapshot
+        self._hub = hub
+        self._queue = queue
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._semaphore = Semaphore(concurrency)
+        self._intervals: Dict[DeviceKey, float] = {}
+        self._due: Dict[DeviceKey, float] = {}
+        self._states: Dict[DeviceKey, Tuple[Hashable, Any]] = {}
+        self._polls: Set["Task[None]"] = set()
+        self._wake: Optional["Future[None]"] = None
+        self._scheduler: Optional["Task[None]"] = None
+
+    def start(self) -> None:
+        """Start polling in the background."""
+        if not self._scheduler:
+            self._scheduler = create_task(self._schedule())
+
+    async def stop(self) -> None:
+        """Stop polling, cancelling the polls in flight."""
+        tasks = list(self._polls)
+        if self._scheduler:
+            tasks.append(self._scheduler)
+            self._scheduler = None
+        for task in tasks:
+            task.cancel()
+        await gather(*tasks, return_exceptions=True)
+
+    def get(self, key: DeviceKey, read: Hashable) -> Optional[Any]:
+        """Return the last polled state of the device, if it is the read polled."""
+        state = self._states.get(key)
+        if state and state[0] == read:
+            return state[1]
+        return None
+
+    def written(self, key: DeviceKey) -> None:
+        """Drop the device's polled state, polling it again right away."""
+        self._states.pop(key, None)
+        if key in self._due:
+            self._intervals[key] = self._min_interval
+            self._due[key] = min(self._due[key], monotonic())
+            self._wake_up()
+
+    async def _schedule(self) -> None:
+        """Use for starting the due polls, sleeping until the next one is due."""
+        loop = get_running_loop()
+        while True:
+            self._sync()
+            now = monotonic()
+            for key, due in self._due.items():
+                if due <= now:
+                    # not due again until the poll is done and reschedules it
+                    self._due[key] = float("inf")
+                    task = create_task(self._poll(key))
+                    self._polls.add(task)
+                    task.add_done_callback(self._polls.discard)
+            next_due = min(self._due.values(), default=now + self._max_interval)
+            self._wake = loop.create_future()
+            timer = loop.call_later(
+                min(next_due - now, self._max_interval), self._wake_up
+            )
+            try:
+                await self._wake
+            finally:
+                timer.cancel()
+
+    def _wake_up(self) -> None:
+        """Use for waking the scheduler up to start the polls due."""
+        if self._wake and not self._wake.done():
+            self._wake.set_result(None)
+
+    def _sync(self) -> None:
+        """Use for scheduling the newly registered devices, dropping the removed."""
+        keys = self._registry.keys()
+        for key in keys - self._due.keys():
+            self._intervals[key] = self._min_interval
+            self._due[key] = monotonic() + self._jittered(self._min_interval)
+        for key in self._due.keys() - keys:
+            del self._due[key]
+            del self._intervals[key]
+            self._states.pop(key, None)
+
+    async def _poll(self, key: DeviceKey) -> None:
+        """Use for polling the device's state, rescheduling it by whether it changed."""
+        read, command = _polled_read(key)
+        interval = min(self._intervals.get(key, 0) * 2, self._max_interval)
+        try:
+            async with self._semaphore:
+                state = _serialize_object(await self._queue.submit(key, command, read))
+        except Exception:
+            server_logger.debug(f"polling device {key.device_id} failed", exc_info=True)
+            self._states.pop(key, None)
+        else:
+            if self.get(key, read) != state:
+                interval = self._min_interval
+            self._states[key] = (read, state)
+            shaped = _snapshot_state(key.device_type, state)
+            if self._snapshot:
+                self._snapshot.update(key.device_id, shaped)
+            if self._hub:
+                self._hub.publish_state(key.device_id, shaped)
+        if key in self._due:
+            self._intervals[key] = interval
+            self._due[key] = monotonic() + self._jittered(interval)
+            self._wake_up()
+
+    def _jittered(self, interval: float) -> float:
+        """Use for spreading the polls of devices scheduled at the same moment."""
+        return interval * uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+
+APP_POLLER = web.AppKey("poller", SwitcherPoller)
+
+
+class ShutterJob:
+    """A shutter moving to a position, watched until it gets there.
+
+    Args:
+        job_id: the id the job is fetched by.
+        key: the key of the shutter's device.
+        index: the index of the shutter on the device.
+        position: the position the shutter is moving to.
+
+    """
+
+    def __init__(self, job_id: str, key: DeviceKey, index: int, position: int) -> None:
+        """Initialize the job."""
+        self.job_id = job_id
+        self.key = key
+        self.index = index
+        self.position = position
+        self.current: Optional[int] = None
+        self.state = JOB_MOVING
+        self.started = time()
+        self.finished: Optional[float] = None
+        self._changed: "Future[None]" = get_running_loop().create_future()
+
+    def describe(self) -> Dict[str, Any]:
+        """Return the job's progress."""
+        return {
+            KEY_JOB: self.job_id,
+            KEY_DEVICE_ID: self.key.device_id,
+            KEY_INDEX: self.index,
+            KEY_POSITION: self.position,
+            "current_position": self.current,
+            KEY_STATE: self.state,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+    def update(self, current: Optional[int], state: Optional[str] = None) -> None:
+        """Record the shutter's position, finishing the job if given its final state."""
+        if current == self.current and state is None:
+            return
+        self.current = current
+        if state is not None:
+            self.state = state
+            self.finished = time()
+        self._changed.set_result(None)
+        self._changed = get_running_loop().create_future()
+
+    async def changed(self, timeout: float) -> bool:
+        """Wait for the job's progress, returns whether it changed in time."""
+        done, _ = await wait({self._changed}, timeout=timeout)
+        return bool(done)
+
+    async def wait(self, timeout: float) -> None:
+        """Wait for the job to finish, for up to the timeout."""
+        deadline = monotonic() + timeout
+        while not self.finished and deadline > monotonic():
+            await self.changed(deadline - monotonic())
+
+
+class SwitcherShutterJobs:
+    """Shutter moves watched server side until the shutters reach their position.
+
+    One watcher polls each moving shutter through the command queue, sharing the
+    reads of clients, so clients wait on the job instead of polling the shutter.
+    A new move of a shutter supersedes the job watching its previous move.
+
+    Args:
+        queue: the command queue the polls are sent through, shared with requests.
+        interval: seconds between the polls of a moving shutter.
+        timeout: seconds a shutter is watched before its job timed out.
+        max_entries: number of jobs kept before dropping the oldest finished.
+
+    """
+
+    def __init__(
+        self,
+        queue: SwitcherCommandQueue,
+        interval: float = 1,
+        timeout: float = 120,
+        max_entries: int = 1024,
+    ) -> None:
+        """Initialize the shutter jobs."""
+        self._queue = queue
+        self._interval = interval
+        self._timeout = timeout
+        self._max_entries = max_entries
+        self._jobs: "OrderedDict[str, ShutterJob]" = OrderedDict()
+        self._watchers: Dict[Tuple[str, str, int], Tuple[ShutterJob, "Task[None]"]] = {}
+
+    def start(self, key: DeviceKey, index: int, position: int) -> ShutterJob:
+        """Start watching the shutter move to the position, superseding its last job."""
+        shutter = (key.ip_address, key.device_id, index)
+        watched = self._watchers.pop(shutter, None)
+        if watched:
+            watched[1].cancel()
+            watched[0].update(watched[0].current, JOB_SUPERSEDED)
+        job = ShutterJob(f"{getrandbits(64):016x}", key, index, position)
+        self._jobs[job.job_id] = job
+        for job_id in [j for j, old in self._jobs.items() if old.finished]:
+            if len(self._jobs) <= self._max_entries:
+                break
+            del self._jobs[job_id]
+        task = create_task(self._watch(job))
+        self._watchers[shutter] = (job, task)
+        task.add_done_callback(lambda _: self._forget(shutter, job))
+        return job
+
+    def get(self, job_id: str) -> ShutterJob:
+        """Return the job of the id."""
+        try:
+            return self._jobs[job_id]
+        except KeyError as exc:
+            raise ValueError(f"failed to get job {job_id}") from exc
+
+    async def stop(self) -> None:
+        """Stop watching the moving shutters."""
+        watchers, self._watchers = self._watchers, {}
+        for _, task in watchers.values():
+            task.cancel()
+        await gather(*(task for _, task in watchers.values()), return_exceptions=True)
+
+    async def _watch(self, job: ShutterJob) -> None:
+        """Use for polling the shutter until it reaches the position, or it stopped."""
+        deadline = monotonic() + self._timeout
+        read = (ENDPOINT_GET_SHUTTER_STATE, job.index)
+        while True:
+            await sleep(min(self._interval, max(deadline - monotonic(), 0)))
+            if monotonic() >= deadline:
+                job.update(job.current, JOB_TIMED_OUT)
+                return
+            try:
+                state = cast(
+                    SwitcherShutterStateResponse,
+                    await self._queue.submit(
+                        job.key, lambda swapi: swapi.get_shutter_state(job.index), read
+                    ),
+                )
+            except Exception:
+                server_logger.debug(f"polling job {job.job_id} failed", exc_info=True)
+                continue
+            position = int(state.position)
+            if position == job.position:
+                job.update(position, JOB_DONE)
+                return
+            # stopped short of the position, by an obstacle or by hand
+            if (
+                position == job.current
+                and state.direction == ShutterDirection.SHUTTER_STOP
+            ):
+                job.update(position, JOB_STOPPED)
+                return
+            job.update(position)
+
+    def _forget(self, shutter: Tuple[str, str, int], job: ShutterJob) -> None:
+        """Use for dropping the watcher of the finished job."""
+        if self._watchers.get(shutter, (None,))[0] is job:
+            del self._watchers[shutter]
+
+
+APP_SHUTTER_JOBS = web.AppKey("shutter_jobs", SwitcherShutterJobs)
+
+
+class SwitcherBreezeRemotes:
+    """Breeze remotes database loaded once, with the parsed remotes cached.
+
+    The database is loaded off the event loop, and remotes are parsed from it
+    on first use. The least recently used parsed remote is evicted when full.
+
+    Args:
+        max_entries: max number of parsed remotes kept.
+        remotes_db_path: path of the supported remotes json file.
+
+    """
+
+    def __init__(
+        self, max_entries: int = 32, remotes_db_path: str = BREEZE_REMOTE_DB_FPATH
+    ) -> None:
+        """Initialize the remotes cache."""
+        self._max_entries = max_entries
+        self._remotes_db_path = remotes_db_path
+        self._remotes_db: Optional["Future[Dict[str, Any]]"] = None
+        self._remotes: "OrderedDict[str, SwitcherBreezeRemote]" = OrderedDict()
+
+    def preload(self) -> "Future[Dict[str, Any]]":
+        """Start loading the remotes database in the background, if not yet."""
+        if self._remotes_db is None:
+            self._remotes_db = get_running_loop().run_in_executor(None, self._load)
+        return self._remotes_db
+
+    def _load(self) -> Dict[str, Any]:
+        """Use for reading the remotes database file."""
+        with open(self._remotes_db_path) as remotes_fd:
+            return load(remotes_fd)
+
+    async def get(self, remote_id: str) -> SwitcherBreezeRemote:
+        """Return the parsed remote, raises KeyError for unknown remotes."""
+        remote = self._remotes.get(remote_id)
+        if remote:
+            self._remotes.move_to_end(remote_id)
+            return remote
+        # shielded so one caller going away does not cancel the shared load
+        remotes_db = await shield(self.preload())
+        remote = SwitcherBreezeRemote(remotes_db[remote_id])
+        self._remotes[remote_id] = remote
+        if len(self._remotes) > self._max_entries:
+            self._remotes.popitem(last=False)
+        return remote
+
+
+APP_REMOTES = web.AppKey("remotes", SwitcherBreezeRemotes)
+APP_BATCH_CONCURRENCY = web.AppKey("batch_concurrency", int)
+APP_JSON = web.AppKey("json", JsonCodec)
+
+
+def _otlp_value(value: Union[str, int]) -> Dict[str, Union[str, int]]:
+    """Use for shaping a span attribute value as otlp json does."""
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    return {"stringValue": value}
+
+
+def _otlp_traces(traces: Sequence[SwitcherTrace]) -> Dict[str, Any]:
+    """Use for shaping the traces as an otlp json export request."""
+    spans: List[Dict[str, Any]] = []
+    for trace in traces:
+        spans.append(
+            {
+                "traceId": trace.trace_id,
+                "spanId": trace.span_id,
+                "name": trace.name,
+                "kind": 2,
+                "startTimeUnixNano": str(trace.start),
+                "endTimeUnixNano": str(trace.end),
+                "attributes": [
+                    {"key": key, "value": _otlp_value(value)}
+                    for key, value in trace.attributes.items()
+                ],
+            }
+        )
+        spans.extend(
+            {
+                "traceId": trace.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": trace.span_id,
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(span.start),
+                "endTimeUnixNano": str(span.end),
+            }
+            for span in trace.spans
+        )
+    service = {"key": "service.name", "value": _otlp_value(TRACE_SERVICE_NAME)}
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [service]},
+                "scopeSpans": [{"scope": {"name": TRACE_SERVICE_NAME}, "spans": spans}],
+            }
+        ]
+    }
+
+
+def _append_line(path: str, line: str) -> None:
+    """Use for appending a line to the file."""
+    with open(path, "a") as lines_file:
+        lines_file.write(line + "\n")
+
+
+class SwitcherTracer:
+    """Sample the requests for tracing, exporting their spans in batches.
+
+    The finished traces are exported every second as otlp json, appended as a
+    line to the file and posted to the collector. Traces are dropped while the
+    exports fall behind, tracing is not worth stalling the requests for.
+
+    Args:
+        sample_rate: fraction of the requests traced, 0 disables tracing.
+        path: file the otlp json lines are appended to.
+        otlp_url: otlp http collector the traces are posted to.
+
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0,
+        path: Optional[str] = None,
+        otlp_url: Optional[str] = None,
+    ) -> None:
+        """Initialize the tracer."""
+        self._sample_rate = sample_rate
+        self._path = path
+        self._otlp_url = otlp_url
+        self._pending: List[SwitcherTrace] = []
+        self._session: Optional[ClientSession] = None
+        self._exporter: Optional["Task[None]"] = None
+        self.dropped = 0
+
+    def sample(self, name: str) -> Optional[SwitcherTrace]:
+        """Return a trace for the request if it is sampled."""
+        if self._sample_rate <= 0 or random() >= self._sample_rate:
+            return None
+        return SwitcherTrace(name)
+
+    def finish(self, trace: SwitcherTrace) -> None:
+        """End the trace's root span, queueing it for the export."""
+        trace.end = time_ns()
+        if not self._path and not self._otlp_url:
+            return
+        if len(self._pending) >= TRACE_MAX_PENDING:
+            self.dropped += 1
+            return
+        self._pending.append(trace)
+
+    def start(self) -> None:
+        """Start exporting the traces in the background."""
+        if (self._path or self._otlp_url) and not self._exporter:
+            self._session = ClientSession(timeout=ClientTimeout(total=5))
+            self._exporter = create_task(self._export_periodically())
+
+    async def stop(self) -> None:
+        """Stop exporting in the background, exporting the pending traces."""
+        if self._exporter:
+            self._exporter.cancel()
+            await gather(self._exporter, return_exceptions=True)
+            self._exporter = None
+        await self.export()
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def export(self) -> None:
+        """Export the pending traces, a failed export drops them."""
+        if not self._pending:
+            return
+        traces, self._pending = self._pending, []
+        payload = _otlp_traces(traces)
+        try:
+            if self._path:
+                await get_running_loop().run_in_executor(
+                    None, _append_line, self._path, dumps(payload)
+                )
+            if self._otlp_url and self._session:
+                async with self._session.post(self._otlp_url, json=payload) as resp:
+                    resp.raise_for_status()
+        except Exception:
+            server_logger.debug("exporting the traces failed", exc_info=True)
+            self.dropped += len(traces)
+
+    async def _export_periodically(self) -> None:
+        """Use for exporting the finished traces every interval."""
+        while True:
+            await sleep(TRACE_EXPORT_INTERVAL)
+            await self.export()
+
+
+APP_TRACER = web.AppKey("tracer", SwitcherTracer)
+
+
+def _json_response(
+    request: web.Request, payload: Any, status: int = 200
+) -> web.Response:
+    """Use for responding with the payload encoded by the configured json codec."""
+    with _span("encode"):
+        return web.json_response(
+            payload, status=status, dumps=request.app[APP_JSON].dumps
+        )
+
+
+def _not_modified(request: web.Request, etag: str) -> bool:
+    """Use for checking whether the client already has the etag's representation."""
+    return any(match.value in (etag, ETAG_ANY) for match in request.if_none_match or ())
+
+
+async def _json_body(request: web.Request) -> Any:
+    """Use for decoding the request body with the configured json codec."""
+    with _span("decode"):
+        return await request.json(loads=request.app[APP_JSON].loads)
+
+
+async def _read(
+    app: web.Application,
+    query: Mapping[str, str],
+    read: Hashable,
+    command: Callable[[SwitcherApi], Awaitable[T]],
+    serialize: Callable[[T], Any],
+) -> Any:
+    """Use for sending a read command, answering from the response cache if cached."""
+    key = _resolve_device_key(app, query)
+    response = app[APP_POLLER].get(key, read)
+    if response is not None:
+        return response
+    cache = app[APP_CACHE]
+    response = cache.get(key, read)
+    if response is None:
+        generation = cache.generation(key)
+        try:
+            response = serialize(await app[APP_QUEUE].submit(key, command, read))
+        except SwitcherCircuitOpenError:
+            response = app[APP_BREAKER].last_known(key, read)
+            if response is None:
+                raise
+            return response
+        cache.put(key, read, response, generation)
+        app[APP_BREAKER].remember(key, read, response)
+        if read == _polled_read(key)[0]:
+            app[APP_SNAPSHOT].update(
+                key.device_id, _snapshot_state(key.device_type, response)
+            )
+    return response
+
+
+async def _write(
+    app: web.Application,
+    query: Mapping[str, str],
+    command: Callable[[SwitcherApi], Awaitable[T]],
+) -> T:
+    """Use for sending a write command, invalidating what is cached for the device."""
+    key = _resolve_device_key(app, query)
+    refused = False
+    try:
+        return await app[APP_QUEUE].submit(key, command)
+    except (SwitcherCircuitOpenError, SwitcherOverloadedError):
+        # refused before reaching the device, what is known of its state still holds
+        refused = True
+        raise
+    finally:
+        if not refused:
+            app[APP_CACHE].invalidate(key)
+            app[APP_STATES].discard(key.device_id)
+            app[APP_BREAKER].forget(key)
+            app[APP_POLLER].written(key)
+
+
+Operation = Callable[
+    [web.Application, Mapping[str, str], Dict[str, Any]], Awaitable[Any]
+]
+
+OPERATIONS: Dict[str, Operation] = {}
+
+
+async def _idempotent_write(
+    request: web.Request, endpoint: str, operation: Operation, body: Dict[str, Any]
+) -> web.Response:
+    """Use for running a write once per idempotency key, replaying its result."""
+    key = request.headers.get(HEADER_IDEMPOTENCY_KEY)
+    if key is None:
+        payload = await operation(request.app, request.query, body)
+        return _json_response(request, payload)
+    payload, replayed = await request.app[APP_IDEMPOTENT].run(
+        key,
+        (endpoint, tuple(request.query.items()), dumps(body, sort_keys=True)),
+        lambda: operation(request.app, request.query, body),
+    )
+    response = _json_response(request, payload)
+    if replayed:
+        response.headers[HEADER_IDEMPOTENT_REPLAYED] = "true"
+    return response
+
+
+def _operation(method: str, endpoint: str) -> Callable[[Operation], Operation]:
+    """Use for registering a device operation as an endpoint and a batch operation."""
+
+    def register(operation: Operation) -> Operation:
+        @wraps(operation)
+        async def handler(request: web.Request) -> web.Response:
+            body = await _json_body(request) if request.body_exists else {}
+            if method != "GET":
+                return await _idempotent_write(request, endpoint, operation, body)
+            payload = await operation(request.app, request.query, body)
+            with _span("encode"):
+                text, etag = request.app[APP_ENCODED].encode(
+                    (endpoint, tuple(request.query.items())), payload
+                )
+            if _not_modified(request, etag):
+                response = web.Response(status=304)
+            else:
+                response = web.Response(text=text, content_type="application/json")
+            response.etag = ETag(etag)
+            return response
+
+        routes.route(method, endpoint)(handler)
+        OPERATIONS[endpoint] = operation
+        return operation
+
+    return register
+
+
+@_operation("GET", ENDPOINT_GET_STATE)
+async def get_state(
+    app: web.Application, query: Mapping[str, str], body: Dict[str, Any]
+) -> Any:
+    """Use to get the current state of the device."""
+    device = _cached_device(app, query)
+    if isinstance(device, SwitcherPowerBase):
+        return _cached_state(device)
+    return await _read(
+        app,
+        query,
+        ENDPOINT_GET_STATE,
+        lambda swapi: swapi.get_state(),
+        _serialize_object,
+    )
+
+
+@_operation("POST", ENDPOINT_TURN_ON)
+async def turn_on(
+    app: web.Application, query: Mapping[str, str], body: Dict[str, Any]
+) -> Any:
+    """Use to turn on the device."""
+    minutes = int(body[KEY_MINUTES]) if body.get(KEY_MINUTES) else 0
+    response = await _write(
+        app, query, lambda swapi: swapi.control_device(Command.ON, minutes)
+    )
+    return _serialize_object(response)
+
+
+@_operation("POST", ENDPOINT_TURN_OFF)
+async def turn_off(
+    app: web.Application, query: Mapping[str, str], body: Dict[str, Any]
+) -> Any:
+    """Use to turn on the device."""
+    response = await _write(app, query, lambda swapi: swapi.control_device(Command.OFF))
+    return _serialize_object(response)
+
+
+@_operation("PATCH", ENDPOINT_SET_NAME)
+async def set_name(
+    app: web.Application, query: Mapping[str, str], body: Dict[str, Any]
+) -> Any:
+    """Use to set the device's name."""
+    try:
+        name = body[KEY_NAME]
+    except Exception as exc:
+        raise ValueError(f"failed to get {KEY_NAME} from body as json") from exc
+    response = await _write(app, query, lambda swapi: swapi.set_device_name(name))
+    return _serialize_object(response)
+
+
+@_operation("PATCH", ENDPOINT_SET_AUTO_SHUTDOWN)
+async def set_auto_shutdown(
+    app: web.Application, query: Mapping[str, str], body: Dict[str, Any]
+) -> Any:
+    """Use to set the device's auto shutdown configuration value."""
+    try:
+        hours = body[KEY_HOURS]
+        minutes = int(body[KEY_MINUTES]) if body.get(KEY_MINUTES) else 0
+    except Exception as exc:
+        raise ValueError("failed to get hours from body as json") from exc
+    full_time = timedelta(hours=int(hours), minutes=int(minutes) if minutes else 0)
+    response = await _write(
+        app, query, lambda swapi: swapi.set_auto_shutdown(full_time)
+    )
+    return _serialize_object(response)
+
+
+@_operation("GET", ENDPOINT_GET_SCHEDULES)
+async def get_schedules(
+    app: web.Application, query: Mapping[str, str], body: Dict[str, Any]
+) -> Any:
+    """Use to get the current configured schedules on the device."""
+    return await _read(
+        app,
+        query,
+        ENDPOINT_GET_SCHEDULES,
+        lambda swapi: swapi.get_schedules(),
+        _serialize_schedules,
+    )
+
+
+@_operation("DELETE", ENDPOINT_DELETE_SCHEDULE)
+async def delete_schedule(
+    app: web.Application, query: Mapping[str, str], body: Dict[str, Any]
+) -> Any:
+    """Use to delete an existing schedule."""
+    try:
+        schedule_id = body[KEY_SCHEDULE]
+    except Exception as exc:
+        raise ValueError("failed to get schedule from body as json") from exc
+    response = await _write(
+        app, query, lambda swapi: swapi.delete_schedule(schedule_id)
+    )
+    return _serialize_object(response)
+
+
+@_operation("POST", ENDPOINT_CREATE_SCHEDULE)
+async def create_schedule(
+    app: web.Application, query: Mapping[str, str], body: Dict[str, Any]
+) -> Any:
+    """Use to create a new schedule."""
+    start_time = body[KEY_START]
+    stop_time = body[KEY_STOP]
+    selected_days = (
+        set([WEEKDAYS[d] for d in body[KEY_DAYS]]) if body.get(KEY_DAYS) else set()
+    )
+    response = await _write(
+        app,
+        query,
+        lambda swapi: swapi.create_schedule(start_time, stop_time, selected_days),
+    )
+    return _serialize_object(response)
+
+
+@_operation("POST", ENDPOINT_SET_POSITION)
+async def set_position(
+    app: web.Application, query: Mapping[str, str], body: Dict[str, Any]
+) -> Any:
+    """Use for setting the shutter position of the Runner and Runner Mini devices."""
+    try:
+        position = int(body[KEY_POSITION])
+    except Exception as exc:
+        raise ValueError("failed to get position from body as json") from exc
+    if KEY_INDEX in query:
+        index = int(query[KEY_INDEX])
+    else:
+        index = 0
+    response = await _write(
+        app, query, lambda swapi: swapi.set_position(position, index)
+    )
+    return _serialize_object(response)
+
+
+@_operation("GET", ENDPOINT_GET_BREEZE_STATE)
+async def get_breeze_state(
+    app: web.Application, query: Mapping[str, str], body: Dict[str, Any]
+) -> Any:
+    """Use for sending the get state packet to the Breeze device."""
+    device = _cached_device(app, query)
+    if isinstance(device, SwitcherThermostat):
+        return _broadcast_breeze_state(device)
+    return await _read(
+        app,
+        query,
+        ENDPOINT_GET_BREEZE_STATE,
+        lambda swapi: swapi.get_breeze_state(),
+        _serialize_object,
+    )
+
+
+@_operation("GET", ENDPOINT_GET_SHUTTER_STATE)
+async def get_shutter_state(
+    app: web.Application, query: Mapping[str, str], body: Dict[str, Any]
+) -> Any:
+    """Use for sending the get state packet to the Breeze device."""
+    if KEY_INDEX in query:
+        index = int(query[KEY_INDEX])
+    else:
+        index = 0
+    return await _read(
+        app,
+        query,
+        (ENDPOINT_GET_SHUTTER_STATE, index),
+        lambda swapi: swapi.get_shutter_state(index),
+        _serialize_object,
+    )
+
+
+@_operation("POST", ENDPOINT_POST_STOP_SHUTTER)
+async def stop_shutter(
+    app: web.Application, query: Mapping[str, str], body: Dict[str, Any]
+) -> Any:
+    """Use for stopping the shutter."""
+    if KEY_INDEX in query:
+        index = int(query[KEY_INDEX])
+    else:
+        index = 0
+    response = await _write(app, query, lambda swapi: swapi.stop_shutter(index))
+    return _serialize_object(response)
+
+
+@_operation("PATCH", ENDPOINT_CONTROL_BREEZE_DEVICE)
+async def control_breeze_device(
+    app: web.Application, query: Mapping[str, str], body: Dict[str, Any]
+) -> Any:
+    """Use for update breez device state."""
+    try:
+        device_state = DEVICE_STATES.get(body.get(KEY_DEVICE_STATE, None))
+        thermostat_mode = THERMOSTAT_MODES.get(body.get(KEY_THERMOSTAT_MODE, None))
+        target_temp = int(body[KEY_TARGET_TEMP]) if body.get(KEY_TARGET_TEMP) else 0
+        fan_level = THERMOSTAT_FAN_LEVELS.get(body.get(KEY_FAN_LEVEL, None))
+        thermostat_swing = THERMOSTAT_SWINGS.get(body.get(KEY_THERMOSTAT_SWING, None))
+        remote_id = body[KEY_REMOTE_ID]
+    except Exception as exc:
+        raise ValueError(
+            "failed to get commands from body as json, you might sent illegal value"
+        ) from exc
+    with _span("remote"):
+        remote = await app[APP_REMOTES].get(remote_id)
+    response = await _write(
+        app,
+        query,
+        lambda swapi: swapi.control_breeze_device(
+            remote,
+            device_state,
+            thermostat_mode,
+            target_temp,
+            fan_level,
+            thermostat_swing,
+        ),
+    )
+    return _serialize_object(response)
+
+
+class SwitcherScenes:
+    """Named groups of devices and scenes of operations to run on them at once.
+
+    A group lists device aliases. A scene lists batch operations, an operation
+    with a group instead of a query runs for every device of the group.
+
+    Args:
+        path: json file the groups and scenes are loaded from and saved to.
+
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        """Initialize the groups and scenes."""
+        self._file = SharedJsonFile(path)
+        self._groups: Dict[str, List[str]] = {}
+        self._scenes: Dict[str, List[Dict[str, Any]]] = {}
+
+    def load(self) -> None:
+        """Load the groups and scenes from the file, a missing file is created."""
+        content = self._file.changed()
+        if content is not None:
+            self._replace(content)
+
+    def content(self) -> Dict[str, Any]:
+        """Return the groups and scenes by name."""
+        self._refresh()
+        return {KEY_GROUPS: self._groups, KEY_SCENES: self._scenes}
+
+    def expand(self, operations: List[Any]) -> List[Any]:
+        """Return the operations, with the group operations run for every device."""
+        self._refresh()
+        expanded = []
+        for operation in operations:
+            aliases = (
+                self._groups.get(operation[KEY_GROUP])
+                if isinstance(operation, dict)
+                and isinstance(operation.get(KEY_GROUP), str)
+                and isinstance(operation.get(KEY_QUERY, {}), dict)
+                else None
+            )
+            if aliases is None:
+                expanded.append(operation)
+                continue
+            device_operation = {k: v for k, v in operation.items() if k != KEY_GROUP}
+            for alias in aliases:
+                query = {**operation.get(KEY_QUERY, {}), KEY_DEVICE: alias}
+                expanded.append({**device_operation, KEY_QUERY: query})
+        return expanded
+
+    def group(self, group: str) -> List[str]:
+        """Return the device aliases of the group."""
+        self._refresh()
+        try:
+            return self._groups[group]
+        except KeyError as exc:
+            raise ValueError(f"failed to get group {group}") from exc
+
+    def operations(self, scene: str) -> List[Any]:
+        """Return the operations of the scene, expanded for the groups."""
+        self._refresh()
+        try:
+            operations = self._scenes[scene]
+        except KeyError as exc:
+            raise ValueError(f"failed to get scene {scene}") from exc
+        return self.expand(operations)
+
+    async def set_group(self, group: str, aliases: Any) -> List[str]:
+        """Create or replace the group, saving the file."""
+        self._check_group(group, aliases)
+        self._replace(
+            await self._file.edit(
+                lambda content: content.setdefault(KEY_GROUPS, {}).update(
+                    {group: aliases}
+                )
+            )
+        )
+        return self._groups[group]
+
+    async def set_scene(self, scene: str, operations: Any) -> List[Dict[str, Any]]:
+        """Create or replace the scene, saving the file."""
+        self._check_scene(scene, operations)
+        self._replace(
+            await self._file.edit(
+                lambda content: content.setdefault(KEY_SCENES, {}).update(
+                    {scene: operations}
+                )
+            )
+        )
+        return self._scenes[scene]
+
+    async def remove_group(self, group: str) -> None:
+        """Remove the group, saving the file."""
+        self.group(group)
+        self._replace(
+            await self._file.edit(
+                lambda content: content.get(KEY_GROUPS, {}).pop(group, None)
+            )
+        )
+
+    async def remove_scene(self, scene: str) -> None:
+        """Remove the scene, saving the file."""
+        self._refresh()
+        if scene not in self._scenes:
+            raise ValueError(f"failed to get scene {scene}")
+        self._replace(
+            await self._file.edit(
+                lambda content: content.get(KEY_SCENES, {}).pop(scene, None)
+            )
+        )
+
+    def _check_group(self, group: str, aliases: Any) -> None:
+        """Use for validating the group lists device aliases."""
+        if not isinstance(aliases, list) or not all(
+            isinstance(alias, str) for alias in aliases
+        ):
+            raise ValueError(f"failed to get device aliases array of group {group}")
+
+    def _check_scene(self, scene: str, operations: Any) -> None:
+        """Use for validating the scene lists operations of known endpoints."""
+        if not isinstance(operations, list) or not all(
+            isinstance(operation, dict)
+            and operation.get(KEY_ENDPOINT) in OPERATIONS
+            and (KEY_QUERY in operation or KEY_GROUP in operation)
+            and isinstance(operation.get(KEY_QUERY, {}), dict)
+            for operation in operations
+        ):
+            raise ValueError(
+                f"failed to get operations array of scene {scene}, each operation"
+                f" needs a known {KEY_ENDPOINT} and a {KEY_QUERY} or a {KEY_GROUP}"
+            )
+
+    def _replace(self, content: Mapping[str, Any]) -> None:
+        """Use for validating the loaded or edited groups and scenes, replacing them."""
+        groups = content.get(KEY_GROUPS, {})
+        scenes = content.get(KEY_SCENES, {})
+        for group, aliases in groups.items():
+            self._check_group(group, aliases)
+        for scene, operations in scenes.items():
+            self._check_scene(scene, operations)
+        self._groups, self._scenes = dict(groups), dict(scenes)
+
+    def _refresh(self) -> None:
+        """Use for reloading the groups and scenes when another worker edited them."""
+        try:
+            content = self._file.changed()
+            if content is not None:
+                self._replace(content)
+        except ValueError:
+            server_logger.warning(f"failed to reload {self._file.path}", exc_info=True)
+
+
+APP_SCENES = web.AppKey("scenes", SwitcherScenes)
+
+
+async def _run_batch_operation(
+    app: web.Application,
+    semaphore: Semaphore,
+    operation: Any,
+    timed: bool = False,
+) -> Dict[str, Any]:
+    """Use for running one operation of a batch, reporting its failure as a result."""
+    async with semaphore:
+        started = monotonic()
+        result = await _run_operation(app, operation)
+        if timed:
+            result["duration"] = monotonic() - started
+        return result
+
+
+async def _run_operation(app: web.Application, operation: Any) -> Dict[str, Any]:
+    """Use for running an operation of a batch or a scene, returning its result."""
+    if not isinstance(operation, dict) or KEY_ENDPOINT not in operation:
+        return {"status": 500, "error": "unknown batch operation endpoint"}
+    if KEY_GROUP in operation:
+        return {"status": 500, "error": f"failed to get group {operation[KEY_GROUP]}"}
+    try:
+        run = OPERATIONS[operation[KEY_ENDPOINT]]
+    except Exception:
+        return {"status": 500, "error": "unknown batch operation endpoint"}
+    try:
+        result = await run(
+            app, operation.get(KEY_QUERY, {}), operation.get(KEY_BODY) or {}
+        )
+    except SwitcherTimeoutError as exc:
+        return {"status": 504, "error": str(exc)}
+    except SwitcherCircuitOpenError as exc:
+        return {"status": 503, "error": str(exc)}
+    except SwitcherOverloadedError as exc:
+        return {"status": 429, "error": str(exc)}
+    except Exception as exc:
+        server_logger.debug("batch operation failed", exc_info=True)
+        return {"status": 500, "error": str(exc)}
+    return {"status": 200, "result": result}
+
+
+@routes.post(ENDPOINT_BATCH)
+async def batch(request: web.Request) -> web.Response:
+    """Use for running many device operations concurrently."""
+    try:
+        operations = await _json_body(request)
+        if not isinstance(operations, list):
+            raise TypeError("batch body is not an array")
+    except Exception as exc:
+        raise ValueError("failed to get operations array from body as json") from exc
+    semaphore = Semaphore(request.app[APP_BATCH_CONCURRENCY])
+    return _json_response(
+        request,
+        await gather(
+            *[
+                _run_batch_operation(request.app, semaphore, operation)
+                for operation in request.app[APP_SCENES].expand(operations)
+            ]
+        ),
+    )
+
+
+@routes.get(ENDPOINT_SCENES)
+async def get_scenes(request: web.Request) -> web.Response:
+    """Use for getting the device groups and scenes."""
+    return _json_response(request, request.app[APP_SCENES].content())
+
+
+@routes.put(ENDPOINT_GROUPS)
+async def set_group(request: web.Request) -> web.Response:
+    """Use for creating or replacing a group of device aliases."""
+    try:
+        group = request.query[KEY_GROUP]
+        aliases = await _json_body(request)
+    except Exception as exc:
+        raise ValueError(
+            f"failed to get {KEY_GROUP} from query and aliases from body as json"
+        ) from exc
+    return _json_response(
+        request, await request.app[APP_SCENES].set_group(group, aliases)
+    )
+
+
+@routes.put(ENDPOINT_SCENES)
+async def set_scene(request: web.Request) -> web.Response:
+    """Use for creating or replacing a scene of operations."""
+    try:
+        scene = request.query[KEY_SCENE]
+        operations = await _json_body(request)
+    except Exception as exc:
+        raise ValueError(
+            f"failed to get {KEY_SCENE} from query and operations from body as json"
+        ) from exc
+    return _json_response(
+        request, await request.app[APP_SCENES].set_scene(scene, operations)
+    )
+
+
+@routes.delete(ENDPOINT_GROUPS)
+async def remove_group(request: web.Request) -> web.Response:
+    """Use for removing a group."""
+    try:
+        group = request.query[KEY_GROUP]
+    except Exception as exc:
+        raise ValueError(f"failed to get {KEY_GROUP} from query") from exc
+    await request.app[APP_SCENES].remove_group(group)
+    return _json_response(request, {})
+
+
+@routes.delete(ENDPOINT_SCENES)
+async def remove_scene(request: web.Request) -> web.Response:
+    """Use for removing a scene."""
+    try:
+        scene = request.query[KEY_SCENE]
+    except Exception as exc:
+        raise ValueError(f"failed to get {KEY_SCENE} from query") from exc
+    await request.app[APP_SCENES].remove_scene(scene)
+    return _json_response(request, {})
+
+
+@routes.post(ENDPOINT_RUN_SCENE)
+async def run_scene(request: web.Request) -> web.Response:
+    """Use for running the operations of a scene concurrently, timing each."""
+    try:
+        scene = request.query[KEY_SCENE]
+    except Exception as exc:
+        raise ValueError(f"failed to get {KEY_SCENE} from query") from exc
+    operations = request.app[APP_SCENES].operations(scene)
+    semaphore = Semaphore(request.app[APP_BATCH_CONCURRENCY])
+    started = monotonic()
+    results = await gather(
+        *[
+            _run_batch_operation(request.app, semaphore, operation, timed=True)
+            for operation in operations
+        ]
+    )
+    for operation, result in zip(operations, results):
+        query = operation.get(KEY_QUERY)
+        result[KEY_ENDPOINT] = operation.get(KEY_ENDPOINT)
+        result[KEY_DEVICE] = (
+            query.get(KEY_DEVICE, query.get(KEY_ID))
+            if isinstance(query, dict)
+            else None
+        )
+    return _json_response(
+        request, {"duration": monotonic() - started, "results": results}
+    )
+
+
+@routes.get(ENDPOINT_GET_CACHE_STATS)
+async def get_cache_stats(request: web.Request) -> web.Response:
+    """Use for getting the response cache counters."""
+    return _json_response(request, request.app[APP_CACHE].stats())
+
+
+@routes.get(ENDPOINT_DEVICES)
+async def get_devices(request: web.Request) -> web.Response:
+    """Use for getting the registered devices by alias."""
+    return _json_response(request, request.app[APP_DEVICES].descriptors())
+
+
+@routes.put(ENDPOINT_DEVICES)
+async def register_device(request: web.Request) -> web.Response:
+    """Use for registering a device by the alias, replacing an existing one."""
+    try:
+        alias = request.query[KEY_DEVICE]
+        descriptor = await _json_body(request)
+    except Exception as exc:
+        raise ValueError(
+            f"failed to get {KEY_DEVICE} from query and descriptor from body as json"
+        ) from exc
+    return _json_response(
+        request, await request.app[APP_DEVICES].register(alias, descriptor)
+    )
+
+
+@routes.delete(ENDPOINT_DEVICES)
+async def unregister_device(request: web.Request) -> web.Response:
+    """Use for removing the device registered by the alias."""
+    try:
+        alias = request.query[KEY_DEVICE]
+    except Exception as exc:
+        raise ValueError(f"failed to get {KEY_DEVICE} from query") from exc
+    await request.app[APP_DEVICES].unregister(alias)
+    return _json_response(request, {})
+
+
+@routes.get(ENDPOINT_DISCOVER)
+async def discover(request: web.Request) -> web.Response:
+    """Use for finding the devices broadcasting on the lan."""
+    try:
+        window = float(request.query.get(KEY_WINDOW, DISCOVERY_WINDOW))
+    except ValueError as exc:
+        raise ValueError(f"failed to get {KEY_WINDOW} from query as seconds") from exc
+    devices = await request.app[APP_DISCOVERY].discover(
+        min(max(window, 0), DISCOVERY_MAX_WINDOW)
+    )
+    if request.query.get(KEY_REGISTER) == "true":
+        devices = await request.app[APP_DEVICES].register_discovered(devices)
+    return _json_response(request, devices)
+
+
+def _selected_device_ids(request: web.Request) -> Optional[Set[str]]:
+    """Use for getting the ids of the devices filtered by id, alias or group."""
+    app = request.app
+    aliases: List[str] = request.query.getall(KEY_DEVICE, [])
+    for group in request.query.getall(KEY_GROUP, []):
+        aliases.extend(app[APP_SCENES].group(group))
+    device_ids = set(request.query.getall(KEY_ID, []))
+    if not aliases and not device_ids:
+        return None
+    return device_ids | {app[APP_DEVICES].get(alias).device_id for alias in aliases}
+
+
+@routes.get(ENDPOINT_GET_STATES)
+async def get_states(request: web.Request) -> web.Response:
+    """Use for getting the last known states of the devices in one response."""
+    try:
+        since = int(request.query.get(KEY_SINCE, 0))
+    except ValueError as exc:
+        raise ValueError(f"failed to get {KEY_SINCE} from query as a version") from exc
+    device_ids = _selected_device_ids(request)
+    snapshot = request.app[APP_SNAPSHOT]
+    etag = str(snapshot.version)
+    if device_ids is not None:
+        etag += f"-{crc32(','.join(sorted(device_ids)).encode()):08x}"
+    if _not_modified(request, etag):
+        response = web.Response(status=304)
+    else:
+        response = _json_response(
+            request,
+            {
+                KEY_VERSION: snapshot.version,
+                KEY_STATES: snapshot.changed(since, device_ids),
+            },
+        )
+    response.etag = ETag(etag)
+    return response
+
+
+@routes.post(ENDPOINT_SHUTTER_JOBS)
+async def create_shutter_job(request: web.Request) -> web.Response:
+    """Use for moving the shutter, answering a job watching it reach the position."""
+    body = await _json_body(request) if request.body_exists else {}
+    await set_position(request.app, request.query, body)
+    job = request.app[APP_SHUTTER_JOBS].start(
+        _resolve_device_key(request.app, request.query),
+        int(request.query.get(KEY_INDEX, 0)),
+        int(body[KEY_POSITION]),
+    )
+    response = _json_response(request, job.describe(), status=202)
+    response.headers["Location"] = f"{ENDPOINT_SHUTTER_JOBS}?{KEY_JOB}={job.job_id}"
+    return response
+
+
+@routes.get(ENDPOINT_SHUTTER_JOBS)
+async def get_shutter_job(request: web.Request) -> web.Response:
+    """Use for getting the job, waiting up to the wait seconds for it to finish."""
+    job = request.app[APP_SHUTTER_JOBS].get(request.query.get(KEY_JOB, ""))
+    try:
+        wait = float(request.query.get(KEY_WAIT, 0))
+    except ValueError as exc:
+        raise ValueError(f"failed to get {KEY_WAIT} from query as seconds") from exc
+    await job.wait(min(max(wait, 0), JOB_MAX_WAIT))
+    return _json_response(request, job.describe())
+
+
+@routes.get(ENDPOINT_SHUTTER_JOB_EVENTS)
+async def shutter_job_events(request: web.Request) -> web.StreamResponse:
+    """Use for streaming the job's progress as events until it finishes."""
+    job = request.app[APP_SHUTTER_JOBS].get(request.query.get(KEY_JOB, ""))
+    response = web.StreamResponse(
+        headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+    )
+    await response.prepare(request)
+    codec = request.app[APP_JSON]
+    try:
+        while True:
+            data = codec.dumps(job.describe())
+            await response.write(f"event: job\ndata: {data}\n\n".encode())
+            if job.finished:
+                break
+            while not await job.changed(STREAM_HEARTBEAT):
+                await response.write(b": keep-alive\n\n")
+    except ConnectionResetError:
+        ws_logger.debug("job event stream client went away")
+    return response
+
+
+@routes.get(ENDPOINT_GET_LIMITS)
+async def get_limits(request: web.Request) -> web.Response:
+    """Use for getting the state of the request limits and the devices' queues."""
+    limits = request.app[APP_LIMITER].stats()
+    limits["devices"] = request.app[APP_QUEUE].stats()
+    return _json_response(request, limits)
+
+
+@routes.get(ENDPOINT_GET_BREAKERS)
+async def get_breakers(request: web.Request) -> web.Response:
+    """Use for getting the circuit breaker state of the failing devices."""
+    return _json_response(request, request.app[APP_BREAKER].stats())
+
+
+async def _send_deltas(
+    ws: web.WebSocketResponse,
+    subscription: SwitcherStateSubscription,
+    codec: JsonCodec,
+) -> None:
+    """Use for sending the subscription's deltas until the hub closes it."""
+    try:
+        while not subscription.closed:
+            deltas = await subscription.next(STREAM_HEARTBEAT)
+            for device_id, delta in deltas.items():
+                message = {KEY_DEVICE_ID: device_id, KEY_STATE: delta}
+                await ws.send_json(message, dumps=codec.dumps)
+    except ConnectionResetError:
+        ws_logger.debug("stream client went away")
+    await ws.close()
+
+
+@routes.get(ENDPOINT_STREAM)
+async def stream(request: web.Request) -> web.WebSocketResponse:
+    """Use for streaming the state deltas of the subscribed devices over websocket."""
+    ws = web.WebSocketResponse(heartbeat=STREAM_HEARTBEAT)
+    await ws.prepare(request)
+    hub = request.app[APP_HUB]
+    codec = request.app[APP_JSON]
+    subscription = hub.subscribe(set(request.query.getall(KEY_ID, [])))
+    sender = create_task(_send_deltas(ws, subscription, codec))
+    try:
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+            try:
+                command = message.json(loads=codec.loads)
+                subscribe = set(command.get(KEY_SUBSCRIBE, []))
+                unsubscribe = set(command.get(KEY_UNSUBSCRIBE, []))
+            except Exception:
+                ws_logger.debug("ignoring malformed stream message", exc_info=True)
+                await ws.send_json(
+                    {"error": "failed to get subscription from message"},
+                    dumps=codec.dumps,
+                )
+                continue
+            added = subscribe - subscription.device_ids
+            subscription.device_ids = (subscription.device_ids | added) - unsubscribe
+            hub.resend(subscription, added)
+    finally:
+        hub.unsubscribe(subscription)
+        sender.cancel()
+    return ws
+
+
+@routes.get(ENDPOINT_STREAM_EVENTS)
+async def stream_events(request: web.Request) -> web.StreamResponse:
+    """Use for streaming the state deltas of the subscribed devices as events."""
+    response = web.StreamResponse(
+        headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+    )
+    await response.prepare(request)
+    hub = request.app[APP_HUB]
+    codec = request.app[APP_JSON]
+    subscription = hub.subscribe(set(request.query.getall(KEY_ID, [])))
+    try:
+        while not subscription.closed:
+            deltas = await subscription.next(STREAM_HEARTBEAT)
+            if not deltas:
+                await response.write(b": keep-alive\n\n")
+            for device_id, delta in deltas.items():
+                data = codec.dumps({KEY_DEVICE_ID: device_id, KEY_STATE: delta})
+                await response.write(f"event: state\ndata: {data}\n\n".encode())
+    except ConnectionResetError:
+        ws_logger.debug("event stream client went away")
+    finally:
+        hub.unsubscribe(subscription)
+    return response
+
+
+@routes.get(ENDPOINT_METRICS)
+async def get_metrics(request: web.Request) -> web.Response:
+    """Use for getting the metrics in the prometheus text format."""
+    return web.Response(
+        text=request.app[APP_METRICS].render(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+@web.middleware
+async def metrics_middleware(
+    request: web.Request, handler: Callable
+) -> web.StreamResponse:
+    """Middleware for counting and timing the requests by route and status."""
+    metrics = request.app[APP_METRICS]
+    resource = request.match_info.route.resource
+    # unmatched paths are not labelled by path, so they cannot explode the series
+    route = resource.canonical if resource else "unmatched"
+    status = 500
+    metrics.requests_in_flight.inc(route)
+    started = monotonic()
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as exc:
+        status = exc.status
+        raise
+    finally:
+        elapsed = monotonic() - started
+        metrics.requests_in_flight.dec(route)
+        metrics.requests.inc(route, request.method, str(status))
+        metrics.request_duration.observe(elapsed, route, request.method, str(status))
+
+
+def _overloaded_response(
+    request: web.Request, exc: SwitcherOverloadedError
+) -> web.Response:
+    """Use for answering a refused request with when it would be admitted."""
+    request.app[APP_METRICS].rejected.inc(exc.limit)
+    response = _json_response(request, {"error": str(exc)}, status=429)
+    response.headers["Retry-After"] = str(max(ceil(exc.retry_in), 1))
+    return response
+
+
+@web.middleware
+async def admission_middleware(
+    request: web.Request, handler: Callable
+) -> web.StreamResponse:
+    """Middleware for refusing the requests over the limits with a fast 429."""
+    if request.path in ADMISSION_EXEMPT:
+        return await handler(request)
+    limiter = request.app[APP_LIMITER]
+    # streams are held open, they are rate limited but not counted as handled
+    counted = request.path not in STREAM_ENDPOINTS
+    try:
+        # the handler's errors are answered by the error middleware, not raised here
+        with limiter.admit(request.remote or "", counted):
+            return await handler(request)
+    except SwitcherOverloadedError as exc:
+        return _overloaded_response(request, exc)
+
+
+@web.middleware
+async def device_time_middleware(
+    request: web.Request, handler: Callable
+) -> web.StreamResponse:
+    """Middleware for collecting the device round-trips of the request."""
+    device_times: List[float] = []
+    request[REQUEST_DEVICE_TIMES] = device_times
+    token = _device_times.set(device_times)
+    try:
+        return await handler(request)
+    finally:
+        _device_times.reset(token)
+
+
+@web.middleware
+async def tracing_middleware(
+    request: web.Request, handler: Callable
+) -> web.StreamResponse:
+    """Middleware for tracing the sampled requests, timing their phases as spans."""
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource else "unmatched"
+    tracer = request.app[APP_TRACER]
+    trace = tracer.sample(f"{request.method} {route}")
+    if trace is None:
+        return await handler(request)
+    trace.attributes.update({"http.method": request.method, "http.route": route})
+    token = _trace.set(trace)
+    try:
+        response = await handler(request)
+        trace.attributes["http.status_code"] = response.status
+        # streams send their headers when they start, before the spans are known
+        if not response.prepared:
+            response.headers[HEADER_SERVER_TIMING] = trace.server_timing()
+        return response
+    finally:
+        _trace.reset(token)
+        tracer.finish(trace)
+
+
+@web.middleware
+async def error_middleware(request: web.Request, handler: Callable) -> web.Response:
+    """Middleware for handling server exceptions."""
+    try:
+        return await handler(request)
+    except SwitcherTimeoutError as exc:
+        server_logger.warning("timed out while handing over to endpoint: %s", exc)
+        request.app[APP_METRICS].errors.inc(type(exc).__name__)
+        return _json_response(request, {"error": str(exc)}, status=504)
+    except SwitcherCircuitOpenError as exc:
+        request.app[APP_METRICS].errors.inc(type(exc).__name__)
+        response = _json_response(request, {"error": str(exc)}, status=503)
+        response.headers["Retry-After"] = str(max(ceil(exc.retry_in), 1))
+        return response
+    except SwitcherOverloadedError as exc:
+        return _overloaded_response(request, exc)
+    except Exception as exc:
+        server_logger.exception("caught exception while handing over to endpoint")
+        request.app[APP_METRICS].errors.inc(type(exc).__name__)
+        return _json_response(request, {"error": str(exc)}, status=500)
+
+
+@web.middleware
+async def deadline_middleware(
+    request: web.Request, handler: Callable
+) -> web.StreamResponse:
+    """Middleware for bounding the handling time by the client's timeout header."""
+    header = request.headers.get(HEADER_REQUEST_TIMEOUT)
+    if header is None:
+        return await handler(request)
+    try:
+        timeout = float(header)
+        if timeout <= 0:
+            raise ValueError("request timeout is not positive")
+    except ValueError as exc:
+        raise ValueError(
+            f"failed to get {HEADER_REQUEST_TIMEOUT} header as seconds"
+        ) from exc
+    return await _within(handler(request), timeout, "request deadline")
+
+
+class CustomAccessLogger(AbstractAccessLogger):
+    """Custom implementation of the aiohttp access logger."""
+
+    def log(self, request: BaseRequest, response: StreamResponse, time: float) -> None:
+        """Log as debug instead origin info."""
+        if not self.logger.isEnabledFor(DEBUG):
+            return
+        remote = request.remote
+        method = request.method
+        path = request.path
+        status = response.status
+        self.logger.debug(f"{remote} {method} {path} done in {time}s: {status}")
+
+
+class JsonAccessLogger(CustomAccessLogger):
+    """Access logger recording the requests for the json access log format."""
+
+    def log(self, request: BaseRequest, response: StreamResponse, time: float) -> None:
+        """Log as debug the request's timing, encoded by the formatter off the loop."""
+        if not self.logger.isEnabledFor(DEBUG):
+            return
+        access = {
+            "remote": request.remote,
+            "method": request.method,
+            "path": request.path,
+            "status": response.status,
+            "duration": time,
+            "device_duration": sum(request.get(REQUEST_DEVICE_TIMES, ())),
+        }
+        self.logger.debug("access", extra={KEY_ACCESS: access})
+
+
+ACCESS_LOGGERS = {"text": CustomAccessLogger, "json": JsonAccessLogger}
+
+
+class JsonAccessFormatter(Formatter):
+    """Log formatter writing the json access records as json lines."""
+
+    def format(self, record: LogRecord) -> str:
+        """Format the json access records as json, the other records as usual."""
+        access = getattr(record, KEY_ACCESS, None)
+        if access is None:
+            return super().format(record)
+        return dumps({"time": self.formatTime(record), **access})
+
+
+async def _connection_pool_ctx(app: web.Application) -> AsyncIterator[None]:
+    """Use for running the connection pool alongside the application."""
+    app[APP_POOL].start()
+    yield
+    await app[APP_POOL].close()
+
+
+async def _close_streams(app: web.Application) -> None:
+    """Use for ending the open streams when the application shuts down."""
+    app[APP_HUB].close()
+
+
+async def _breeze_remotes_ctx(app: web.Application) -> AsyncIterator[None]:
+    """Use for loading the breeze remotes database while the application starts."""
+    app[APP_REMOTES].preload()
+    yield
+
+
+async def _poller_ctx(app: web.Application) -> AsyncIterator[None]:
+    """Use for polling the registered devices alongside the application."""
+    app[APP_POLLER].start()
+    yield
+    await app[APP_POLLER].stop()
+
+
+async def _tracer_ctx(app: web.Application) -> AsyncIterator[None]:
+    """Use for exporting the traces alongside the application."""
+    app[APP_TRACER].start()
+    yield
+    await app[APP_TRACER].stop()
+
+
+async def _shutter_jobs_ctx(app: web.Application) -> AsyncIterator[None]:
+    """Use for stopping the watchers of the moving shutters on shutdown."""
+    yield
+    await app[APP_SHUTTER_JOBS].stop()
+
+
+async def _bridge_ctx(app: web.Application) -> AsyncIterator[None]:
+    """Use for running the udp bridge alongside the application."""
+    await app[APP_BRIDGE].start()
+    yield
+    await app[APP_BRIDGE].stop()
+
+
+def create_app(
+    args: Namespace, shared_directory: Optional[str] = None
+) -> web.Application:
+    """Use for creating the web application configured by the parsed arguments.
+
+    The shared directory is set for the worker processes, sharing their locks and
+    state through it.
+    """
+    device_locks = None
+    idempotency_directory = None
+    if shared_directory:
+        device_locks = SwitcherDeviceLocks(shared_directory, args.command_timeout)
+        idempotency_directory = join(shared_directory, "idempotency")
+        makedirs(idempotency_directory, exist_ok=True)
+    app = web.Application(
+        middlewares=[
+            metrics_middleware,
+            admission_middleware,
+            device_time_middleware,
+            tracing_middleware,
+            error_middleware,
+            deadline_middleware,
+        ]
+    )
+    app.add_routes(routes)
+    app[APP_METRICS] = SwitcherMetrics()
+    app[APP_POOL] = SwitcherConnectionPool(
+        args.pool_idle_ttl,
+        app[APP_METRICS],
+        DeviceTimeouts(args.connect_timeout, args.login_timeout, args.command_timeout),
+    )
+    app[APP_BREAKER] = SwitcherCircuitBreaker(
+        args.breaker_failures,
+        args.breaker_backoff,
+        args.breaker_max_backoff,
+        args.cache_max_entries,
+    )
+    app[APP_QUEUE] = SwitcherCommandQueue(
+        app[APP_POOL], device_locks, app[APP_BREAKER], args.max_device_requests
+    )
+    app[APP_LIMITER] = SwitcherLimiter(
+        args.max_requests,
+        args.rate_limit,
+        args.rate_burst,
+        args.cache_max_entries,
+        args.workers,
+    )
+    app.cleanup_ctx.append(_connection_pool_ctx)
+    app[APP_CACHE] = SwitcherResponseCache(args.cache_ttl, args.cache_max_entries)
+    app[APP_REMOTES] = SwitcherBreezeRemotes(args.remotes_max_entries)
+    app.cleanup_ctx.append(_breeze_remotes_ctx)
+    app[APP_STATES] = SwitcherStateCache(args.bridge_max_age)
+    app[APP_DEVICES] = SwitcherDeviceRegistry(args.devices)
+    app[APP_DEVICES].load()
+    app[APP_DISCOVERY] = SwitcherDiscovery(args.bridge_ports, args.bridge)
+    app[APP_SCENES] = SwitcherScenes(args.scenes)
+    app[APP_SCENES].load()
+    app[APP_SNAPSHOT] = SwitcherStateSnapshot()
+    app[APP_HUB] = SwitcherStateHub()
+    app[APP_POLLER] = SwitcherPoller(
+        app[APP_DEVICES],
+        app[APP_QUEUE],
+        args.poll_min_interval,
+        args.poll_max_interval,
+        args.poll_concurrency,
+        app[APP_SNAPSHOT],
+        app[APP_HUB],
+    )
+    if args.poll:
+        app.cleanup_ctx.append(_poller_ctx)
+    app[APP_SHUTTER_JOBS] = SwitcherShutterJobs(
+        app[APP_QUEUE],
+        args.shutter_job_interval,
+        args.shutter_job_timeout,
+        args.cache_max_entries,
+    )
+    app.cleanup_ctx.append(_shutter_jobs_ctx)
+    # aiosignal>=1.4 types signals by paramspec, which aiohttp 3.10 does not match
+    app.on_shutdown.append(_close_streams)  # type: ignore[arg-type]
+    app[APP_BATCH_CONCURRENCY] = args.batch_concurrency
+    app[APP_JSON] = JSON_CODECS[args.json]
+    app[APP_TRACER] = SwitcherTracer(
+        args.trace_sample_rate, args.trace_file, args.trace_otlp_url
+    )
+    app.cleanup_ctx.append(_tracer_ctx)
+    app[APP_ENCODED] = SwitcherEncodedResponses(
+        app[APP_JSON].dumps, args.cache_max_entries
+    )
+    app[APP_IDEMPOTENT] = SwitcherIdempotentWrites(
+        args.idempotency_ttl, args.cache_max_entries, idempotency_directory
+    )
+    if args.bridge:
+
+        def on_broadcast(device: SwitcherBase) -> None:
+            app[APP_STATES].update(device)
+            app[APP_HUB].publish(device)
+            app[APP_DISCOVERY].update(device)
+            app[APP_SNAPSHOT].update(
+                device.device_id,
+                _snapshot_state(device.device_type, _stream_state(device)),
+            )
+
+        app[APP_BRIDGE] = SwitcherBridge(on_broadcast, args.bridge_ports)
+        app.cleanup_ctx.append(_bridge_ctx)
+    return app
+
+
+def _configure_logging(log_level: str) -> QueueListener:
+    """Use for configuring the loggers of the server process.
+
+    Records are handed through a queue to a listener thread writing them, so a
+    slow stream does not block the event loop. Stop the returned listener to flush.
+    """
+    loggingConfig = {
+        "version": 1,
         "formatters": {
             "default": {
-                "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+                "()": JsonAccessFormatter,
+                "fmt": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
             }
         },
         "handlers": {
@@ -456,19 +4152,149 @@ def log(self, request: BaseRequest, response: StreamResponse, time: float) -> No
         "loggers": {
             "": {"handlers": ["stream"], "propagate": True},
             "aioswitcher.api": {"level": "WARNING"},
-            access_logger.name: {"level": args.log_level},
-            client_logger.name: {"level": args.log_level},
-            server_logger.name: {"level": args.log_level},
-            web_logger.name: {"level": args.log_level},
-            ws_logger.name: {"level": args.log_level},
+            access_logger.name: {"level": log_level},
+            client_logger.name: {"level": log_level},
+            server_logger.name: {"level": log_level},
+            web_logger.name: {"level": log_level},
+            ws_logger.name: {"level": log_level},
         },
     }
 
     config.dictConfig(loggingConfig)
+    root = getLogger()
+    listener = QueueListener(SimpleQueue(), *root.handlers, respect_handler_level=True)
+    root.handlers = [QueueHandler(listener.queue)]
+    listener.start()
+    return listener
 
-    app = web.Application(middlewares=[error_middleware])
-    app.add_routes(routes)
+
+def _serving_marker(shared_directory: str, pid: int) -> str:
+    """Use for getting the path of the file marking the worker as serving."""
+    return join(shared_directory, f"{pid}.serving")
+
+
+def _mark_serving(shared_directory: str) -> None:
+    """Use for marking the worker as serving, once it is listening on the port."""
+    open(_serving_marker(shared_directory, getpid()), "w").close()
+
+
+def _run_worker(args: Namespace, shared_directory: str) -> None:
+    """Use for serving the application from a worker process."""
+    # restarted workers are forked with the supervisor's handlers installed
+    signal(SIGINT, default_int_handler)
+    signal(SIGTERM, SIG_DFL)
+    listener = _configure_logging(args.log_level)
+    try:
+        web.run_app(
+            create_app(args, shared_directory),
+            port=args.port,
+            reuse_port=True,
+            access_log_class=ACCESS_LOGGERS[args.access_log_format],
+            # called once the worker is listening
+            print=lambda _: _mark_serving(shared_directory),
+        )
+    finally:
+        listener.stop()
+
+
+def _serve_workers(args: Namespace) -> int:
+    """Use for serving from pre-forked worker processes, restarting crashed ones.
+
+    Crashed workers are restarted after a backoff doubling while they keep crashing,
+    a worker exiting before it started serving stops the server, returning 1.
+    """
+    shared_directory = mkdtemp(prefix="switcher_webapi_")
+    stopping = False
+    status = 0
+    started = [0.0] * args.workers
+    backoff = [0.0] * args.workers
+    restart_at: Dict[int, float] = {}
+
+    def start_worker(index: int) -> Process:
+        worker = Process(target=_run_worker, args=(args, shared_directory))
+        worker.start()
+        started[index] = monotonic()
+        return worker
+
+    def stop(signum: int, frame: Optional[FrameType]) -> None:
+        nonlocal stopping
+        stopping = True
+
+    workers = [start_worker(index) for index in range(args.workers)]
+    signal(SIGINT, stop)
+    signal(SIGTERM, stop)
+    while not stopping:
+        timeout = min([1.0, *(at - monotonic() for at in restart_at.values())])
+        connection.wait(
+            [w.sentinel for i, w in enumerate(workers) if i not in restart_at],
+            timeout=max(timeout, 0),
+        )
+        for index, worker in enumerate(workers):
+            if stopping:
+                break
+            now = monotonic()
+            if index in restart_at:
+                if now >= restart_at[index]:
+                    del restart_at[index]
+                    workers[index] = start_worker(index)
+                continue
+            if worker.is_alive():
+                continue
+            if not exists(_serving_marker(shared_directory, worker.pid or 0)):
+                server_logger.error(
+                    "worker %s exited with %s before serving, stopping",
+                    worker.pid,
+                    worker.exitcode,
+                )
+                stopping = True
+                status = 1
+                break
+            if now - started[index] > WORKER_RESTART_MAX_BACKOFF:
+                backoff[index] = 0
+            backoff[index] = min(
+                backoff[index] * 2 or WORKER_RESTART_BACKOFF, WORKER_RESTART_MAX_BACKOFF
+            )
+            server_logger.warning(
+                "worker %s exited with %s, restarting in %ss",
+                worker.pid,
+                worker.exitcode,
+                backoff[index],
+            )
+            restart_at[index] = now + backoff[index]
+    # workers shut down gracefully on sigterm, finishing their in-flight requests
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.join()
+    rmtree(shared_directory, ignore_errors=True)
+    return status
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers > 1 and args.bridge:
+        parser.error("--bridge listens on fixed udp ports, it cannot run in workers")
+    if args.workers > 1 and args.poll:
+        parser.error(
+            "--poll would poll every device from each worker, it cannot run"
+            " in workers"
+        )
+
+    listener = _configure_logging(args.log_level)
 
     server_logger.info("starting server")
-    web.run_app(app, port=args.port, access_log_class=CustomAccessLogger)
+    status = 0
+    if args.workers > 1:
+        status = _serve_workers(args)
+    else:
+        app = create_app(args)
+        web.run_app(
+            app,
+            port=args.port,
+            access_log_class=ACCESS_LOGGERS[args.access_log_format],
+        )
     server_logger.info("server stopped")
+    listener.stop()
+    raise SystemExit(status)
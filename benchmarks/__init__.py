@@ -0,0 +1 @@
+"""Benchmarks of the web service, run from the repository root."""
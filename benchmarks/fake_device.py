@@ -0,0 +1,164 @@
+"""A simulated Switcher device speaking the TCP packets the web service sends.
+
+The device answers every packet by its header: logins with a session id,
+state and schedule queries with canned but parsable responses, and every
+control packet with an acknowledgement. A latency, with an optional jitter,
+is slept before every answer to mimic a device on the local network.
+"""
+
+from asyncio import IncompleteReadError, StreamReader, StreamWriter, sleep, start_server
+from asyncio.base_events import Server
+from random import uniform
+from struct import pack
+from time import time
+from typing import Optional
+
+from aioswitcher.api import SWITCHER_TCP_PORT_TYPE1, SWITCHER_TCP_PORT_TYPE2
+
+KIND_TYPES = {"plug": "plug", "touch": "touch", "breeze": "breeze", "runner": "runner"}
+KIND_PORTS = {
+    "plug": SWITCHER_TCP_PORT_TYPE1,
+    "touch": SWITCHER_TCP_PORT_TYPE1,
+    "breeze": SWITCHER_TCP_PORT_TYPE2,
+    "runner": SWITCHER_TCP_PORT_TYPE2,
+}
+
+LOGIN_COMMANDS = (b"\x02\x32\xa1\x00", b"\x03\x05\xa6\x00", b"\x03\x05\xa1\x00")
+GET_STATE_TYPE1 = b"\x02\x32\x01\x03"
+GET_STATE_TYPE2 = b"\x03\x05\x01\x03"
+GET_SCHEDULES = b"\x02\x32\x01\x02"
+GET_SCHEDULES_LENGTH = 0x57
+
+SCHEDULES = 4
+
+
+def _response(length: int, **fields: bytes) -> bytes:
+    """Use for building a response with the given bytes at the given offsets."""
+    response = bytearray(b"\xfe\xf0" + pack("<H", length) + bytes(length - 4))
+    for offset, value in fields.items():
+        start = int(offset[1:])
+        end = start + len(value)
+        response[start:end] = value
+    return bytes(response)
+
+
+def login_response() -> bytes:
+    """Return a login response carrying a session id."""
+    return _response(40, o8=b"\x1a\x2b\x3c\x4d")
+
+
+def water_heater_state() -> bytes:
+    """Return the state of a water heater on for 20 minutes with 30 left."""
+    return _response(
+        104,
+        o75=b"\x01",
+        o77=pack("<H", 2100),
+        o89=pack("<I", 1800),
+        o93=pack("<I", 1200),
+        o97=pack("<I", 7200),
+    )
+
+
+def breeze_state() -> bytes:
+    """Return the state of an air conditioner cooling to 22 with a remote."""
+    return _response(
+        96,
+        o76=pack("<H", 235),
+        o78=b"\x01",
+        o79=b"\x04",
+        o80=bytes([22]),
+        o81=b"\x21",
+        o84=b"ELEC7022",
+    )
+
+
+def shutter_state() -> bytes:
+    """Return the state of a stopped shutter half way open."""
+    return _response(96, o76=bytes([50]), o78=b"\x00\x00")
+
+
+def schedules() -> bytes:
+    """Return a few recurring schedules."""
+    start = int(time()) // 3600 * 3600
+    slots = b"".join(
+        bytes([index, 1, 0x22, 1])
+        + pack("<II", start + index * 3600, start + index * 3600 + 1800)
+        + bytes(4)
+        for index in range(SCHEDULES)
+    )
+    return _response(45 + len(slots) + 4, o45=slots)
+
+
+def ack_response() -> bytes:
+    """Return the acknowledgement of a control packet."""
+    return _response(44)
+
+
+class FakeSwitcherDevice:
+    """A simulated device listening on the tcp port of its kind.
+
+    Args:
+        kind: the kind of device, plug, touch, breeze or runner.
+        ip_address: the address to listen on, a distinct loopback address
+            per device lets many devices share the fixed device ports.
+        latency: seconds slept before every answer.
+        jitter: max seconds randomly added to or removed from the latency.
+
+    """
+
+    def __init__(
+        self, kind: str, ip_address: str, latency: float = 0, jitter: float = 0
+    ) -> None:
+        """Initialize the fake device."""
+        self.kind = kind
+        self.ip_address = ip_address
+        self.latency = latency
+        self.jitter = jitter
+        self.packets = 0
+        self._server: Optional[Server] = None
+
+    @property
+    def port(self) -> int:
+        """Return the tcp port devices of this kind listen on."""
+        return KIND_PORTS[self.kind]
+
+    async def start(self) -> None:
+        """Start listening for connections."""
+        self._server = await start_server(self._serve, self.ip_address, self.port)
+
+    async def stop(self) -> None:
+        """Stop listening and close the server."""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def answer(self, packet: bytes) -> bytes:
+        """Return the answer of the device to the packet."""
+        command = packet[4:8]
+        if command in LOGIN_COMMANDS:
+            return login_response()
+        if command == GET_STATE_TYPE1:
+            return water_heater_state()
+        if command == GET_STATE_TYPE2:
+            return breeze_state() if self.kind == "breeze" else shutter_state()
+        if command == GET_SCHEDULES and packet[2] == GET_SCHEDULES_LENGTH:
+            return schedules()
+        return ack_response()
+
+    async def _serve(self, reader: StreamReader, writer: StreamWriter) -> None:
+        """Use for answering the packets of one connection until it closes."""
+        try:
+            while True:
+                header = await reader.readexactly(4)
+                length = int.from_bytes(header[2:4], "little")
+                packet = header + await reader.readexactly(length - 4)
+                self.packets += 1
+                delay = self.latency + uniform(-self.jitter, self.jitter)
+                if delay > 0:
+                    await sleep(delay)
+                writer.write(self.answer(packet))
+                await writer.drain()
+        except (IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,60 @@
+"""Micro-benchmark of the json codecs on realistic state and schedule payloads.
+
+Run from the repository root with ``python -m benchmarks.json_codecs``.
+"""
+
+from argparse import ArgumentParser
+from timeit import Timer
+from types import SimpleNamespace
+
+from aioswitcher.device import DeviceState
+from aioswitcher.schedule import Days
+from aioswitcher.schedule.parser import SwitcherSchedule
+
+from app import webapp
+
+STATE_RESPONSE = SimpleNamespace(
+    unparsed_response=b"\x00" * 32,
+    state=DeviceState.ON,
+    time_left="00:30:00",
+    time_on="01:12:43",
+    auto_shutdown="02:00:00",
+    power_consumption=2100,
+    electric_current=9.5,
+)
+
+SCHEDULES = [
+    SwitcherSchedule(str(i), True, {Days.MONDAY, Days.FRIDAY}, "17:00", "18:30")
+    for i in range(8)
+]
+
+
+def payloads() -> dict:
+    """Use for building the payloads as the endpoints serialize them."""
+    return {
+        "get_state": webapp._serialize_object(STATE_RESPONSE),
+        "get_schedules": [webapp._serialize_object(s) for s in SCHEDULES],
+    }
+
+
+def main() -> None:
+    """Use for timing every available codec on every payload."""
+    args_parser = ArgumentParser(description=__doc__.splitlines()[0])
+    args_parser.add_argument("-n", "--number", type=int, default=20000)
+    args = args_parser.parse_args()
+
+    for name, payload in payloads().items():
+        for codec_name, codec in sorted(webapp.JSON_CODECS.items()):
+            encoded = codec.dumps(payload)
+            dumps = Timer(lambda: codec.dumps(payload)).timeit(args.number)
+            loads = Timer(lambda: codec.loads(encoded)).timeit(args.number)
+            print(
+                f"{name:<14} {codec_name:<7} "
+                f"dumps {args.number / dumps:>10.0f}/s  "
+                f"loads {args.number / loads:>10.0f}/s  "
+                f"{len(encoded)} bytes"
+            )
+
+
+if __name__ == "__main__":
+    main()
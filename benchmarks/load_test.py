@@ -0,0 +1,334 @@
+"""Load test of the web service against simulated Switcher devices.
+
+Starts fake devices on distinct loopback addresses, runs webapp.py in a
+subprocess, drives its endpoints at the target concurrency and reports the
+throughput, the latency percentiles and the server memory use.
+
+Run from the repository root, arguments after ``--`` are passed to webapp.py::
+
+    python -m benchmarks.load_test --output results.json -- --cache-ttl 1
+"""
+
+import json
+import sys
+from argparse import ArgumentParser, Namespace
+from asyncio import gather, get_running_loop, run, sleep
+from itertools import cycle
+from pathlib import Path
+from random import choice
+from subprocess import DEVNULL, Popen
+from subprocess import run as run_process
+from time import perf_counter, strftime
+from typing import IO, Any, Dict, List, NamedTuple, Optional, Union
+
+from aiohttp import ClientError, ClientSession
+
+from benchmarks.fake_device import KIND_TYPES, FakeSwitcherDevice
+
+ROOT = Path(__file__).parent.parent
+
+
+class Workload(NamedTuple):
+    """A request the load test sends to the devices of a kind."""
+
+    kind: str
+    method: str
+    path: str
+    body: Optional[Dict[str, Any]] = None
+
+
+WORKLOADS = {
+    "get_state": Workload("touch", "GET", "/switcher/get_state"),
+    "get_schedules": Workload("touch", "GET", "/switcher/get_schedules"),
+    "turn_on": Workload("touch", "POST", "/switcher/turn_on", {"minutes": "30"}),
+    "turn_off": Workload("touch", "POST", "/switcher/turn_off"),
+    "get_breeze_state": Workload("breeze", "GET", "/switcher/get_breeze_state"),
+    "control_breeze_device": Workload(
+        "breeze",
+        "PATCH",
+        "/switcher/control_breeze_device",
+        {"device_state": "on", "target_temp": "22", "remote_id": "ELEC7022"},
+    ),
+    "get_shutter_state": Workload("runner", "GET", "/switcher/get_shutter_state"),
+    "set_shutter_position": Workload(
+        "runner", "POST", "/switcher/set_shutter_position", {"position": "30"}
+    ),
+}
+
+DEFAULT_WORKLOADS = [
+    "get_state",
+    "get_schedules",
+    "get_breeze_state",
+    "get_shutter_state",
+]
+
+
+def percentile(latencies: List[float], percent: float) -> float:
+    """Return the latency below which the given percent of the requests are."""
+    if not latencies:
+        return 0.0
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def summarize(latencies: List[float], errors: int, duration: float) -> Dict:
+    """Return the throughput and latency percentiles, in milliseconds."""
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput": round(len(latencies) / duration, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def process_tree(pid: int) -> List[int]:
+    """Return the pid and the pids of its descendants, linux only."""
+    children: Dict[int, List[int]] = {}
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # the ppid follows the state, after the parenthesized command name
+            ppid = int(stat.read_text().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(stat.parent.name))
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children.get(parent, []))
+    return tree
+
+
+def server_memory(pid: int) -> Dict[str, Optional[int]]:
+    """Return the resident and peak memory in KiB summed over the server processes.
+
+    The workers of --workers are counted with their supervisor, linux only.
+    """
+    memory: Dict[str, Optional[int]] = {"rss_kib": None, "peak_rss_kib": None}
+    processes = 0
+    for process in process_tree(pid):
+        try:
+            status = Path(f"/proc/{process}/status").read_text()
+        except OSError:
+            continue
+        processes += 1
+        for line in status.splitlines():
+            if line.startswith("VmRSS:"):
+                memory["rss_kib"] = (memory["rss_kib"] or 0) + int(line.split()[1])
+            elif line.startswith("VmHWM:"):
+                memory["peak_rss_kib"] = (memory["peak_rss_kib"] or 0) + int(
+                    line.split()[1]
+                )
+    memory["processes"] = processes
+    return memory
+
+
+def version() -> Dict[str, str]:
+    """Return the version and commit of the tested tree."""
+    commit = run_process(
+        ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True
+    ).stdout.decode()
+    return {
+        "version": (ROOT / "VERSION").read_text().strip(),
+        "commit": commit.strip(),
+    }
+
+
+async def wait_for_server(session: ClientSession, url: str, server: Popen) -> None:
+    """Use for waiting until the server accepts requests."""
+    for _ in range(100):
+        if server.poll() is not None:
+            raise RuntimeError(f"webapp.py exited with {server.returncode}")
+        try:
+            async with session.get(f"{url}/switcher/cache_stats"):
+                return
+        except ClientError:
+            await sleep(0.1)
+    raise RuntimeError("webapp.py did not start accepting requests")
+
+
+async def drive(
+    session: ClientSession,
+    url: str,
+    requests: List[Dict],
+    deadline: float,
+    latencies: Dict[str, List[float]],
+    errors: Dict[str, int],
+) -> None:
+    """Use for sending requests one after the other until the deadline."""
+    while perf_counter() < deadline:
+        request = choice(requests)
+        name = request["name"]
+        started = perf_counter()
+        try:
+            async with session.request(
+                request["method"], url + request["path"], json=request["body"]
+            ) as response:
+                await response.read()
+                failed = response.status != 200
+        except ClientError:
+            failed = True
+        if failed:
+            errors[name] += 1
+        else:
+            latencies[name].append(perf_counter() - started)
+
+
+async def load_test(args: Namespace) -> Dict:
+    """Use for running the load test and returning its results."""
+    kinds = cycle(sorted({WORKLOADS[name].kind for name in args.workloads}))
+    devices = [
+        FakeSwitcherDevice(next(kinds), f"127.0.0.{2 + i}", args.latency, args.jitter)
+        for i in range(args.devices)
+    ]
+    for device in devices:
+        await device.start()
+
+    requests = []
+    for index, device in enumerate(devices):
+        query = f"type={KIND_TYPES[device.kind]}&id={index:06x}"
+        query += f"&ip={device.ip_address}&key=18"
+        for name in args.workloads:
+            workload = WORKLOADS[name]
+            if workload.kind == device.kind:
+                requests.append(
+                    {
+                        "name": name,
+                        "method": workload.method,
+                        "path": f"{workload.path}?{query}",
+                        "body": workload.body,
+                    }
+                )
+
+    url = f"http://127.0.0.1:{args.port}"
+    command = [sys.executable, str(ROOT / "app" / "webapp.py"), "-p", str(args.port)]
+    # unread pipes would fill up and block the server's logging
+    log: Union[int, IO[str]] = (
+        open(args.server_log, "w") if args.server_log else DEVNULL
+    )
+    server = Popen(command + args.webapp_args, stdout=log, stderr=log)
+    latencies: Dict[str, List[float]] = {name: [] for name in args.workloads}
+    errors = {name: 0 for name in args.workloads}
+    try:
+        async with ClientSession() as session:
+            await wait_for_server(session, url, server)
+            if args.warmup:
+                warmup = perf_counter() + args.warmup
+                await gather(
+                    *[
+                        drive(session, url, requests, warmup, {**latencies}, {**errors})
+                        for _ in range(args.concurrency)
+                    ]
+                )
+                latencies = {name: [] for name in args.workloads}
+                errors = {name: 0 for name in args.workloads}
+            started = perf_counter()
+            await gather(
+                *[
+                    drive(
+                        session,
+                        url,
+                        requests,
+                        started + args.duration,
+                        latencies,
+                        errors,
+                    )
+                    for _ in range(args.concurrency)
+                ]
+            )
+            duration = perf_counter() - started
+        memory = server_memory(server.pid)
+    finally:
+        server.terminate()
+        # waited off the loop so the devices see their connections closing
+        await get_running_loop().run_in_executor(None, server.wait)
+        for device in devices:
+            await device.stop()
+        if not isinstance(log, int):
+            log.close()
+
+    return {
+        **version(),
+        "date": strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {
+            "devices": args.devices,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "webapp_args": args.webapp_args,
+        },
+        "total": summarize(
+            [lat for name in latencies for lat in latencies[name]],
+            sum(errors.values()),
+            duration,
+        ),
+        "endpoints": {
+            name: summarize(latencies[name], errors[name], duration)
+            for name in args.workloads
+        },
+        "memory": memory,
+        "device_packets": sum(device.packets for device in devices),
+    }
+
+
+def report(results: Dict, baseline: Optional[Dict]) -> None:
+    """Use for printing the results, compared to the baseline if given."""
+    rows = {"total": results["total"], **results["endpoints"]}
+    print(
+        f"{'':<24}{'requests':>10}{'errors':>8}{'req/s':>11}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    )
+    for name, row in rows.items():
+        print(
+            f"{name:<24}{row['requests']:>10}{row['errors']:>8}"
+            f"{row['throughput']:>11}{row['p50_ms']:>10}"
+            f"{row['p95_ms']:>10}{row['p99_ms']:>10}"
+        )
+        if baseline:
+            before = {"total": baseline["total"], **baseline["endpoints"]}.get(name)
+            if before and before["throughput"] and before["p99_ms"]:
+                print(
+                    f"{'  vs baseline':<42}"
+                    f"{row['throughput'] / before['throughput']:>10.2f}x"
+                    f"{'':>20}{row['p99_ms'] / before['p99_ms']:>9.2f}x"
+                )
+    print(f"server memory: {results['memory']}")
+
+
+def main() -> None:
+    """Use for parsing the arguments and running the load test."""
+    args_parser = ArgumentParser(description=__doc__.splitlines()[0])
+    args_parser.add_argument("--devices", type=int, default=3)
+    args_parser.add_argument("--concurrency", type=int, default=20)
+    args_parser.add_argument("--duration", type=float, default=10)
+    args_parser.add_argument("--warmup", type=float, default=1)
+    args_parser.add_argument(
+        "--latency", type=float, default=0.02, help="device latency in seconds"
+    )
+    args_parser.add_argument(
+        "--jitter", type=float, default=0.005, help="device jitter in seconds"
+    )
+    args_parser.add_argument("--port", type=int, default=3698)
+    args_parser.add_argument(
+        "--workloads", nargs="+", choices=sorted(WORKLOADS), default=DEFAULT_WORKLOADS
+    )
+    args_parser.add_argument("--output", type=Path, help="file to save results to")
+    args_parser.add_argument(
+        "--server-log", type=Path, help="file to save the output of webapp.py to"
+    )
+    args_parser.add_argument(
+        "--baseline", type=Path, help="results file of a previous run to compare to"
+    )
+    args_parser.add_argument("webapp_args", nargs="*", help="arguments of webapp.py")
+    args = args_parser.parse_args()
+
+    results = run(load_test(args))
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+    report(results, baseline)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Micro-benchmark of the compiled serializers against the reflective one.
+
+Run from the repository root with ``python -m benchmarks.serializers``.
+"""
+
+from argparse import ArgumentParser
+from timeit import Timer
+
+from aioswitcher.api.messages import (
+    SwitcherShutterStateResponse,
+    SwitcherStateResponse,
+    SwitcherThermostatStateResponse,
+)
+from aioswitcher.device import (
+    DeviceState,
+    DeviceType,
+    ShutterDirection,
+    ThermostatFanLevel,
+    ThermostatMode,
+    ThermostatSwing,
+)
+from aioswitcher.schedule import Days
+from aioswitcher.schedule.parser import SwitcherSchedule
+
+from app import webapp
+
+
+def response(cls: type, **attrs: object) -> object:
+    """Use for building a response without parsing an unparsed response."""
+    obj: object = object.__new__(cls)
+    obj.__dict__.update(unparsed_response=b"\x00" * 32, **attrs)
+    return obj
+
+
+OBJECTS = {
+    "state": response(
+        SwitcherStateResponse,
+        state=DeviceState.ON,
+        time_left="00:30:00",
+        time_on="01:12:43",
+        auto_shutdown="02:00:00",
+        power_consumption=2100,
+        electric_current=9.5,
+    ),
+    "breeze_state": response(
+        SwitcherThermostatStateResponse,
+        state=DeviceState.ON,
+        mode=ThermostatMode.COOL,
+        fan_level=ThermostatFanLevel.MEDIUM,
+        temperature=23.5,
+        target_temperature=22,
+        swing=ThermostatSwing.ON,
+        remote_id="DLK65863",
+    ),
+    "shutter_state": response(
+        SwitcherShutterStateResponse,
+        position=50,
+        direction=ShutterDirection.SHUTTER_STOP,
+        device_type=DeviceType.RUNNER,
+        index=0,
+    ),
+    "schedule": SwitcherSchedule(
+        "1", True, {Days.MONDAY, Days.FRIDAY}, "17:00", "18:30"
+    ),
+}
+
+
+def main() -> None:
+    """Use for timing both serializers on every response class."""
+    args_parser = ArgumentParser(description=__doc__.splitlines()[0])
+    args_parser.add_argument("-n", "--number", type=int, default=100000)
+    args = args_parser.parse_args()
+
+    for name, obj in OBJECTS.items():
+        reflective = Timer(lambda: webapp._serialize_reflectively(obj))
+        compiled = Timer(lambda: webapp._serialize_object(obj))
+        before = reflective.timeit(args.number) / args.number
+        after = compiled.timeit(args.number) / args.number
+        print(
+            f"{name:<14} reflective {before * 1e9:>7.0f}ns  "
+            f"compiled {after * 1e9:>7.0f}ns  "
+            f"{before / after:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()